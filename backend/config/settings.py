@@ -94,6 +94,76 @@ DATABASES = {
         'PORT': config('DATABASE_PORT'),
     }
 }
+# Readings storage (PostgreSQL only): monthly range partitions and a BRIN index on timestamp,
+# both applied by devices migration 0008. Keep partitions ahead with `manage.py reading_partitions`.
+READINGS_PARTITIONING = config('READINGS_PARTITIONING', default=True, cast=bool)
+READINGS_BRIN_INDEX = config('READINGS_BRIN_INDEX', default=True, cast=bool)
+
+# Simulator
+# Server processes (and `manage.py run_simulator`) elect one leader that runs the simulator;
+# other commands never start it. Set to False for servers that must not even stand by.
+SIMULATOR_ENABLED = config('SIMULATOR_ENABLED', default=True, cast=bool)
+# The leader renews its lease this often; a standby takes over once it is this old
+SIMULATOR_LEASE_RENEW_SECONDS = config('SIMULATOR_LEASE_RENEW_SECONDS', default=5, cast=int)
+SIMULATOR_LEASE_SECONDS = config('SIMULATOR_LEASE_SECONDS', default=15, cast=int)
+# Split the fleet over this many simulator processes (one lease each, devices placed by consistent
+# hashing); run at least as many candidates, e.g. `manage.py run_simulator --processes N`
+SIMULATOR_SHARDS = config('SIMULATOR_SHARDS', default=1, cast=int)
+# One shared tick generates every reading that has come due across all devices
+SIMULATOR_TICK_SECONDS = config('SIMULATOR_TICK_SECONDS', default=60, cast=int)
+# Readings written per device in a single tick; anything beyond is carried over as backlog
+SIMULATOR_MAX_SLOTS_PER_TICK = config('SIMULATOR_MAX_SLOTS_PER_TICK', default=96, cast=int)
+# Startup gap fill: 'sync' blocks app loading until done, 'background' runs it in a thread, 'off' skips it.
+# With several shards the fill always runs in the background, after one more election round
+SIMULATOR_GAP_FILL_MODE = config('SIMULATOR_GAP_FILL_MODE', default='background')
+SIMULATOR_GAP_FILL_WORKERS = config('SIMULATOR_GAP_FILL_WORKERS', default=4, cast=int)
+# Gap fill and backfill commit every this many slots per device, so an interrupted fill resumes from there
+SIMULATOR_FILL_CHUNK_SLOTS = config('SIMULATOR_FILL_CHUNK_SLOTS', default=2880, cast=int)
+# How often each process checks the shared device-config version for changes made elsewhere
+DEVICE_CONFIG_CHECK_SECONDS = config('DEVICE_CONFIG_CHECK_SECONDS', default=5, cast=float)
+
+# Alarm lifecycle: an alarm clears once readings are back inside the threshold by the
+# hysteresis band, and both raising and clearing need the condition to hold for the debounce
+ALARM_HYSTERESIS_TEMPERATURE = config('ALARM_HYSTERESIS_TEMPERATURE', default=0.5, cast=float)
+ALARM_HYSTERESIS_HUMIDITY = config('ALARM_HYSTERESIS_HUMIDITY', default=1.0, cast=float)
+ALARM_DEBOUNCE_SECONDS = config('ALARM_DEBOUNCE_SECONDS', default=0, cast=float)
+
+# Dashboard counters are kept incrementally and recounted from the source tables this often
+COUNTERS_RECONCILE_SECONDS = config('COUNTERS_RECONCILE_SECONDS', default=3600, cast=int)
+COUNTERS_RECONCILE_CHUNK = config('COUNTERS_RECONCILE_CHUNK', default=100, cast=int)
+
+# Live feed (/api/live/): each stream sends at most one batch per flush interval, and a
+# comment line when idle so proxies keep the connection open
+LIVE_FLUSH_SECONDS = config('LIVE_FLUSH_SECONDS', default=0.5, cast=float)
+LIVE_HEARTBEAT_SECONDS = config('LIVE_HEARTBEAT_SECONDS', default=15, cast=float)
+# Streams hold their connection open: serve them from an ASGI server (config.asgi), where
+# each one is a coroutine. Under WSGI every open stream ties up a worker thread.
+# Relay live events between server processes through PostgreSQL LISTEN/NOTIFY; without it
+# (or on other backends) clients only see events written by the process they are connected to.
+# Off by default: once on, every write sends a NOTIFY whether or not anyone is listening.
+LIVE_RELAY = config('LIVE_RELAY', default=False, cast=bool)
+
+# Batch ingest (/api/readings/ingest/): rows per bulk load and alarm evaluation, largest
+# accepted body, how far ahead of the clock a timestamp may be, and row errors reported
+INGEST_CHUNK_SIZE = config('INGEST_CHUNK_SIZE', default=50000, cast=int)
+INGEST_MAX_BYTES = config('INGEST_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+INGEST_MAX_FUTURE_SECONDS = config('INGEST_MAX_FUTURE_SECONDS', default=300, cast=float)
+INGEST_MAX_ERRORS = config('INGEST_MAX_ERRORS', default=100, cast=int)
+
+# Background report jobs: finished ZIPs are written under REPORTS_DIR
+REPORTS_DIR = config('REPORTS_DIR', default=str(BASE_DIR / 'media' / 'reports'))
+REPORT_WORKERS = config('REPORT_WORKERS', default=2, cast=int)
+# A running job reports progress at least this often; one silent for REPORT_JOB_STALE_SECONDS
+# (its process died) is queued again. Finished jobs' ZIPs are deleted after REPORT_RETENTION_HOURS
+REPORT_JOB_HEARTBEAT_SECONDS = config('REPORT_JOB_HEARTBEAT_SECONDS', default=10, cast=float)
+REPORT_JOB_STALE_SECONDS = config('REPORT_JOB_STALE_SECONDS', default=60, cast=float)
+REPORT_RETENTION_HOURS = config('REPORT_RETENTION_HOURS', default=72, cast=float)
+# Report charts: 'png' embeds rendered images, 'vector' draws the lines as PDF paths
+REPORT_CHART_FORMAT = config('REPORT_CHART_FORMAT', default='png')
+# Rendered single-device reports are cached on disk; 0 disables the cache
+REPORT_CACHE_DIR = config('REPORT_CACHE_DIR', default=str(BASE_DIR / 'media' / 'report-cache'))
+REPORT_CACHE_MAX_BYTES = config('REPORT_CACHE_MAX_BYTES', default=512 * 1024 * 1024, cast=int)
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
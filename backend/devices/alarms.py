@@ -0,0 +1,441 @@
+"""Alarm lifecycle engine for incoming readings.
+
+Every ingest path (API writes, the realtime tick, backfill and gap fill)
+hands its readings to `evaluate_readings` as parallel arrays. Each
+device and reading alarm type runs a small state machine:
+
+- An alarm is raised once its raise condition (beyond the alert threshold)
+  has held for ALARM_DEBOUNCE_SECONDS.
+- It is cleared (`active=False`) once the value has been back inside the
+  threshold by at least the hysteresis band for the same duration.
+- In between, the state doesn't change, so values hovering around the
+  threshold don't flap.
+
+Debounce state lives in process memory. Whether an alarm is open is
+read from the database for every batch, since other processes (API
+workers, other simulator shards, acknowledgements and deletes) raise and
+clear alarms too. The database is written only when an alarm actually
+starts or ends: a raise is one multi-row upsert against the
+`unique_open_alarm` constraint, a clear one UPDATE per alarm type, and an
+excursion that starts and ends inside one batch (as most do in a backfill)
+one already cleared alarm row, all in bulk.
+
+Readings older than a device's last evaluated one (late uploads) replay
+a state machine of their own before the newer rows run. Rewritten
+history (inject) can't be replayed; it raises through
+`raise_from_history` instead.
+"""
+import threading
+from collections import ChainMap
+from datetime import timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from . import counters, live
+from .cache import device_configs
+from .models import Alarm
+
+THRESHOLD_FIELDS = ('alert_temp_min', 'alert_temp_max', 'alert_humidity_min', 'alert_humidity_max')
+
+# Alarm type -> (reading column, threshold field, True when raised above the threshold)
+READING_ALARMS = {
+    'TEMP_HI': ('temperature', 'alert_temp_max', True),
+    'TEMP_LO': ('temperature', 'alert_temp_min', False),
+    'HUM_HI': ('humidity', 'alert_humidity_max', True),
+    'HUM_LO': ('humidity', 'alert_humidity_min', False),
+}
+
+# Rows per INSERT statement, well below the bound-parameter limits of every backend
+UPSERT_BATCH_SIZE = 2000
+
+_NOT_SET = np.iinfo(np.int64).min
+
+
+def _as_datetime64(timestamps):
+    timestamps = np.asarray(timestamps)
+    if timestamps.dtype.kind == 'M':
+        return timestamps.astype('datetime64[us]')
+    return np.array(
+        [np.datetime64(t.astimezone(dt_timezone.utc).replace(tzinfo=None), 'us') for t in timestamps],
+        dtype='datetime64[us]',
+    )
+
+
+def load_thresholds(device_ids, devices=None):
+    """Per-device alarm limits aligned with `device_ids`: a status-on mask plus one array per
+    threshold field, NaN where unset. Uses `devices` when given, else the device config cache.
+    """
+    if devices is None:
+        by_id = device_configs.get_many(device_ids)
+    else:
+        by_id = {device.id: device for device in devices}
+    found = [by_id.get(device_id) for device_id in device_ids]
+    limits = {'on': np.array([device is not None and device.status == 'on' for device in found], dtype=bool)}
+    for field in THRESHOLD_FIELDS:
+        values = [getattr(device, field) if device is not None else None for device in found]
+        limits[field] = np.array([np.nan if value is None else value for value in values], dtype=float)
+    return limits
+
+
+def hysteresis_for(column):
+    if column == 'temperature':
+        return settings.ALARM_HYSTERESIS_TEMPERATURE
+    return settings.ALARM_HYSTERESIS_HUMIDITY
+
+
+class AlarmState:
+    """Lifecycle state of one device's alarm type between batches.
+
+    `raise_since` / `clear_since` hold the start (epoch microseconds) of a raise or clear
+    condition still running at the end of the last batch, for debouncing across batches.
+    """
+    __slots__ = ('active', 'raise_since', 'clear_since')
+
+    def __init__(self, active=False):
+        self.active = active
+        self.raise_since = _NOT_SET
+        self.clear_since = _NOT_SET
+
+
+def _transition(row, state):
+    device_id, alarm_type, value, timestamp = row
+    return device_id, alarm_type, state, value, np.datetime64(timestamp, 'us').item().replace(tzinfo=dt_timezone.utc)
+
+
+def _condition_starts(condition, times, group_of_row, group_starts, carried_since):
+    """Start time of the unbroken run of `condition` each row belongs to.
+
+    A run that begins on a group's first row continues from `carried_since`
+    when the previous batch ended inside the same run.
+    """
+    rows = np.arange(condition.size)
+    first_in_group = np.zeros(condition.size, dtype=bool)
+    first_in_group[group_starts] = True
+    run_begins = condition & (first_in_group | ~np.r_[False, condition[:-1]])
+    begin_row = np.maximum.accumulate(np.where(run_begins, rows, 0))
+    starts = times[begin_row]
+    carried = carried_since[group_of_row]
+    continues = condition & (begin_row == group_starts[group_of_row]) & (carried != _NOT_SET)
+    return np.where(continues, carried, starts)
+
+
+class AlarmStateMachine:
+    """Per-device alarm states for this process, advanced one batch at a time."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states = {}
+        self._seen_until = {}  # device id -> time of its last evaluated reading
+
+    def _refresh(self, device_ids):
+        """Take the active flags of `device_ids` from their open alarms in the database."""
+        active = set(Alarm.objects.filter(
+            device_id__in=device_ids, alarm_type__in=list(READING_ALARMS), active=True,
+        ).values_list('device_id', 'alarm_type'))
+        for device_id in device_ids:
+            self._seen_until.setdefault(device_id, _NOT_SET)
+            for alarm_type in READING_ALARMS:
+                key = (device_id, alarm_type)
+                state = self._states.get(key)
+                if (state.active if state else False) != (key in active):
+                    # Raised, cleared or deleted elsewhere: debounce afresh from here
+                    self._states[key] = AlarmState(active=key in active)
+
+    def forget(self, device_id):
+        with self._lock:
+            self._seen_until.pop(device_id, None)
+            for alarm_type in READING_ALARMS:
+                self._states.pop((device_id, alarm_type), None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+            self._seen_until.clear()
+
+    def advance(self, device_ids, times, columns, limits):
+        """Run a batch ordered by device then time through every alarm type's state machine.
+
+        Every excursion in the batch is recorded: one that both starts and ends inside it
+        is written as an alarm that is already cleared. Rows no newer than a device's last
+        evaluated reading (late or backfilled history) can't continue its state machine;
+        they replay one of their own from a clear state, before the newer rows run, and
+        an excursion still going at their end opens its alarm unless one is open already.
+        Returns (raised, cleared): rows of (device id, alarm type, value, epoch microseconds)
+        for the alarms that start and end, taken from the reading that decided the transition.
+        """
+        with self._lock:
+            self._refresh(np.unique(device_ids).tolist())
+            seen_until = np.array([self._seen_until[device_id] for device_id in device_ids.tolist()], dtype=np.int64)
+            fresh = times > seen_until
+            late_opened, late_closed, overlay = [], [], {}
+            if not fresh.all():
+                late = ~fresh
+                late_opened, late_closed, _, _ = _replay(
+                    device_ids[late], times[late],
+                    {name: values[late] for name, values in columns.items()},
+                    {name: values[late] for name, values in limits.items()},
+                    {},
+                )
+                late_opened = [row for row in late_opened if not getattr(self._states.get(row[:2]), 'active', False)]
+                # The newer rows continue from the alarms the late ones leave open
+                for device_id, alarm_type, _, _ in late_opened:
+                    overlay[(device_id, alarm_type)] = AlarmState(active=True)
+                device_ids, times = device_ids[fresh], times[fresh]
+                columns = {name: values[fresh] for name, values in columns.items()}
+                limits = {name: values[fresh] for name, values in limits.items()}
+
+            opened, closed, cleared, updates = _replay(
+                device_ids, times, columns, limits, ChainMap(overlay, self._states),
+            )
+            closed += late_closed
+            if late_opened or opened or closed or cleared:
+                with transaction.atomic():
+                    upsert_alarms(late_opened)
+                    clear_alarms([(device_id, alarm_type) for device_id, alarm_type, _, _ in cleared])
+                    upsert_alarms(opened)
+                    insert_cleared_alarms([raised for raised, _ in closed])
+                    # An alarm that wasn't active had no open row, so every raise adds one
+                    counters.add_alarms([row[:2] for row in late_opened + opened] + [raised[:2] for raised, _ in closed])
+                    transaction.on_commit(lambda: live.publish_alarms(
+                        [_transition(row, 'raised') for row in late_opened + opened]
+                        + [_transition(row, state) for pair in closed for row, state in zip(pair, ('raised', 'cleared'))]
+                        + [_transition(row, 'cleared') for row in cleared]
+                    ))
+            # Only once the transitions are written, so a failed write is retried by the next batch
+            self._states.update(overlay)
+            self._states.update(updates)
+            if times.size:
+                group_ids, group_ends = np.unique(device_ids[::-1], return_index=True)
+                for device_id, end in zip(group_ids.tolist(), (device_ids.size - 1 - group_ends).tolist()):
+                    self._seen_until[device_id] = int(times[end])
+        raised_rows = late_opened + opened + [raised for raised, _ in closed]
+        return raised_rows, cleared + [ended for _, ended in closed]
+
+    def raise_from(self, rows):
+        """Open (device id, alarm type, value, epoch microseconds) alarms found outside the
+        normal reading flow, e.g. edited history. They clear like any other active alarm.
+        """
+        with self._lock:
+            self._refresh(sorted({row[0] for row in rows}))
+            self._open(rows)
+
+    def _open(self, rows):
+        if not rows:
+            return
+        # Rows for alarms that are already active refresh the open alarm instead of adding one
+        opened = [
+            (device_id, alarm_type) for device_id, alarm_type, _, _ in rows
+            if not getattr(self._states.get((device_id, alarm_type)), 'active', False)
+        ]
+        with transaction.atomic():
+            upsert_alarms(rows)
+            counters.add_alarms(opened)
+            transaction.on_commit(lambda: live.publish_alarms([_transition(row, 'raised') for row in rows]))
+        for device_id, alarm_type, _, _ in rows:
+            state = self._states.get((device_id, alarm_type)) or AlarmState()
+            state.active = True
+            state.clear_since = _NOT_SET
+            self._states[(device_id, alarm_type)] = state
+
+
+def _replay(device_ids, times, columns, limits, states):
+    """Advance the alarm types of rows ordered by device then time from `states`.
+
+    Returns (opened, closed, cleared, updates): rows of the alarms raised and still
+    active at the end, (raised row, cleared row) pairs of the excursions that start and
+    end inside the batch, rows of the alarms active before it that cleared, and the
+    ((device id, alarm type), AlarmState) each device ends the batch in.
+    """
+    opened, closed, cleared, updates = [], [], [], []
+    if not times.size:
+        return opened, closed, cleared, updates
+    debounce = int(settings.ALARM_DEBOUNCE_SECONDS * 1_000_000)
+    group_ids, group_starts, group_of_row = np.unique(device_ids, return_index=True, return_inverse=True)
+    group_ends = np.r_[group_starts[1:], device_ids.size] - 1
+    group_ids = group_ids.tolist()
+    rows = np.arange(device_ids.size)
+
+    for alarm_type, (column, field, above) in READING_ALARMS.items():
+        values = columns[column]
+        threshold = limits[field]
+        band = hysteresis_for(column)
+        # NaN thresholds compare false: an unset limit never raises and always clears
+        with np.errstate(invalid='ignore'):
+            if above:
+                raise_condition = values > threshold
+                clear_condition = ~(values > threshold - band)
+            else:
+                raise_condition = values < threshold
+                clear_condition = ~(values < threshold + band)
+
+        group_states = [states.get((device_id, alarm_type)) for device_id in group_ids]
+        was_active = np.array([state is not None and state.active for state in group_states], dtype=bool)
+        raise_since = np.array([state.raise_since if state else _NOT_SET for state in group_states], dtype=np.int64)
+        clear_since = np.array([state.clear_since if state else _NOT_SET for state in group_states], dtype=np.int64)
+
+        raise_starts = _condition_starts(raise_condition, times, group_of_row, group_starts, raise_since)
+        clear_starts = _condition_starts(clear_condition, times, group_of_row, group_starts, clear_since)
+        raises = raise_condition & (times - raise_starts >= debounce)
+        clears = clear_condition & (times - clear_starts >= debounce)
+
+        # Each raise or clear event leaves the alarm active or not; it's a transition where that
+        # differs from the event before it, or from the state the device started the batch in
+        events = rows[raises | clears]
+        after = raises[events]
+        event_groups = group_of_row[events]
+        first_event = np.r_[True, event_groups[1:] != event_groups[:-1]]
+        before = np.where(first_event, was_active[event_groups], np.r_[False, after[:-1]])
+        pending = {}
+        for row in events[after != before].tolist():
+            device_id = group_ids[group_of_row[row]]
+            transition = (device_id, alarm_type, float(values[row]), int(times[row]))
+            if raises[row]:
+                pending[device_id] = transition
+            elif device_id in pending:
+                closed.append((pending.pop(device_id), transition))
+            else:
+                cleared.append(transition)
+        opened.extend(pending.values())
+
+        last_event = np.maximum.reduceat(np.where(raises | clears, rows, -1), group_starts)
+        is_active = np.where(last_event >= 0, raises[np.maximum(last_event, 0)], was_active)
+        for index, device_id in enumerate(group_ids):
+            end = group_ends[index]
+            state = AlarmState(bool(is_active[index]))
+            if raise_condition[end]:
+                state.raise_since = int(raise_starts[end])
+            if clear_condition[end]:
+                state.clear_since = int(clear_starts[end])
+            updates.append(((device_id, alarm_type), state))
+    return opened, closed, cleared, updates
+
+
+def _latest_hits(device_ids, times, columns, limits):
+    """(device id, alarm type, value, epoch microseconds) of each device's latest reading
+    beyond each threshold, for rows ordered by device then time with per-row limits.
+    """
+    if not device_ids.size:
+        return []
+    _, group_starts = np.unique(device_ids, return_index=True)
+    rows = np.arange(device_ids.size)
+    hits_found = []
+    for alarm_type, (column, field, above) in READING_ALARMS.items():
+        values = columns[column]
+        threshold = limits[field]
+        with np.errstate(invalid='ignore'):
+            hits = (values > threshold) if above else (values < threshold)
+        last_hit = np.maximum.reduceat(np.where(hits, rows, -1), group_starts)
+        for row in last_hit[last_hit >= 0].tolist():
+            hits_found.append((int(device_ids[row]), alarm_type, float(values[row]), int(times[row])))
+    return hits_found
+
+
+alarm_states = AlarmStateMachine()
+
+
+def evaluate_readings(device_ids, timestamps, temperatures, humidities, devices=None):
+    """Advance alarm state with a batch of readings. Returns the number of alarms raised or cleared.
+
+    `device_ids` may be a single id for a one-device batch. Timestamps may be
+    aware datetimes or UTC `datetime64` values, in any order. Readings of
+    devices that are off are ignored.
+    """
+    timestamps = _as_datetime64(timestamps)
+    if not timestamps.size:
+        return 0
+    device_ids = np.broadcast_to(np.asarray(device_ids, dtype=np.int64), timestamps.shape)
+    temperatures = np.asarray(temperatures, dtype=float)
+    humidities = np.asarray(humidities, dtype=float)
+
+    order = np.lexsort((timestamps, device_ids))
+    device_ids, timestamps = device_ids[order], timestamps[order]
+    temperatures, humidities = temperatures[order], humidities[order]
+
+    unique_ids, inverse = np.unique(device_ids, return_inverse=True)
+    limits = {name: values[inverse] for name, values in load_thresholds(unique_ids.tolist(), devices).items()}
+    on = limits.pop('on')
+    if not on.any():
+        return 0
+    limits = {name: values[on] for name, values in limits.items()}
+    raised, cleared = alarm_states.advance(
+        device_ids[on], timestamps[on].astype(np.int64),
+        {'temperature': temperatures[on], 'humidity': humidities[on]}, limits,
+    )
+    return len(raised) + len(cleared)
+
+
+def raise_from_history(device_ids, timestamps, temperatures, humidities):
+    """Raise an alarm for each device and type with a reading beyond its threshold, from its
+    latest such reading, whatever the readings' age. Used after history is rewritten
+    in place, which the state machine can't replay.
+    Returns the number of alarms raised or refreshed.
+    """
+    timestamps = _as_datetime64(timestamps)
+    if not timestamps.size:
+        return 0
+    device_ids = np.asarray(device_ids, dtype=np.int64)
+    order = np.lexsort((timestamps, device_ids))
+    device_ids, times = device_ids[order], timestamps[order].astype(np.int64)
+    columns = {
+        'temperature': np.asarray(temperatures, dtype=float)[order],
+        'humidity': np.asarray(humidities, dtype=float)[order],
+    }
+    unique_ids, inverse = np.unique(device_ids, return_inverse=True)
+    limits = {name: values[inverse] for name, values in load_thresholds(unique_ids.tolist()).items()}
+    on = limits.pop('on')
+    raised = _latest_hits(
+        device_ids[on], times[on],
+        {name: values[on] for name, values in columns.items()},
+        {name: values[on] for name, values in limits.items()},
+    )
+    if raised:
+        alarm_states.raise_from(raised)
+    return len(raised)
+
+
+def _upsert_sql(row_count):
+    quote = connection.ops.quote_name
+    table = quote(Alarm._meta.db_table)
+    columns = ('device_id', 'alarm_type', 'triggered_value', 'timestamp', 'acknowledged', 'active')
+    values = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * row_count)
+    # The conflict target repeats the predicate of the unique_open_alarm partial index
+    return (
+        f"INSERT INTO {table} ({', '.join(quote(c) for c in columns)}) VALUES {values} "
+        f"ON CONFLICT ({quote('device_id')}, {quote('alarm_type')}) "
+        f"WHERE NOT {quote('acknowledged')} AND {quote('active')} DO UPDATE SET "
+        f"{quote('triggered_value')} = EXCLUDED.{quote('triggered_value')}, "
+        f"{quote('timestamp')} = EXCLUDED.{quote('timestamp')}"
+    )
+
+
+def upsert_alarms(rows):
+    """Write (device id, alarm type, value, epoch microseconds) rows as open alarms."""
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[offset:offset + UPSERT_BATCH_SIZE]
+            params = []
+            for device_id, alarm_type, value, timestamp in batch:
+                moment = np.datetime64(timestamp, 'us').item().replace(tzinfo=dt_timezone.utc)
+                params.extend((device_id, alarm_type, value, adapt(moment), False, True))
+            cursor.execute(_upsert_sql(len(batch)), params)
+
+
+def insert_cleared_alarms(rows):
+    """Write (device id, alarm type, value, epoch microseconds) rows as alarms that already cleared."""
+    Alarm.objects.bulk_create([
+        Alarm(
+            device_id=device_id, alarm_type=alarm_type, triggered_value=value, active=False,
+            timestamp=np.datetime64(timestamp, 'us').item().replace(tzinfo=dt_timezone.utc),
+        )
+        for device_id, alarm_type, value, timestamp in rows
+    ], batch_size=UPSERT_BATCH_SIZE)
+
+
+def clear_alarms(pairs):
+    """Mark the active alarms of (device id, alarm type) pairs inactive, one UPDATE per type."""
+    by_type = {}
+    for device_id, alarm_type in pairs:
+        by_type.setdefault(alarm_type, []).append(device_id)
+    for alarm_type, device_ids in by_type.items():
+        Alarm.objects.filter(device_id__in=device_ids, alarm_type=alarm_type, active=True).update(active=False)
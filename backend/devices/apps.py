@@ -6,7 +6,16 @@ class DevicesConfig(AppConfig):
     name = 'devices'
     def ready(self):
         import devices.signals
-        print("App ready - starting scheduler")  
+        from django.conf import settings
         from . import simulator
+        from .reports import jobs
+        # migrate, shell, tests, other commands and report workers must never generate readings or run jobs
+        if not simulator.is_server_process() or jobs.is_worker_process():
+            return
+        # Picks up jobs queued, or left running by a process that died, before this one started
+        jobs.ensure_dispatcher()
+        if not settings.SIMULATOR_ENABLED:
+            return
+        print("App ready - starting scheduler")  
         simulator.start()
         
@@ -0,0 +1,217 @@
+import threading
+import time
+from datetime import timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+
+class LastReadingCache:
+    """Latest reading timestamp per device id, kept in process memory.
+
+    Warmed once with a single grouped query and then updated by every write
+    path, so the realtime simulation never has to look at the readings table.
+    `None` marks a device that is known to have no readings yet.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._warmed = False
+
+    def _load(self, device_ids=None):
+        from .models import Reading  # Local import to avoid circular dependency
+
+        readings = Reading.objects.all()
+        if device_ids is not None:
+            readings = readings.filter(device_id__in=device_ids)
+        return dict(readings.values('device_id').annotate(last=Max('timestamp')).values_list('device_id', 'last'))
+
+    def warm(self):
+        entries = self._load()
+        with self._lock:
+            for device_id, timestamp in entries.items():
+                self._store(device_id, timestamp)
+            self._warmed = True
+
+    def get_many(self, device_ids):
+        """Last timestamps for `device_ids`; unknown ids are looked up together in one query."""
+        if not self._warmed:
+            self.warm()
+        with self._lock:
+            missing = [device_id for device_id in device_ids if device_id not in self._entries]
+        if missing:
+            loaded = self._load(missing)
+            with self._lock:
+                for device_id in missing:
+                    self._store(device_id, loaded.get(device_id))
+        with self._lock:
+            return {device_id: self._entries.get(device_id) for device_id in device_ids}
+
+    def get(self, device_id):
+        return self.get_many([device_id])[device_id]
+
+    def _store(self, device_id, timestamp):
+        current = self._entries.get(device_id)
+        if current is None or (timestamp is not None and timestamp > current):
+            self._entries[device_id] = timestamp
+
+    def record(self, device_id, timestamp):
+        with self._lock:
+            self._store(device_id, timestamp)
+
+    def record_batch(self, device_ids, timestamps):
+        """Record a written batch given as parallel arrays of ids and UTC `datetime64` values."""
+        device_ids = np.asarray(device_ids)
+        if not device_ids.size:
+            return
+        timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+        order = np.lexsort((timestamps, device_ids))
+        # The last row of every device run is that device's newest timestamp
+        last_rows = order[np.r_[device_ids[order][1:] != device_ids[order][:-1], True]]
+        with self._lock:
+            for device_id, timestamp in zip(device_ids[last_rows].tolist(), timestamps[last_rows].tolist()):
+                self._store(device_id, timestamp.replace(tzinfo=dt_timezone.utc))
+
+    def invalidate(self, device_id):
+        with self._lock:
+            self._entries.pop(device_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._warmed = False
+
+
+last_readings = LastReadingCache()
+
+
+# Device fields read on hot paths: simulation, alarm evaluation and report summaries
+DEVICE_CONFIG_FIELDS = (
+    'id', 'number', 'code', 'status', 'status_changed_at', 'started_at', 'logging_interval_minutes',
+    'temperature_min', 'temperature_max', 'humidity_min', 'humidity_max',
+    'alert_temp_min', 'alert_temp_max', 'alert_humidity_min', 'alert_humidity_max',
+)
+DEVICE_CONFIG_VERSION = 'devices'
+
+
+class DeviceConfig:
+    """Read-only snapshot of one device's configuration, attribute-compatible with `Device`."""
+    __slots__ = DEVICE_CONFIG_FIELDS
+
+    def __init__(self, values):
+        for field, value in zip(DEVICE_CONFIG_FIELDS, values):
+            setattr(self, field, value)
+
+    @classmethod
+    def from_device(cls, device):
+        return cls([getattr(device, field) for field in DEVICE_CONFIG_FIELDS])
+
+    def __repr__(self):
+        return f"<DeviceConfig {self.id} {self.code}>"
+
+
+def bump_version(name=DEVICE_CONFIG_VERSION):
+    """Increment a ConfigVersion counter and return its new value."""
+    from .models import ConfigVersion  # Local import to avoid circular dependency
+
+    table = connection.ops.quote_name(ConfigVersion._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"UPDATE {table} SET version = version + 1 WHERE name = %s RETURNING version", [name])
+        row = cursor.fetchone()
+    if row is None:
+        ConfigVersion.objects.get_or_create(name=name, defaults={'version': 1})
+        return None
+    return row[0]
+
+
+class DeviceConfigCache:
+    """Every device's configuration, kept in process memory.
+
+    Changes made in this process are applied directly by the Device signals.
+    Changes made elsewhere are noticed through the 'devices' ConfigVersion
+    counter: at most every DEVICE_CONFIG_CHECK_SECONDS the counter is read,
+    and only when it has moved is the (small) device table reloaded.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._codes = {}
+        self._version = None
+        self._checked_at = None
+
+    def _read_version(self):
+        from .models import ConfigVersion  # Local import to avoid circular dependency
+
+        return ConfigVersion.objects.filter(name=DEVICE_CONFIG_VERSION).values_list('version', flat=True).first()
+
+    def _reload(self, version):
+        from .models import Device  # Local import to avoid circular dependency
+
+        entries = {row[0]: DeviceConfig(row) for row in Device.objects.values_list(*DEVICE_CONFIG_FIELDS)}
+        with self._lock:
+            self._entries = entries
+            self._codes = {config.code: device_id for device_id, config in entries.items()}
+            self._version = version
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < settings.DEVICE_CONFIG_CHECK_SECONDS:
+            return
+        version = self._read_version()
+        self._checked_at = now
+        if self._version is None or version != self._version:
+            self._reload(version)
+
+    def all(self):
+        self._ensure_fresh()
+        with self._lock:
+            return sorted(self._entries.values(), key=lambda config: config.id)
+
+    def get_many(self, device_ids):
+        """id -> DeviceConfig for `device_ids`; ids of unknown devices are left out."""
+        self._ensure_fresh()
+        with self._lock:
+            return {device_id: self._entries[device_id] for device_id in device_ids if device_id in self._entries}
+
+    def get(self, device_id):
+        return self.get_many([device_id]).get(device_id)
+
+    def ids_by_code(self, codes):
+        """code -> device id for `codes`; unknown codes are left out."""
+        self._ensure_fresh()
+        with self._lock:
+            return {code: self._codes[code] for code in codes if code in self._codes}
+
+    def _applied(self, version):
+        # Our own bump is the only change since the last load: stay current without reloading
+        if version is not None and self._version is not None and version == self._version + 1:
+            self._version = version
+
+    def update(self, device, version=None):
+        with self._lock:
+            previous = self._entries.get(device.id)
+            if previous is not None:
+                self._codes.pop(previous.code, None)
+            self._entries[device.id] = DeviceConfig.from_device(device)
+            self._codes[device.code] = device.id
+            self._applied(version)
+
+    def remove(self, device_id, version=None):
+        with self._lock:
+            previous = self._entries.pop(device_id, None)
+            if previous is not None:
+                self._codes.pop(previous.code, None)
+            self._applied(version)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._codes = {}
+            self._version = None
+            self._checked_at = None
+
+
+device_configs = DeviceConfigCache()
@@ -0,0 +1,149 @@
+"""Materialized dashboard counters.
+
+Counting the readings table (or every unacknowledged alarm) on each
+dashboard load costs a full scan. Instead every write path adds its deltas
+to small per-device StatCounter rows in the same transaction as the write,
+and the dashboard sums those rows. A periodic `reconcile` recounts from
+the source tables to repair any drift (partitions dropped by retention,
+rows changed outside the application).
+
+On PostgreSQL `approximate_reading_count` reads the planner's estimate from
+`pg_class.reltuples` instead, which costs nothing but is only as fresh as
+the last ANALYZE.
+"""
+from collections import Counter
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from .models import Alarm, Device, Reading, StatCounter
+
+READINGS = 'readings'
+ALARM_PREFIX = 'alarms:'
+
+# Rows per upsert statement
+UPSERT_BATCH_SIZE = 2000
+
+
+def alarm_counter(alarm_type):
+    return f"{ALARM_PREFIX}{alarm_type}"
+
+
+def _upsert_sql(row_count):
+    quote = connection.ops.quote_name
+    table = quote(StatCounter._meta.db_table)
+    values = ', '.join(['(%s, %s, %s)'] * row_count)
+    return (
+        f"INSERT INTO {table} ({quote('device_id')}, {quote('name')}, {quote('value')}) VALUES {values} "
+        f"ON CONFLICT ({quote('device_id')}, {quote('name')}) "
+        f"DO UPDATE SET {quote('value')} = {table}.{quote('value')} + EXCLUDED.{quote('value')}"
+    )
+
+
+def add(deltas):
+    """Add {(device id, counter name): delta} to the stored counters."""
+    # A fixed row order keeps concurrent writers from deadlocking on each other's rows
+    rows = sorted((key, delta) for key, delta in deltas.items() if delta)
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        for offset in range(0, len(rows), UPSERT_BATCH_SIZE):
+            batch = rows[offset:offset + UPSERT_BATCH_SIZE]
+            params = [value for (device_id, name), delta in batch for value in (device_id, name, delta)]
+            cursor.execute(_upsert_sql(len(batch)), params)
+
+
+def add_readings(device_ids, sign=1):
+    """Count a batch of written (or, with sign=-1, deleted) readings given by their device ids."""
+    ids, counts = np.unique(np.asarray(device_ids, dtype=np.int64), return_counts=True)
+    add({(device_id, READINGS): sign * count for device_id, count in zip(ids.tolist(), counts.tolist())})
+
+
+def add_alarms(pairs, sign=1):
+    """Count (device id, alarm type) pairs of alarms that became (or stopped being) unacknowledged."""
+    add({(device_id, alarm_counter(alarm_type)): sign * count for (device_id, alarm_type), count in Counter(pairs).items()})
+
+
+def _recount(device_ids):
+    """{(device id, counter name): value} counted from the readings and alarms tables."""
+    readings = (
+        Reading.objects.filter(device_id__in=device_ids)
+        .values('device_id').annotate(total=Count('id')).order_by()
+        .values_list('device_id', 'total')
+    )
+    alarms = (
+        Alarm.objects.filter(device_id__in=device_ids, acknowledged=False)
+        .values('device_id', 'alarm_type').annotate(total=Count('id')).order_by()
+        .values_list('device_id', 'alarm_type', 'total')
+    )
+    counted = {(device_id, READINGS): total for device_id, total in readings}
+    counted.update({(device_id, alarm_counter(alarm_type)): total for device_id, alarm_type, total in alarms})
+    return counted
+
+
+def _drift(device_ids):
+    """{(device id, counter name): delta} that takes the stored counters to the recount.
+
+    Counts and counters are read in one snapshot, where every write path's rows and
+    counter deltas are either both visible or both not, without locking anything.
+    """
+    # The isolation level can only be set by the statement that starts the transaction
+    outermost = not connection.in_atomic_block
+    with transaction.atomic():
+        if connection.vendor == 'postgresql' and outermost:
+            with connection.cursor() as cursor:
+                cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        counted = _recount(device_ids)
+        stored = {
+            (device_id, name): value
+            for device_id, name, value in StatCounter.objects.filter(device_id__in=device_ids)
+            .values_list('device_id', 'name', 'value')
+        }
+    return {key: counted.get(key, 0) - stored.get(key, 0) for key in counted.keys() | stored.keys()}
+
+
+def reconcile(chunk_size=None):
+    """Recount every device's counters from the readings and alarms tables.
+
+    Each chunk of devices is counted in a read-only snapshot, and only the drift is
+    then added to the counters, like any other write path's delta. Increments made
+    meanwhile are kept, and writers never wait on the scans. Returns the number of
+    devices recounted.
+    """
+    chunk_size = chunk_size or settings.COUNTERS_RECONCILE_CHUNK
+    device_ids = list(Device.objects.order_by('id').values_list('id', flat=True))
+    for offset in range(0, len(device_ids), chunk_size):
+        add(_drift(device_ids[offset:offset + chunk_size]))
+    return len(device_ids)
+
+
+def approximate_reading_count():
+    """Planner estimate of the readings row count (summed over partitions), or None off PostgreSQL."""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        # reltuples is -1 for tables that were never analyzed
+        cursor.execute(
+            "SELECT COALESCE(SUM(GREATEST(reltuples, 0)), 0) FROM pg_class WHERE oid = to_regclass(%s) "
+            "OR oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+            [Reading._meta.db_table, Reading._meta.db_table],
+        )
+        return int(cursor.fetchone()[0])
+
+
+def totals():
+    """Total readings, total unacknowledged alarms and unacknowledged alarms per type."""
+    sums = dict(StatCounter.objects.values('name').annotate(total=Sum('value')).order_by().values_list('name', 'total'))
+    by_alarm_type = {
+        name[len(ALARM_PREFIX):]: total for name, total in sums.items() if name.startswith(ALARM_PREFIX) and total
+    }
+    return sums.get(READINGS, 0), sum(by_alarm_type.values()), by_alarm_type
+
+
+def by_device():
+    """device id -> {'readings': n, 'alarms': n} from the stored counters."""
+    breakdown = {}
+    for device_id, name, value in StatCounter.objects.values_list('device_id', 'name', 'value'):
+        entry = breakdown.setdefault(device_id, {'readings': 0, 'alarms': 0})
+        entry['readings' if name == READINGS else 'alarms'] += value
+    return breakdown
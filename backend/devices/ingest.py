@@ -0,0 +1,306 @@
+"""Batch ingest of readings pushed by gateways or uploaded as CSV exports.
+
+A payload (JSON array, NDJSON or CSV) is turned into four columns, checked
+with array operations and written through the simulator's bulk loader:
+COPY on PostgreSQL, chunked INSERTs elsewhere, with rollups, counters, the
+last-reading cache and the live feed updated along the way. Alarms are
+evaluated once per chunk of INGEST_CHUNK_SIZE rows. Rows that fail a check
+are reported back by position and the rest are loaded. Readings for a
+(device, timestamp) slot that already has one are counted as duplicates and
+left alone, so a gateway can safely resend a batch it isn't sure arrived.
+
+Devices are given by code or id and resolved through the device config
+cache. Timestamps are ISO 8601 strings (naive ones are in the current time
+zone) or epoch seconds, as numbers or digit strings.
+"""
+import csv
+import io
+import json
+import re
+import warnings
+from datetime import datetime, timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+from .alarms import evaluate_readings
+from .cache import device_configs
+from .simulation import bulk_load_readings
+
+COLUMNS = ('device', 'timestamp', 'temperature', 'humidity')
+
+# Lower-cased header/key prefix -> column; covers Govee exports such as
+# "Timestamp for sample frequency every 1 min", "Temperature_Celsius" and "Relative_Humidity"
+COLUMN_PREFIXES = (
+    ('device', 'device'),
+    ('code', 'device'),
+    ('time', 'timestamp'),
+    ('date', 'timestamp'),
+    ('temp', 'temperature'),
+    ('humid', 'humidity'),
+    ('relative_humid', 'humidity'),
+)
+
+TEMPERATURE_RANGE = (-100.0, 150.0)
+HUMIDITY_RANGE = (0.0, 100.0)
+
+# Row checks in reporting order; the first one a row fails is the error given for it
+_ERRORS = (
+    'unknown device',
+    'invalid timestamp',
+    'timestamp is in the future',
+    'invalid temperature',
+    'temperature out of range',
+    'invalid humidity',
+    'humidity out of range',
+)
+
+# Epoch seconds given as text, e.g. "1700000000" or "1700000000.5" in a CSV column
+_NUMBER = re.compile(r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*')
+
+# Range of datetime64 values that convert to Python datetimes (and so can be localized)
+_EARLIEST = np.datetime64('0001-01-02', 'us')
+_LATEST = np.datetime64('9999-12-30', 'us')
+
+JSON_TYPES = ('application/json',)
+NDJSON_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+CSV_TYPES = ('text/csv', 'application/csv', 'text/plain')
+
+
+class IngestError(ValueError):
+    """The payload as a whole can't be read."""
+
+
+def _column_for(name):
+    name = str(name).strip().lower()
+    for prefix, column in COLUMN_PREFIXES:
+        if name.startswith(prefix):
+            return column
+    return None
+
+
+def _map_keys(names):
+    """column -> index/key of the first name that maps to it, plus whether temperatures are Fahrenheit."""
+    mapping = {}
+    fahrenheit = False
+    for name in names:
+        column = _column_for(name)
+        if column and column not in mapping:
+            mapping[column] = name
+            fahrenheit |= column == 'temperature' and 'fahrenheit' in str(name).lower()
+    return mapping, fahrenheit
+
+
+def _from_records(records, device):
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        raise IngestError("Expected a list of reading objects")
+    if not records:
+        return {column: [] for column in COLUMNS}, False
+    mapping, fahrenheit = _map_keys(records[0])
+    columns = {column: [record.get(key) for record in records] for column, key in mapping.items()}
+    return _complete(columns, len(records), device), fahrenheit
+
+
+def _from_csv(text, device):
+    rows = [row for row in csv.reader(io.StringIO(text)) if row]
+    if not rows:
+        raise IngestError("The CSV file is empty")
+    mapping, fahrenheit = _map_keys(rows[0])
+    header = rows[0]
+    rows = rows[1:]
+    width = len(header)
+    rows = [row if len(row) >= width else row + [''] * (width - len(row)) for row in rows]
+    values = list(zip(*rows)) if rows else [()] * width
+    columns = {column: list(values[header.index(name)]) for column, name in mapping.items()}
+    return _complete(columns, len(rows), device), fahrenheit
+
+
+def _complete(columns, count, device):
+    if 'device' not in columns:
+        if device is None:
+            raise IngestError("No device column; pass ?device=<code or id>")
+        columns['device'] = [device] * count
+    missing = [column for column in COLUMNS if column not in columns]
+    if missing:
+        raise IngestError(f"Missing column(s): {', '.join(missing)}")
+    return columns
+
+
+def parse_payload(data, content_type, device=None):
+    """Columns (device, timestamp, temperature, humidity) of a raw JSON array, NDJSON or CSV body.
+
+    `device` stands in for a missing device column, e.g. a single-sensor CSV export.
+    Temperatures from a Fahrenheit column are converted to Celsius.
+    """
+    kind = (content_type or '').split(';')[0].strip().lower()
+    try:
+        text = data.decode('utf-8-sig') if isinstance(data, bytes) else data
+        if kind in JSON_TYPES:
+            columns, fahrenheit = _from_records(json.loads(text), device)
+        elif kind in NDJSON_TYPES:
+            columns, fahrenheit = _from_records([json.loads(line) for line in text.splitlines() if line.strip()], device)
+        elif kind in CSV_TYPES:
+            columns, fahrenheit = _from_csv(text, device)
+        else:
+            raise IngestError("Send application/json, application/x-ndjson or text/csv")
+    except (UnicodeDecodeError, json.JSONDecodeError, csv.Error) as exc:
+        raise IngestError(f"Unreadable payload: {exc}") from exc
+    if fahrenheit:
+        columns['temperature'] = (_floats(columns['temperature']) - 32) * 5 / 9
+    return columns
+
+
+def _floats(values):
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        result = np.full(len(values), np.nan)
+        for index, value in enumerate(values):
+            try:
+                result[index] = float(value)
+            except (TypeError, ValueError):
+                pass
+        return result
+
+
+def resolve_devices(values):
+    """Device id per value (-1 when unknown). A value matching a device code wins over one matching an id."""
+    tokens = np.asarray(values, dtype=object).astype(str)
+    unique, inverse = np.unique(np.char.strip(tokens), return_inverse=True)
+    unique = unique.tolist()
+    by_code = device_configs.ids_by_code(unique)
+    known_ids = device_configs.get_many([int(token) for token in unique if token.isdigit()])
+    ids = np.array([
+        by_code.get(token, int(token) if token.isdigit() and int(token) in known_ids else -1)
+        for token in unique
+    ], dtype=np.int64)
+    return ids[inverse.reshape(-1)]
+
+
+def _local_to_utc(naive, tz):
+    """UTC for naive wall-clock datetime64 values in `tz`, with the offset looked up once per distinct hour."""
+    result = np.full(naive.shape, np.datetime64('NaT'), dtype='datetime64[us]')
+    known = ~np.isnat(naive)
+    if not known.any():
+        return result
+    hours, inverse = np.unique(naive[known].astype('datetime64[h]'), return_inverse=True)
+    offsets = np.array([tz.utcoffset(hour.item()) // timedelta(microseconds=1) for hour in hours], dtype=np.int64)
+    result[known] = naive[known] - offsets[inverse].astype('timedelta64[us]')
+    return result
+
+
+def _is_number(value):
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, (int, float)) or (isinstance(value, str) and _NUMBER.fullmatch(value) is not None)
+
+
+def _from_epoch_seconds(values):
+    micros = np.asarray([float(value) for value in values], dtype=float) * 1e6
+    with np.errstate(invalid='ignore'):
+        valid = (
+            np.isfinite(micros)
+            & (micros >= _EARLIEST.astype(np.int64)) & (micros <= _LATEST.astype(np.int64))
+        )
+    result = np.full(micros.shape, np.datetime64('NaT'), dtype='datetime64[us]')
+    result[valid] = micros[valid].astype(np.int64).astype('datetime64[us]')
+    return result
+
+
+def parse_timestamps(values, tz=None):
+    """UTC datetime64[us] per value, NaT where unparseable.
+
+    Plain ISO strings and all-numeric epoch seconds (numbers or digit strings)
+    are converted in one NumPy call; strings with a UTC offset, dates outside
+    years 1-9999 or mixed input take the per-value path.
+    """
+    tz = tz or timezone.get_current_timezone()
+    values = list(values)
+    numeric = [_is_number(value) for value in values]
+    if values and all(numeric):
+        return _from_epoch_seconds(values)
+    try:
+        if any(numeric):
+            raise ValueError("NumPy would read numbers as microseconds or years")
+        with warnings.catch_warnings():
+            # NumPy only warns about offsets it would silently drop; treat that as "take the slow path"
+            warnings.simplefilter('error')
+            naive = np.array(values, dtype='datetime64[us]')
+        known = naive[~np.isnat(naive)]
+        # Out of range for Python datetimes, or a digit string NumPy read as a year
+        if not ((known < _EARLIEST) | (known > _LATEST)).any():
+            return _local_to_utc(naive, tz)
+    except (TypeError, ValueError, Warning):
+        pass
+
+    parsed = []
+    for value in values:
+        try:
+            if _is_number(value):
+                moment = datetime.fromtimestamp(float(value), dt_timezone.utc)
+            else:
+                moment = datetime.fromisoformat(str(value).strip())
+                if timezone.is_naive(moment):
+                    moment = timezone.make_aware(moment, tz)
+            parsed.append(np.datetime64(moment.astimezone(dt_timezone.utc).replace(tzinfo=None), 'us'))
+        except (TypeError, ValueError, OverflowError, OSError):
+            parsed.append(np.datetime64('NaT'))
+    return np.array(parsed, dtype='datetime64[us]')
+
+
+def validate(columns):
+    """Resolve and check the columns. Returns (device ids, timestamps, temperatures, humidities, error index)
+    where the error index is -1 for valid rows and otherwise points into `_ERRORS`.
+    """
+    device_ids = resolve_devices(columns['device'])
+    timestamps = parse_timestamps(columns['timestamp'])
+    temperatures = _floats(columns['temperature'])
+    humidities = _floats(columns['humidity'])
+
+    latest = np.datetime64(timezone.now().astimezone(dt_timezone.utc).replace(tzinfo=None), 'us')
+    latest += np.timedelta64(int(settings.INGEST_MAX_FUTURE_SECONDS * 1_000_000), 'us')
+    with np.errstate(invalid='ignore'):
+        failures = np.array([
+            device_ids < 0,
+            np.isnat(timestamps),
+            timestamps > latest,
+            ~np.isfinite(temperatures),
+            (temperatures < TEMPERATURE_RANGE[0]) | (temperatures > TEMPERATURE_RANGE[1]),
+            ~np.isfinite(humidities),
+            (humidities < HUMIDITY_RANGE[0]) | (humidities > HUMIDITY_RANGE[1]),
+        ])
+    errors = np.where(failures.any(axis=0), failures.argmax(axis=0), -1)
+    return device_ids, timestamps, temperatures, humidities, errors
+
+
+def ingest(columns):
+    """Validate and load a parsed batch. Returns a summary with up to INGEST_MAX_ERRORS row errors.
+
+    Error rows are numbered from 1 in payload order (the CSV header doesn't count).
+    """
+    device_ids, timestamps, temperatures, humidities, errors = validate(columns)
+    valid = errors < 0
+    # Timestamp order keeps the loaded rows close to how the readings table is laid out
+    order = np.flatnonzero(valid)[np.lexsort((device_ids[valid], timestamps[valid]))]
+    device_ids, timestamps = device_ids[order], timestamps[order]
+    temperatures, humidities = temperatures[order], humidities[order]
+
+    created = 0
+    chunk_size = settings.INGEST_CHUNK_SIZE
+    for offset in range(0, order.size, chunk_size):
+        chunk = slice(offset, offset + chunk_size)
+        inserted = bulk_load_readings(device_ids[chunk], timestamps[chunk], temperatures[chunk], humidities[chunk])
+        created += len(inserted[1])
+        # Rows that were already stored have had their alarms evaluated
+        evaluate_readings(*inserted)
+
+    rejected = np.flatnonzero(~valid)
+    return {
+        'received': int(valid.size),
+        'created': created,
+        'duplicates': int(order.size) - created,
+        'rejected': int(rejected.size),
+        'errors': [
+            {'row': row + 1, 'error': _ERRORS[errors[row]]}
+            for row in rejected[:settings.INGEST_MAX_ERRORS].tolist()
+        ],
+    }
@@ -0,0 +1,75 @@
+"""Leader election over lease rows, so only one process runs the simulator (or each shard of it).
+
+Every candidate process tries to take or renew the lease every
+SIMULATOR_LEASE_RENEW_SECONDS with one conditional UPDATE: the holder
+extends it to now + SIMULATOR_LEASE_SECONDS, anyone else only succeeds once
+it has expired. A leader that dies is therefore replaced within a lease
+length. Expiry is compared against the database clock, so hosts with
+skewed clocks can't steal a live lease.
+
+A leader that can't renew (database unreachable, process stalled) counts
+itself as leader only until its own lease would have run out, measured
+from before its last successful renewal, so it steps down no later than a
+standby can take over. Writes are idempotent per (device, timestamp)
+slot, so even an overlap at the handover can't duplicate readings.
+"""
+import os
+import socket
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Now
+from .models import Lease
+
+
+# Identifies this process in every lease it holds
+PROCESS_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def held_leases(names):
+    """The subset of lease `names` that some process currently holds."""
+    return set(Lease.objects.filter(name__in=names, expires_at__gte=Now()).values_list('name', flat=True))
+
+
+class LeaderLease:
+    def __init__(self, name):
+        self.name = name
+        self.holder = PROCESS_ID
+        self._valid_until = None  # time.monotonic() deadline of the lease we last secured
+
+    @property
+    def held(self):
+        return self._valid_until is not None and time.monotonic() < self._valid_until
+
+    def acquire(self):
+        """Take or renew the lease. Returns whether this process holds it now.
+
+        Database errors propagate; `held` keeps answering from the last renewal.
+        """
+        started = time.monotonic()
+        length = settings.SIMULATOR_LEASE_SECONDS
+        claimable = Lease.objects.filter(name=self.name).filter(Q(holder=self.holder) | Q(expires_at__lt=Now()))
+        updated = claimable.update(holder=self.holder, expires_at=Now() + timedelta(seconds=length))
+        if not updated and not Lease.objects.filter(name=self.name).exists():
+            try:
+                with transaction.atomic():
+                    Lease.objects.create(name=self.name, holder=self.holder, expires_at=Now() + timedelta(seconds=length))
+                updated = 1
+            except IntegrityError:
+                pass  # Another process created it first and holds it
+        self._valid_until = started + length if updated else None
+        return bool(updated)
+
+    def release(self):
+        """Give the lease up so a standby can take over at its next attempt."""
+        if self._valid_until is None:
+            return
+        self._valid_until = None
+        Lease.objects.filter(name=self.name, holder=self.holder).update(expires_at=Now())
+
+    def current_holder(self):
+        lease = Lease.objects.filter(name=self.name, expires_at__gte=Now()).first()
+        return lease.holder if lease else None
@@ -0,0 +1,287 @@
+"""In-process fan-out of new readings and alarm transitions to live clients.
+
+Ingest and alarm paths publish after their transaction commits; every open
+Server-Sent Events stream holds a Subscriber that collects the events for
+the devices it asked for. Each event is encoded once at publish time, so a
+client costs a dict update per event and no database work at all.
+
+Events carry a coalescing key ('reading', device) or ('alarm', device,
+type). A client that reads slower than events arrive only ever has the
+newest event per key waiting, so its backlog is bounded by the number of
+devices it follows rather than by how far behind it is. Streams also
+flush at most once every LIVE_FLUSH_SECONDS, which batches bursts (a tick
+writing every device) into a single write.
+
+Events are written by whichever process ingests them (API workers, the
+simulator shards), while clients connect to any server process. On
+PostgreSQL with LIVE_RELAY on, every event is relayed through NOTIFY on
+the 'live_events' channel, and each process with open streams LISTENs on
+a connection of its own and delivers what arrives, its own events
+included. No process can tell whether any other one is listening, so with
+the relay on every write sends a NOTIFY; leave it off unless clients and
+writers live in different processes. Without it (and on other backends)
+clients only see the events of the process they are connected to; run a
+single server process there, with the simulator in it, to get the whole
+feed.
+
+In production serve streams through `astream` from an ASGI server, where
+an open stream is a coroutine. `stream` is for WSGI servers such as
+runserver, and holds a worker thread for as long as the client stays
+connected.
+"""
+import asyncio
+import json
+import select
+import threading
+import time
+import numpy as np
+from datetime import timezone as dt_timezone
+from django.conf import settings
+from django.db import DatabaseError, connection, connections
+from django.utils import timezone
+
+KINDS = ('readings', 'alarms')
+
+RELAY_CHANNEL = 'live_events'
+# NOTIFY payloads must stay below 8000 bytes
+RELAY_PAYLOAD_BYTES = 7900
+RELAY_RETRY_SECONDS = 5
+
+
+def relay_enabled():
+    return settings.LIVE_RELAY and connection.vendor == 'postgresql'
+
+
+def _relay_payloads(kind, events):
+    """JSON payloads of [kind, [[key, device id, frame], ...]], each within RELAY_PAYLOAD_BYTES."""
+    head, payloads, parts, size = f'["{kind}",[', [], [], 0
+    for key, device_id, frame in events:
+        # ASCII-only JSON, so characters are bytes
+        part = json.dumps([key, device_id, frame], separators=(',', ':'))
+        if parts and len(head) + size + len(part) + 2 > RELAY_PAYLOAD_BYTES:
+            payloads.append(f"{head}{','.join(parts)}]]")
+            parts, size = [], 0
+        parts.append(part)
+        size += len(part) + 1
+    if parts:
+        payloads.append(f"{head}{','.join(parts)}]]")
+    return payloads
+
+
+class Subscriber:
+    """Pending events of one live client, keyed for coalescing.
+
+    `loop` is the event loop of an async consumer; without it the consumer is
+    a thread blocking in `wait`.
+    """
+
+    def __init__(self, device_ids=None, kinds=KINDS, loop=None):
+        self.device_ids = device_ids
+        self.kinds = frozenset(kinds)
+        self._loop = loop
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._signalled = False
+        self._ready = asyncio.Event() if loop is not None else threading.Event()
+
+    def wants(self, kind, device_id):
+        return kind in self.kinds and (self.device_ids is None or device_id in self.device_ids)
+
+    def offer(self, key, frame):
+        """Queue `frame`, replacing any older frame with the same key. Safe from any thread."""
+        with self._lock:
+            self._pending.pop(key, None)  # re-inserting keeps the dict in arrival order
+            self._pending[key] = frame
+            if self._signalled:
+                return
+            self._signalled = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        else:
+            self._ready.set()
+
+    def drain(self):
+        """Take every pending frame, oldest first."""
+        self._ready.clear()
+        with self._lock:
+            frames = list(self._pending.values())
+            self._pending.clear()
+            self._signalled = False
+        return frames
+
+    def wait(self, timeout):
+        return self._ready.wait(timeout)
+
+    async def await_ready(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+
+class LiveBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = ()
+        self._listener = None
+
+    @property
+    def active(self):
+        """Whether published events can reach anyone: local clients, or any process through the relay."""
+        return bool(self._subscribers) or relay_enabled()
+
+    def subscribe(self, device_ids=None, kinds=KINDS, loop=None):
+        subscriber = Subscriber(device_ids, kinds, loop)
+        with self._lock:
+            self._subscribers = (*self._subscribers, subscriber)
+            if relay_enabled() and self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='live-relay', daemon=True)
+                self._listener.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers = tuple(s for s in self._subscribers if s is not subscriber)
+
+    def publish(self, kind, events):
+        """Send (key, device id, frame) events of `kind` to the relay, or straight to local clients."""
+        if not relay_enabled():
+            self.deliver(kind, events)
+            return
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                    [RELAY_CHANNEL, _relay_payloads(kind, events)],
+                )
+        except DatabaseError as exc:
+            # The write itself has committed; live clients just miss these events
+            print(f"[Live] Could not relay {kind}: {exc}")
+
+    def deliver(self, kind, events):
+        """Offer (key, device id, frame) events of `kind` to every interested subscriber."""
+        # Publishers read the tuple without the lock; subscribe/unsubscribe swap it whole
+        for subscriber in self._subscribers:
+            for key, device_id, frame in events:
+                if subscriber.wants(kind, device_id):
+                    subscriber.offer(key, frame)
+
+    def _listen(self):
+        """Deliver relayed events for as long as the process runs, reconnecting after errors."""
+        while True:
+            relay = connections.create_connection('default')
+            try:
+                relay.ensure_connection()
+                raw = relay.connection
+                with raw.cursor() as cursor:
+                    cursor.execute(f"LISTEN {RELAY_CHANNEL}")
+                while True:
+                    if not select.select([raw], [], [], settings.LIVE_HEARTBEAT_SECONDS)[0]:
+                        continue
+                    raw.poll()
+                    while raw.notifies:
+                        kind, events = json.loads(raw.notifies.pop(0).payload)
+                        self.deliver(kind, [(tuple(key), device_id, frame) for key, device_id, frame in events])
+            except Exception as exc:
+                # Raw driver errors included: the listener has to outlive any database outage
+                print(f"[Live] Relay listener failed, reconnecting: {exc}")
+            finally:
+                try:
+                    relay.close()
+                except Exception:
+                    pass
+            time.sleep(RELAY_RETRY_SECONDS)
+
+
+broker = LiveBroker()
+
+
+def _frame(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+def publish_readings(device_ids, timestamps, temperatures, humidities):
+    """Publish the newest reading per device of a written batch (parallel arrays, UTC `datetime64`)."""
+    if not broker.active:
+        return
+    device_ids = np.broadcast_to(np.asarray(device_ids, dtype=np.int64), np.shape(timestamps))
+    if not device_ids.size:
+        return
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    order = np.lexsort((timestamps, device_ids))
+    last_rows = order[np.r_[device_ids[order][1:] != device_ids[order][:-1], True]]
+    temperatures = np.asarray(temperatures, dtype=float)
+    humidities = np.asarray(humidities, dtype=float)
+    events = []
+    for row in last_rows.tolist():
+        device_id = int(device_ids[row])
+        moment = timestamps[row].item().replace(tzinfo=dt_timezone.utc)
+        events.append((('reading', device_id), device_id, _frame('reading', {
+            'device': device_id,
+            'temperature': float(temperatures[row]),
+            'humidity': float(humidities[row]),
+            'timestamp': timezone.localtime(moment).isoformat(),
+        })))
+    broker.publish('readings', events)
+
+
+def publish_alarms(transitions):
+    """Publish (device id, alarm type, state, value, timestamp) alarm transitions.
+
+    `state` is 'raised', 'cleared' or 'acknowledged'; value and timestamp may be None.
+    """
+    if not broker.active:
+        return
+    events = []
+    for device_id, alarm_type, state, value, moment in transitions:
+        events.append((('alarm', device_id, alarm_type), device_id, _frame('alarm', {
+            'device': device_id,
+            'alarm_type': alarm_type,
+            'state': state,
+            'value': value,
+            'timestamp': timezone.localtime(moment).isoformat() if moment is not None else None,
+        })))
+    broker.publish('alarms', events)
+
+
+_OPENING = "retry: 3000\n\n"
+_HEARTBEAT = ": keepalive\n\n"
+
+
+def stream(device_ids=None, kinds=KINDS):
+    """SSE text for a WSGI response; ends when the client goes away.
+
+    Each open stream occupies a server thread, so this only suits development
+    and small deployments; production serves `astream` under ASGI.
+    """
+    subscriber = broker.subscribe(device_ids, kinds)
+    try:
+        yield _OPENING
+        while True:
+            if not subscriber.wait(settings.LIVE_HEARTBEAT_SECONDS):
+                yield _HEARTBEAT
+                continue
+            frames = subscriber.drain()
+            if frames:
+                yield ''.join(frames)
+            time.sleep(settings.LIVE_FLUSH_SECONDS)
+    finally:
+        broker.unsubscribe(subscriber)
+
+
+async def astream(device_ids=None, kinds=KINDS):
+    """SSE text for an ASGI response; cancelled by the server when the client disconnects."""
+    subscriber = broker.subscribe(device_ids, kinds, loop=asyncio.get_running_loop())
+    try:
+        yield _OPENING
+        while True:
+            if not await subscriber.await_ready(settings.LIVE_HEARTBEAT_SECONDS):
+                yield _HEARTBEAT
+                continue
+            frames = subscriber.drain()
+            if frames:
+                yield ''.join(frames)
+            await asyncio.sleep(settings.LIVE_FLUSH_SECONDS)
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from devices import counters
+from devices.partitions import (
+    add_months, detach_partitions_before, ensure_partitions, is_partitioned, month_start,
+)
+
+
+class Command(BaseCommand):
+    help = "Create upcoming monthly readings partitions and detach the ones past retention."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=3,
+                            help="Months after the current one to create partitions for (default 3).")
+        parser.add_argument('--retain-months', type=int,
+                            help="Detach partitions older than this many months. Nothing is detached if omitted.")
+        parser.add_argument('--drop', action='store_true',
+                            help="Drop detached partitions instead of keeping them as standalone tables.")
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            if not is_partitioned(cursor):
+                raise CommandError("The readings table is not partitioned (PostgreSQL with READINGS_PARTITIONING only).")
+
+            this_month = month_start(timezone.now())
+            created = ensure_partitions(cursor, this_month, add_months(this_month, options['ahead']))
+            for name in created:
+                self.stdout.write(f"Created partition {name}")
+
+            detached = []
+            if options['retain_months'] is not None:
+                cutoff = add_months(this_month, -options['retain_months'])
+                detached = detach_partitions_before(cursor, cutoff, drop=options['drop'])
+                for name in detached:
+                    self.stdout.write(f"{'Dropped' if options['drop'] else 'Detached'} partition {name}")
+
+        if detached:
+            # The detached readings no longer count
+            counters.reconcile()
+
+        self.stdout.write(self.style.SUCCESS(f"{len(created)} partitions created"))
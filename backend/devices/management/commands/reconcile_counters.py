@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from devices import counters
+
+
+class Command(BaseCommand):
+    help = "Recount the dashboard counters from the readings and alarms tables."
+
+    def handle(self, *args, **options):
+        devices = counters.reconcile()
+        self.stdout.write(self.style.SUCCESS(f"Counters reconciled for {devices} devices"))
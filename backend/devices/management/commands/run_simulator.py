@@ -0,0 +1,41 @@
+import signal
+import subprocess
+import sys
+import time
+from django.core.management.base import BaseCommand
+from devices import simulator
+
+
+class Command(BaseCommand):
+    help = "Stand for a simulator lease in this process and run the simulator (or a shard of it) while holding it."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1,
+                            help="Candidate processes to start; use SIMULATOR_SHARDS of them (up to one per core).")
+
+    def handle(self, *args, **options):
+        # Exit normally on SIGTERM: a supervisor stops its children, a candidate releases its lease
+        signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+        if options['processes'] > 1:
+            self._supervise(options['processes'])
+            return
+
+        simulator.start()
+        try:
+            while True:
+                time.sleep(60)
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping simulator")
+
+    def _supervise(self, count):
+        children = [subprocess.Popen([sys.executable, sys.argv[0], 'run_simulator']) for _ in range(count)]
+        try:
+            for child in children:
+                child.wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for child in children:
+                child.terminate()
+            for child in children:
+                child.wait()
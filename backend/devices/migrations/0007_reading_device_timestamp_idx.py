@@ -0,0 +1,17 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0006_alter_alarm_timestamp'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reading',
+            index=models.Index(fields=['device', 'timestamp'], name='reading_device_timestamp_idx'),
+        ),
+    ]
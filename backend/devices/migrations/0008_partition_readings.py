@@ -0,0 +1,104 @@
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
+from django.db import migrations
+
+# A frozen copy of devices.partitions as of this migration, so later changes there can't alter it
+READINGS_TABLE = 'devices_reading'
+DEFAULT_PARTITION = f"{READINGS_TABLE}_default"
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [READINGS_TABLE])
+    return cursor.fetchone() is not None
+
+
+def partition_readings_table(cursor, quote, months_ahead=3):
+    table = quote(READINGS_TABLE)
+    legacy = f"{READINGS_TABLE}_unpartitioned"
+
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+        "(SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s))",
+        [READINGS_TABLE, READINGS_TABLE],
+    )
+    index_definitions = [row[0] for row in cursor.fetchall()]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype IN ('u', 'f', 'x')",
+        [READINGS_TABLE],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(f'SELECT min("timestamp"), max("timestamp") FROM {table}')
+    oldest, newest = cursor.fetchone()
+
+    now = datetime.now(dt_timezone.utc)
+    month = month_start(oldest or now)
+    last_month = add_months(month_start(max(newest or now, now)), months_ahead)
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {quote(legacy)}")
+    cursor.execute(
+        f'CREATE TABLE {table} (LIKE {quote(legacy)} INCLUDING ALL EXCLUDING INDEXES) PARTITION BY RANGE ("timestamp")'
+    )
+    cursor.execute(f"CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT")
+    while month <= last_month:
+        cursor.execute(
+            f"CREATE TABLE {quote(f'{READINGS_TABLE}_y{month.year:04d}m{month.month:02d}')} "
+            f"PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+            [month, add_months(month, 1)],
+        )
+        month = add_months(month, 1)
+    cursor.execute(f"INSERT INTO {table} OVERRIDING SYSTEM VALUE SELECT * FROM {quote(legacy)}")
+    cursor.execute(
+        "SELECT pg_get_serial_sequence(%s, 'id') FROM pg_attribute "
+        "WHERE attrelid = to_regclass(%s) AND attname = 'id' AND attidentity = ''",
+        [legacy, legacy],
+    )
+    serial = cursor.fetchone()
+    if serial and serial[0]:
+        cursor.execute(f"ALTER SEQUENCE {serial[0]} OWNED BY {table}.id")
+    cursor.execute(f"DROP TABLE {quote(legacy)}")
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(max(id), 0) + 1, false) FROM {table}",
+        [READINGS_TABLE],
+    )
+
+    cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {quote(READINGS_TABLE + "_pkey")} PRIMARY KEY (id, "timestamp")')
+    for name, definition in constraints:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}")
+    for definition in index_definitions:
+        cursor.execute(definition)
+
+
+def partition_readings(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        if settings.READINGS_BRIN_INDEX:
+            # A few pages per partition; lets time-only range scans skip most of the table
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS reading_timestamp_brin ON devices_reading USING brin ("timestamp")'
+            )
+        if settings.READINGS_PARTITIONING and not is_partitioned(cursor):
+            partition_readings_table(cursor, schema_editor.quote_name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0007_reading_device_timestamp_idx'),
+    ]
+
+    operations = [
+        # Not reversible in place: a partitioned table keeps working after unapplying
+        migrations.RunPython(partition_readings, migrations.RunPython.noop),
+    ]
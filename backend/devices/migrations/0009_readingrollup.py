@@ -0,0 +1,69 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:29
+
+from datetime import timezone as dt_timezone
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+
+
+# Frozen as of this migration, rather than importing devices.rollups, whose later changes would alter it
+BATCH_SIZE = 2000
+
+
+def rollup(ReadingRollup, readings, resolution, kind, tzinfo):
+    """Add the `resolution` rollups of `readings`, bucketed by Trunc `kind` in `tzinfo`."""
+    rows = (
+        readings.annotate(bucket=Trunc('timestamp', kind, tzinfo=tzinfo))
+        .values('device_id', 'bucket')
+        .annotate(
+            count=Count('id'),
+            temperature_min=Min('temperature'), temperature_max=Max('temperature'), temperature_sum=Sum('temperature'),
+            humidity_min=Min('humidity'), humidity_max=Max('humidity'), humidity_sum=Sum('humidity'),
+        )
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ReadingRollup(resolution=resolution, **row))
+        if len(batch) == BATCH_SIZE:
+            ReadingRollup.objects.bulk_create(batch)
+            batch = []
+    ReadingRollup.objects.bulk_create(batch)
+
+
+def populate_rollups(apps, schema_editor):
+    Reading = apps.get_model('devices', 'Reading')
+    ReadingRollup = apps.get_model('devices', 'ReadingRollup')
+    for resolution, kind in (('1h', 'hour'), ('1d', 'day')):
+        rollup(ReadingRollup, Reading.objects.all(), resolution, kind, dt_timezone.utc)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0008_partition_readings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReadingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('1h', 'Hourly'), ('1d', 'Daily')], max_length=2)),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('temperature_min', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('temperature_sum', models.FloatField()),
+                ('humidity_min', models.FloatField()),
+                ('humidity_max', models.FloatField()),
+                ('humidity_sum', models.FloatField()),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='devices.device')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'resolution', 'bucket'), name='unique_reading_rollup_bucket')],
+            },
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:46
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def close_duplicate_open_alarms(apps, schema_editor):
+    """Keep only the newest open alarm per device and type; older duplicates become inactive."""
+    Alarm = apps.get_model('devices', 'Alarm')
+    open_alarms = Alarm.objects.filter(acknowledged=False, active=True)
+    duplicates = (
+        open_alarms.values('device_id', 'alarm_type')
+        .annotate(total=Count('id'), newest=Max('id'))
+        .filter(total__gt=1)
+    )
+    for group in duplicates:
+        open_alarms.filter(device_id=group['device_id'], alarm_type=group['alarm_type']).exclude(
+            id=group['newest']
+        ).update(active=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0010_reportjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_alarms, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='alarm',
+            constraint=models.UniqueConstraint(condition=models.Q(('acknowledged', False), ('active', True)), fields=('device', 'alarm_type'), name='unique_open_alarm'),
+        ),
+    ]
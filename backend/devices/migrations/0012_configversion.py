@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+def create_device_counter(apps, schema_editor):
+    apps.get_model('devices', 'ConfigVersion').objects.get_or_create(name='devices')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0011_alarm_unique_open_alarm'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConfigVersion',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_device_counter, migrations.RunPython.noop),
+    ]
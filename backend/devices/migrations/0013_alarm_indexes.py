@@ -0,0 +1,25 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0012_configversion'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='alarm',
+            index=models.Index(fields=['timestamp', 'id'], name='alarm_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alarm',
+            index=models.Index(fields=['device', 'timestamp'], name='alarm_device_timestamp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='alarm',
+            index=models.Index(condition=models.Q(('acknowledged', False)), fields=['timestamp', 'id'], name='unacknowledged_alarm_idx'),
+        ),
+    ]
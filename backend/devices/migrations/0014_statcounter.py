@@ -0,0 +1,42 @@
+# Generated by Django 5.2.4 on 2026-10-18 11:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_rows(apps, schema_editor):
+    """Start the counters from the current readings and unacknowledged alarms."""
+    Reading = apps.get_model('devices', 'Reading')
+    Alarm = apps.get_model('devices', 'Alarm')
+    StatCounter = apps.get_model('devices', 'StatCounter')
+    readings = Reading.objects.values('device_id').annotate(total=Count('id')).order_by()
+    alarms = Alarm.objects.filter(acknowledged=False).values('device_id', 'alarm_type').annotate(total=Count('id')).order_by()
+    StatCounter.objects.bulk_create(
+        [StatCounter(device_id=row['device_id'], name='readings', value=row['total']) for row in readings]
+        + [StatCounter(device_id=row['device_id'], name=f"alarms:{row['alarm_type']}", value=row['total']) for row in alarms],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0013_alarm_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=30)),
+                ('value', models.BigIntegerField(default=0)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='devices.device')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('device', 'name'), name='unique_stat_counter')],
+            },
+        ),
+        migrations.RunPython(count_existing_rows, migrations.RunPython.noop),
+    ]
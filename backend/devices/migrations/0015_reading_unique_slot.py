@@ -0,0 +1,76 @@
+# Generated by Django 5.2.4 on 2026-10-18 12:02
+
+from datetime import timezone as dt_timezone
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+
+
+# Frozen as of this migration, rather than importing devices.rollups, whose later changes would alter it
+BATCH_SIZE = 2000
+
+
+def rollup(ReadingRollup, readings, resolution, kind, tzinfo):
+    """Add the `resolution` rollups of `readings`, bucketed by Trunc `kind` in `tzinfo`."""
+    rows = (
+        readings.annotate(bucket=Trunc('timestamp', kind, tzinfo=tzinfo))
+        .values('device_id', 'bucket')
+        .annotate(
+            count=Count('id'),
+            temperature_min=Min('temperature'), temperature_max=Max('temperature'), temperature_sum=Sum('temperature'),
+            humidity_min=Min('humidity'), humidity_max=Max('humidity'), humidity_sum=Sum('humidity'),
+        )
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ReadingRollup(resolution=resolution, **row))
+        if len(batch) == BATCH_SIZE:
+            ReadingRollup.objects.bulk_create(batch)
+            batch = []
+    ReadingRollup.objects.bulk_create(batch)
+
+
+def remove_duplicate_readings(apps, schema_editor):
+    """Keep the first reading of every (device, timestamp) slot and recount what the duplicates skewed."""
+    Reading = apps.get_model('devices', 'Reading')
+    ReadingRollup = apps.get_model('devices', 'ReadingRollup')
+    StatCounter = apps.get_model('devices', 'StatCounter')
+    duplicates = list(
+        Reading.objects.values('device_id', 'timestamp')
+        .annotate(total=Count('id'), first=Min('id'))
+        .filter(total__gt=1)
+        .order_by()
+    )
+    if not duplicates:
+        return
+
+    for slot in duplicates:
+        Reading.objects.filter(device_id=slot['device_id'], timestamp=slot['timestamp']).exclude(id=slot['first']).delete()
+
+    device_ids = sorted({slot['device_id'] for slot in duplicates})
+    ReadingRollup.objects.filter(device_id__in=device_ids).delete()
+    for resolution, kind in (('1h', 'hour'), ('1d', 'day')):
+        rollup(ReadingRollup, Reading.objects.filter(device_id__in=device_ids), resolution, kind, dt_timezone.utc)
+    totals = Reading.objects.filter(device_id__in=device_ids).values('device_id').annotate(total=Count('id')).order_by()
+    for row in totals:
+        StatCounter.objects.filter(device_id=row['device_id'], name='readings').update(value=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0014_statcounter'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_readings, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='reading',
+            constraint=models.UniqueConstraint(fields=('device', 'timestamp'), name='unique_reading_slot'),
+        ),
+        migrations.RemoveIndex(
+            model_name='reading',
+            name='reading_device_timestamp_idx',
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-18 14:10
+
+from zoneinfo import ZoneInfo
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+
+
+# Frozen as of this migration, rather than importing devices.rollups, whose later changes would alter it
+BATCH_SIZE = 2000
+
+
+def rollup(ReadingRollup, readings, resolution, kind, tzinfo):
+    """Add the `resolution` rollups of `readings`, bucketed by Trunc `kind` in `tzinfo`."""
+    rows = (
+        readings.annotate(bucket=Trunc('timestamp', kind, tzinfo=tzinfo))
+        .values('device_id', 'bucket')
+        .annotate(
+            count=Count('id'),
+            temperature_min=Min('temperature'), temperature_max=Max('temperature'), temperature_sum=Sum('temperature'),
+            humidity_min=Min('humidity'), humidity_max=Max('humidity'), humidity_sum=Sum('humidity'),
+        )
+        .order_by()
+    )
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(ReadingRollup(resolution=resolution, **row))
+        if len(batch) == BATCH_SIZE:
+            ReadingRollup.objects.bulk_create(batch)
+            batch = []
+    ReadingRollup.objects.bulk_create(batch)
+
+
+def rebuild_daily_rollups(apps, schema_editor):
+    """Daily buckets were UTC days; recompute them as TIME_ZONE calendar days."""
+    Reading = apps.get_model('devices', 'Reading')
+    ReadingRollup = apps.get_model('devices', 'ReadingRollup')
+    ReadingRollup.objects.filter(resolution='1d').delete()
+    rollup(ReadingRollup, Reading.objects.all(), '1d', 'day', ZoneInfo(settings.TIME_ZONE))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devices', '0017_device_status_changed_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_daily_rollups, migrations.RunPython.noop),
+    ]
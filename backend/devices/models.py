@@ -1,4 +1,5 @@
 import uuid
+from django.conf import settings
 from django.db import models
 from django.utils import timezone
 from simple_history.models import HistoricalRecords
@@ -18,6 +19,8 @@ class Device (models.Model):
     code = models.CharField(max_length=50, unique=True, default="UNKNOWN")
     location = models.CharField(max_length=100, default="UNKNOWN")
     status = models.CharField(max_length=10, choices=[('on', 'On'), ('off', 'Off')],default='off')
+    # Set whenever `status` changes; the simulator never generates slots from before a device was switched on
+    status_changed_at = models.DateTimeField(null=True, blank=True, editable=False)
     temperature_min = models.FloatField(null=True, blank=True)
     temperature_max = models.FloatField(null=True, blank=True)
     humidity_min = models.FloatField(null=True, blank=True)
@@ -54,6 +57,39 @@ class Reading(models.Model):
     temperature = models.FloatField()
     humidity = models.FloatField()
     timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            # One reading per device and slot, so retried or overlapping writes can't duplicate rows.
+            # Its index also serves every history, report and inject query (one device over a time range).
+            models.UniqueConstraint(fields=['device', 'timestamp'], name='unique_reading_slot'),
+        ]
+
+
+class ReadingRollup(models.Model):
+    """Per-device min/max/sum/count of readings over a UTC hour or a TIME_ZONE calendar day."""
+    RESOLUTIONS = (
+        ('1h', 'Hourly'),
+        ('1d', 'Daily'),
+    )
+
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='rollups')
+    resolution = models.CharField(max_length=2, choices=RESOLUTIONS)
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+    temperature_min = models.FloatField()
+    temperature_max = models.FloatField()
+    temperature_sum = models.FloatField()
+    humidity_min = models.FloatField()
+    humidity_max = models.FloatField()
+    humidity_sum = models.FloatField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'resolution', 'bucket'], name='unique_reading_rollup_bucket'),
+        ]
+
+
 class Alarm(models.Model):
     ALARM_TYPES = (
         ('TEMP_HI', 'Temperature Too High'),
@@ -72,6 +108,25 @@ class Alarm(models.Model):
     acknowledged = models.BooleanField(default=False)
     active = models.BooleanField(default=True)
 
+    class Meta:
+        constraints = [
+            # At most one open alarm per device and type; the alarm upsert conflicts on it
+            models.UniqueConstraint(
+                fields=['device', 'alarm_type'],
+                condition=models.Q(acknowledged=False, active=True),
+                name='unique_open_alarm',
+            ),
+        ]
+        indexes = [
+            # The alarm console lists newest first, overall, per device and (mostly) unacknowledged only;
+            # (timestamp, id) matches its keyset cursor
+            models.Index(fields=['timestamp', 'id'], name='alarm_timestamp_idx'),
+            models.Index(fields=['device', 'timestamp'], name='alarm_device_timestamp_idx'),
+            models.Index(
+                fields=['timestamp', 'id'], condition=models.Q(acknowledged=False), name='unacknowledged_alarm_idx',
+            ),
+        ]
+
     def __str__(self):
         return f"{self.device.name} - {self.get_alarm_type_display()} @ {self.timestamp.strftime('%Y-%m-%d %H:%M')}"
 
@@ -80,3 +135,80 @@ class Alarm(models.Model):
         if self.alarm_type not in ('DC','SD','MD') and self.triggered_value is not None:
             return f"{label}: {self.triggered_value}"
         return label
+
+
+class StatCounter(models.Model):
+    """A materialized per-device count for the dashboard.
+
+    `name` is 'readings' or 'alarms:<alarm type>' (unacknowledged alarms of that type).
+    Write paths add to it incrementally; `devices.counters.reconcile` recounts it.
+    """
+    device = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='counters')
+    name = models.CharField(max_length=30)
+    value = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'name'], name='unique_stat_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_id} {self.name}={self.value}"
+
+
+class ReportJob(models.Model):
+    """A multi-device PDF report rendered in the background into a ZIP on disk."""
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+        ('expired', 'Expired'),  # Done or failed longer than REPORT_RETENTION_HOURS; the ZIP is deleted
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=10, choices=STATUSES, default='queued')
+    device_ids = models.JSONField(null=True, blank=True)  # None means every device
+    start = models.DateTimeField(null=True, blank=True)
+    end = models.DateTimeField(null=True, blank=True)
+    total = models.PositiveIntegerField(default=0)
+    completed = models.PositiveIntegerField(default=0)
+    file_path = models.CharField(max_length=500, blank=True)
+    error = models.TextField(blank=True)
+    failures = models.JSONField(default=list, blank=True)  # [{'device': id, 'error': message}, ...]
+    # Process running the job, and when it last reported progress (database clock)
+    claimed_by = models.CharField(max_length=100, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Report job {self.id} ({self.status})"
+
+
+class ConfigVersion(models.Model):
+    """Change counter for a cached configuration (e.g. 'devices').
+
+    Bumped on every change so processes holding an in-memory copy can tell
+    it is stale from a single-row read.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} v{self.version}"
+
+
+class Lease(models.Model):
+    """A named, expiring claim held by one process (e.g. the simulator leader).
+
+    The holder renews it well before `expires_at`; once it lapses any other
+    process may take it over.
+    """
+    name = models.CharField(max_length=50, primary_key=True)
+    holder = models.CharField(max_length=100, blank=True)
+    expires_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} held by {self.holder or 'nobody'} until {self.expires_at}"
@@ -0,0 +1,170 @@
+"""Monthly range partitioning of the readings table (PostgreSQL only).
+
+Partitions are named `<table>_yYYYYmMM` and cover one UTC calendar month.
+A default partition catches rows that fall outside every monthly range.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+from django.db import connection, transaction
+from .models import Reading
+
+READINGS_TABLE = Reading._meta.db_table
+DEFAULT_PARTITION = f"{READINGS_TABLE}_default"
+_PARTITION_NAME = re.compile(rf"^{READINGS_TABLE}_y(\d{{4}})m(\d{{2}})$")
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f"{READINGS_TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def is_partitioned(cursor, table=READINGS_TABLE):
+    if connection.vendor != 'postgresql':
+        return False
+    cursor.execute(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table]
+    )
+    return cursor.fetchone() is not None
+
+
+def monthly_partitions(cursor):
+    """Month start -> partition name for every attached monthly partition."""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s)",
+        [READINGS_TABLE],
+    )
+    partitions = {}
+    for (name,) in cursor.fetchall():
+        match = _PARTITION_NAME.match(name)
+        if match:
+            partitions[datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)] = name
+    return partitions
+
+
+def create_partition(cursor, month):
+    """Attach the partition for `month`, moving any rows the default partition holds for it."""
+    quote = connection.ops.quote_name
+    name = partition_name(month)
+    lower, upper = month, add_months(month, 1)
+    with transaction.atomic():
+        cursor.execute(
+            f'SELECT count(*) FROM {quote(DEFAULT_PARTITION)} WHERE "timestamp" >= %s AND "timestamp" < %s',
+            [lower, upper],
+        )
+        stray_rows = cursor.fetchone()[0]
+        if stray_rows:
+            cursor.execute(f"ALTER TABLE {quote(READINGS_TABLE)} DETACH PARTITION {quote(DEFAULT_PARTITION)}")
+        cursor.execute(
+            f"CREATE TABLE {quote(name)} PARTITION OF {quote(READINGS_TABLE)} FOR VALUES FROM (%s) TO (%s)",
+            [lower, upper],
+        )
+        if stray_rows:
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {quote(DEFAULT_PARTITION)} "
+                f'WHERE "timestamp" >= %s AND "timestamp" < %s RETURNING *) '
+                f"INSERT INTO {quote(READINGS_TABLE)} SELECT * FROM moved",
+                [lower, upper],
+            )
+            cursor.execute(f"ALTER TABLE {quote(READINGS_TABLE)} ATTACH PARTITION {quote(DEFAULT_PARTITION)} DEFAULT")
+    return name
+
+
+def ensure_partitions(cursor, first_month, last_month):
+    """Create every missing monthly partition from `first_month` to `last_month` inclusive."""
+    existing = monthly_partitions(cursor)
+    created = []
+    month = month_start(first_month)
+    while month <= last_month:
+        if month not in existing:
+            created.append(create_partition(cursor, month))
+        month = add_months(month, 1)
+    return created
+
+
+def detach_partitions_before(cursor, cutoff_month, drop=False):
+    """Detach (and optionally drop) monthly partitions that end on or before `cutoff_month`."""
+    quote = connection.ops.quote_name
+    detached = []
+    for month, name in sorted(monthly_partitions(cursor).items()):
+        if month >= cutoff_month:
+            break
+        cursor.execute(f"ALTER TABLE {quote(READINGS_TABLE)} DETACH PARTITION {quote(name)}")
+        if drop:
+            cursor.execute(f"DROP TABLE {quote(name)}")
+        detached.append(name)
+    return detached
+
+
+def partition_readings_table(cursor, months_ahead=3):
+    """Convert the plain readings table into a table range-partitioned by month.
+
+    The new parent copies every column property of the old table (defaults, the
+    id identity, NOT NULL and CHECK constraints) and existing rows are copied
+    into monthly partitions, ids included; the identity then continues after
+    them. Indexes, unique and foreign key constraints are replayed on the new
+    parent under their original names, except the primary key, which has to
+    include the partition key.
+    """
+    quote = connection.ops.quote_name
+    table = quote(READINGS_TABLE)
+    legacy = f"{READINGS_TABLE}_unpartitioned"
+
+    cursor.execute(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = %s AND indexname NOT IN "
+        "(SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s))",
+        [READINGS_TABLE, READINGS_TABLE],
+    )
+    index_definitions = [row[0] for row in cursor.fetchall()]
+    # LIKE ... INCLUDING ALL copies CHECK constraints; these it can't
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = to_regclass(%s) AND contype IN ('u', 'f', 'x')",
+        [READINGS_TABLE],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(f'SELECT min("timestamp"), max("timestamp") FROM {table}')
+    oldest, newest = cursor.fetchone()
+
+    now = datetime.now(dt_timezone.utc)
+    first_month = month_start(oldest or now)
+    last_month = add_months(month_start(max(newest or now, now)), months_ahead)
+
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {quote(legacy)}")
+    # Indexes are rebuilt below: the primary key one would lack the partition key
+    cursor.execute(
+        f'CREATE TABLE {table} (LIKE {quote(legacy)} INCLUDING ALL EXCLUDING INDEXES) PARTITION BY RANGE ("timestamp")'
+    )
+    cursor.execute(f"CREATE TABLE {quote(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT")
+    ensure_partitions(cursor, first_month, last_month)
+    cursor.execute(f"INSERT INTO {table} OVERRIDING SYSTEM VALUE SELECT * FROM {quote(legacy)}")
+    # A serial id (tables made before Django 4.1) keeps its sequence, which must outlive the old table
+    cursor.execute(
+        "SELECT pg_get_serial_sequence(%s, 'id') FROM pg_attribute "
+        "WHERE attrelid = to_regclass(%s) AND attname = 'id' AND attidentity = ''",
+        [legacy, legacy],
+    )
+    serial = cursor.fetchone()
+    if serial and serial[0]:
+        cursor.execute(f"ALTER SEQUENCE {serial[0]} OWNED BY {table}.id")
+    cursor.execute(f"DROP TABLE {quote(legacy)}")
+    # The copied identity starts over; either way ids continue after the copied ones
+    cursor.execute(
+        f"SELECT setval(pg_get_serial_sequence(%s, 'id'), COALESCE(max(id), 0) + 1, false) FROM {table}",
+        [READINGS_TABLE],
+    )
+
+    cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {quote(READINGS_TABLE + "_pkey")} PRIMARY KEY (id, "timestamp")')
+    for name, definition in constraints:
+        cursor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {quote(name)} {definition}")
+    for definition in index_definitions:
+        cursor.execute(definition)
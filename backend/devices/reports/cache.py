@@ -0,0 +1,157 @@
+"""Content-addressed on-disk cache of rendered single-device reports.
+
+A report's key hashes everything its PDF depends on: the device's fields,
+the requested range, the template version and output settings, and a
+change marker summarising the readings in the range (from their hourly
+rollups, including sums, so in-place edits count) and the alarms in it.
+Any write that changes those produces a new key, and with it a new ETag. Paths that edit
+readings in place also call `invalidate` to free the superseded files
+straight away instead of waiting for eviction.
+
+Files live under REPORT_CACHE_DIR/<device id>/<start>_<end>_<key>.pdf,
+with range bounds in epoch microseconds ('open' when unbounded), so
+invalidation can match ranges without an index. Hits refresh the file's
+mtime and the oldest files are evicted once the directory grows past
+REPORT_CACHE_MAX_BYTES. Since everything is on disk, every process shares
+the cache.
+"""
+import hashlib
+import os
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+from devices.models import Alarm, ReadingRollup
+from devices.reports.pdf_generator import REPORT_TEMPLATE_VERSION
+
+OPEN_BOUND = 'open'
+
+
+def is_enabled():
+    return settings.REPORT_CACHE_MAX_BYTES > 0
+
+
+def _bound(value):
+    return OPEN_BOUND if value is None else str(int(value.timestamp() * 1_000_000))
+
+
+def _device_dir(device_id):
+    return Path(settings.REPORT_CACHE_DIR) / str(device_id)
+
+
+def change_marker(device, start=None, end=None):
+    """Summary of the data a report over [start, end] is drawn from, in two small aggregate queries.
+
+    Readings are summarised from the hourly rollups overlapping the range, which every
+    write path keeps current: a year is 8760 rows instead of every reading. Hours only
+    partly in range can change the marker when nothing in range did, never the other
+    way round. The first element is the number of readings in those hours.
+    """
+    rollups = ReadingRollup.objects.filter(device=device, resolution='1h')
+    alarms = Alarm.objects.filter(device=device)
+    if start:
+        rollups = rollups.filter(bucket__gt=start - timedelta(hours=1))
+        alarms = alarms.filter(timestamp__gte=start)
+    if end:
+        rollups = rollups.filter(bucket__lte=end)
+        alarms = alarms.filter(timestamp__lte=end)
+    reading_marker = rollups.aggregate(
+        count=Sum('count'), last=Max('bucket'),
+        temperatures=Sum('temperature_sum'), humidities=Sum('humidity_sum'),
+        temperature_min=Min('temperature_min'), temperature_max=Max('temperature_max'),
+        humidity_min=Min('humidity_min'), humidity_max=Max('humidity_max'),
+    )
+    alarm_marker = alarms.aggregate(
+        count=Count('id'), last_id=Max('id'), last=Max('timestamp'), values=Sum('triggered_value'),
+    )
+    return (
+        reading_marker['count'] or 0, reading_marker['last'],
+        reading_marker['temperatures'], reading_marker['humidities'],
+        reading_marker['temperature_min'], reading_marker['temperature_max'],
+        reading_marker['humidity_min'], reading_marker['humidity_max'],
+        alarm_marker['count'], alarm_marker['last_id'], alarm_marker['last'], alarm_marker['values'],
+    )
+
+
+def report_key(device, start, end, marker):
+    fields = [(field.attname, getattr(device, field.attname)) for field in device._meta.concrete_fields]
+    parts = (
+        REPORT_TEMPLATE_VERSION, settings.REPORT_CHART_FORMAT, timezone.get_current_timezone_name(),
+        fields, _bound(start), _bound(end), marker,
+    )
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def path_for(device_id, start, end, key):
+    return _device_dir(device_id) / f"{_bound(start)}_{_bound(end)}_{key}.pdf"
+
+
+def lookup(device_id, start, end, key):
+    """The cached PDF's path, or None. A hit marks the file as recently used."""
+    path = path_for(device_id, start, end, key)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+    return path
+
+
+def store(device_id, start, end, key, render):
+    """Call `render(path)` to write the PDF into a temporary file, then move it into place.
+
+    Returns the cached path.
+    """
+    path = path_for(device_id, start, end, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    os.close(handle)
+    try:
+        render(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    evict()
+    return path
+
+
+def evict(max_bytes=None):
+    """Delete least recently used reports until the cache fits in `max_bytes`."""
+    max_bytes = settings.REPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    entries = []
+    total = 0
+    for path in Path(settings.REPORT_CACHE_DIR).glob('*/*.pdf'):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+
+
+def _parse_bound(token, default):
+    return default if token == OPEN_BOUND else int(token)
+
+
+def invalidate(device_ids=None, start=None, end=None):
+    """Drop cached reports of `device_ids` (all devices when None) whose range overlaps [start, end]."""
+    root = Path(settings.REPORT_CACHE_DIR)
+    if device_ids is None:
+        directories = [path for path in root.glob('*') if path.is_dir()]
+    else:
+        directories = [_device_dir(device_id) for device_id in device_ids]
+    lower = _parse_bound(_bound(start), float('-inf'))
+    upper = _parse_bound(_bound(end), float('inf'))
+    for directory in directories:
+        for path in directory.glob('*.pdf'):
+            first, last, _ = path.stem.split('_', 2)
+            if _parse_bound(first, float('-inf')) <= upper and _parse_bound(last, float('inf')) >= lower:
+                path.unlink(missing_ok=True)
@@ -0,0 +1,121 @@
+"""Line charts for device reports.
+
+Charts are drawn with the object-oriented Figure/FigureCanvasAgg API, never
+pyplot, so reports can be rendered from several threads at once. Each
+thread keeps one styled figure per chart colour and only swaps the line
+data, and series are reduced to at most two points per horizontal pixel
+before plotting.
+"""
+import threading
+from datetime import datetime
+from io import BytesIO
+import numpy as np
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from django.utils import timezone
+from reportlab.graphics.shapes import Drawing, Line, PolyLine, String
+from reportlab.lib import colors
+
+FIGSIZE = (10, 3)
+DPI = 100
+DATE_FORMAT = "%I:%M %p %d-%m-%Y"
+# Fixed margins instead of tight_layout(): the tick label format never changes
+MARGINS = dict(left=0.07, right=0.98, top=0.88, bottom=0.42)
+
+_templates = threading.local()
+
+
+def decimate_minmax(times, values, buckets):
+    """Keep the min and max sample of each of `buckets` equal-width time slices.
+
+    The visible envelope of a line plot at that pixel width is unchanged.
+    `times` must be sorted ascending.
+    """
+    times = np.asarray(times, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(times) <= 2 * buckets:
+        return times, values
+
+    span = times[-1] - times[0] or 1.0
+    bucket_ids = np.minimum(((times - times[0]) / span * buckets).astype(np.int64), buckets - 1)
+    # Within each bucket, sorting by value puts the minimum first and the maximum last
+    order = np.lexsort((values, bucket_ids))
+    sorted_ids = bucket_ids[order]
+    firsts = order[np.r_[True, sorted_ids[1:] != sorted_ids[:-1]]]
+    lasts = order[np.r_[sorted_ids[1:] != sorted_ids[:-1], True]]
+    keep = np.unique(np.concatenate([firsts, lasts]))
+    return times[keep], values[keep]
+
+
+def _template(color):
+    """This thread's reusable figure for `color`: axes, labels and formatters set up once."""
+    figures = getattr(_templates, 'figures', None)
+    if figures is None:
+        figures = _templates.figures = {}
+    if color not in figures:
+        figure = Figure(figsize=FIGSIZE, dpi=DPI)
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        figure.subplots_adjust(**MARGINS)
+        (line,) = axes.plot([], [], color=color)
+        axes.xaxis.set_major_locator(mdates.AutoDateLocator())
+        axes.grid(True)
+        axes.set_xlabel('Timestamp', weight='bold')
+        axes.tick_params(axis='x', labelrotation=45)
+        figures[color] = (figure, axes, line)
+    return figures[color]
+
+
+def _plot_width_pixels():
+    return int(FIGSIZE[0] * DPI * (MARGINS['right'] - MARGINS['left']))
+
+
+def render_line_chart_png(times, values, title, ylabel, color):
+    """PNG of `values` over `times` (epoch seconds) as a BytesIO."""
+    figure, axes, line = _template(color)
+    times, values = decimate_minmax(times, values, _plot_width_pixels())
+
+    line.set_data(times / 86400.0, values)  # Matplotlib dates count days since the Unix epoch
+    axes.xaxis.set_major_formatter(mdates.DateFormatter(DATE_FORMAT, tz=timezone.get_current_timezone()))
+    axes.set_title(title, weight='bold')
+    axes.set_ylabel(ylabel, weight='bold')
+    axes.relim()
+    axes.autoscale_view()
+
+    buffer = BytesIO()
+    figure.savefig(buffer, format='png')
+    buffer.seek(0)
+    return buffer
+
+
+def render_line_chart_drawing(times, values, title, ylabel, color, width=450, height=150):
+    """The same chart as ReportLab vector graphics, to be drawn straight onto the PDF page."""
+    times, values = decimate_minmax(times, values, int(width))
+    drawing = Drawing(width, height)
+    left, right, bottom, top = 40, width - 10, 30, height - 20
+    plot_w, plot_h = right - left, top - bottom
+
+    t0, t1 = float(times[0]), float(times[-1])
+    v0, v1 = float(values.min()), float(values.max())
+    t_span = (t1 - t0) or 1.0
+    v_span = (v1 - v0) or 1.0
+    xs = left + (times - t0) / t_span * plot_w
+    ys = bottom + (values - v0) / v_span * plot_h
+
+    drawing.add(String(width / 2, height - 12, title, fontName='Helvetica-Bold', fontSize=9, textAnchor='middle'))
+    drawing.add(String(10, bottom + plot_h / 2, ylabel, fontName='Helvetica', fontSize=7))
+    grey = colors.Color(0.85, 0.85, 0.85)
+    tz = timezone.get_current_timezone()
+    for fraction in np.linspace(0, 1, 5):
+        y = bottom + fraction * plot_h
+        drawing.add(Line(left, y, right, y, strokeColor=grey, strokeWidth=0.4))
+        drawing.add(String(left - 3, y - 2, f"{v0 + fraction * v_span:.1f}", fontSize=6, textAnchor='end'))
+        x = left + fraction * plot_w
+        drawing.add(Line(x, bottom, x, top, strokeColor=grey, strokeWidth=0.4))
+        label = datetime.fromtimestamp(t0 + fraction * t_span, tz).strftime(DATE_FORMAT)
+        drawing.add(String(x, bottom - 10, label, fontSize=5, textAnchor='middle'))
+
+    points = np.column_stack([xs, ys]).ravel().tolist()
+    drawing.add(PolyLine(points, strokeColor=colors.toColor(color), strokeWidth=0.6))
+    return drawing
@@ -0,0 +1,248 @@
+"""Background jobs for multi-device report ZIPs.
+
+Jobs are rows in the database (`ReportJob`), so any process can pick up a
+queued one: a dispatcher thread claims it with a conditional UPDATE, renders
+each device's PDF in a process pool and appends the PDFs to a ZIP on disk as
+they finish. No external broker is involved.
+
+A running job's process stamps `heartbeat_at` with its progress at least
+every REPORT_JOB_HEARTBEAT_SECONDS. A job silent for REPORT_JOB_STALE_SECONDS
+lost its process and is claimed again from the start. A device whose PDF
+can't be rendered is listed in the job's `failures` instead of failing the
+job. ZIPs are deleted REPORT_RETENTION_HOURS after their job finished.
+
+Nothing here imports models at module level: worker processes are spawned
+fresh and only set Django up in `_init_worker`.
+"""
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from pathlib import Path
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+# How often an idle dispatcher looks for jobs queued by other processes
+JOB_POLL_SECONDS = 5
+# How often a dispatcher looks for finished jobs past their retention
+EXPIRY_CHECK_SECONDS = 300
+
+_wakeup = threading.Event()
+_dispatcher = None
+_pool = None
+_lock = threading.Lock()
+
+
+class JobLost(Exception):
+    """Another process claimed the job after this one stopped reporting progress."""
+
+
+def is_worker_process():
+    """Whether this is a report worker spawned by a pool, rather than a process serving the app."""
+    return multiprocessing.parent_process() is not None
+
+
+def _init_worker():
+    import django
+
+    # Report workers only render; they must never start their own simulator
+    os.environ['SIMULATOR_ENABLED'] = 'False'
+    django.setup()
+
+
+def render_device_report(device_id, start, end, directory, context=None):
+    """Worker entry point: write one device's PDF into `directory`.
+
+    `context` is the device's `prefetch.ReportContext`, loaded with the rest of
+    the job's, which spares the worker its device, alarm and aggregate queries.
+    Returns the file path, or None when the device has no readings in range.
+    """
+    from devices.models import Device
+    from devices.reports.series import fetch_series
+    from devices.reports.pdf_generator import (
+        generate_pdf_device_report, iter_reading_rows,
+    )
+
+    try:
+        device = context.device if context is not None else Device.objects.get(id=device_id)
+        readings = fetch_series(device, start, end)
+        if not readings.timestamps.size:
+            return None
+        path = Path(directory) / f"device_{device.id}_report.pdf"
+        generate_pdf_device_report(device, readings, output=str(path), table_rows=iter_reading_rows(device, start, end),
+                                   context=context, start=start, end=end)
+        return str(path)
+    finally:
+        close_old_connections()
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.REPORT_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool whose worker died, so the next submission starts a fresh one."""
+    global _pool
+    with _lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _claimable():
+    from django.db.models import Q
+    from django.db.models.functions import Now
+
+    # Heartbeats use the database clock, so hosts with skewed clocks agree on what is stale
+    stale = Now() - timedelta(seconds=settings.REPORT_JOB_STALE_SECONDS)
+    return Q(status='queued') | Q(status='running', heartbeat_at__lt=stale) | Q(status='running', heartbeat_at=None)
+
+
+def _claim_next_job():
+    from django.db.models.functions import Now
+    from devices.leader import PROCESS_ID
+    from devices.models import ReportJob
+
+    candidates = ReportJob.objects.filter(_claimable()).order_by('created_at').values_list('id', flat=True)
+    for job_id in candidates[:10]:
+        # Only one process wins the claim; a stale job starts over
+        if ReportJob.objects.filter(_claimable(), id=job_id).update(
+            status='running', claimed_by=PROCESS_ID, heartbeat_at=Now(), completed=0, failures=[], error='',
+        ):
+            return ReportJob.objects.get(id=job_id)
+    return None
+
+
+def _report(job, **fields):
+    """Write progress and renew the heartbeat. Raises JobLost once another process owns the job."""
+    from django.db.models.functions import Now
+    from devices.models import ReportJob
+
+    if not ReportJob.objects.filter(id=job.id, status='running', claimed_by=job.claimed_by).update(
+        heartbeat_at=Now(), **fields,
+    ):
+        raise JobLost(f"Report job {job.id} was claimed by another process")
+
+
+def run_job(job):
+    from devices.models import Device, ReportJob
+    from devices.reports.prefetch import prefetch_reports
+
+    devices = Device.objects.all()
+    if job.device_ids is not None:
+        devices = devices.filter(id__in=job.device_ids)
+    # Devices without readings in range would only produce empty results and are left out
+    contexts = prefetch_reports(devices, job.start, job.end)
+    device_ids = [context.device.id for context in contexts]
+
+    job_dir = Path(settings.REPORTS_DIR) / str(job.id)
+    job_dir.mkdir(parents=True, exist_ok=True)
+    zip_path = job_dir / 'reports.zip'
+    owned = ReportJob.objects.filter(id=job.id, claimed_by=job.claimed_by)
+
+    pool = _get_pool()
+    futures = {}
+    failures = []
+    try:
+        _report(job, total=len(device_ids))
+        futures = {
+            pool.submit(render_device_report, device_id, job.start, job.end, str(job_dir), context): device_id
+            for device_id, context in zip(device_ids, contexts)
+        }
+        pending, completed = set(futures), 0
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            while pending:
+                # Wake up at least once per heartbeat, even while a long PDF is rendering
+                done, pending = wait(pending, timeout=settings.REPORT_JOB_HEARTBEAT_SECONDS, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        path = future.result()
+                    except Exception as exc:
+                        if isinstance(exc, BrokenProcessPool):
+                            _discard_pool(pool)
+                        failures.append({'device': futures[future], 'error': str(exc) or type(exc).__name__})
+                        continue
+                    if path:
+                        archive.write(path, Path(path).name)
+                        os.remove(path)
+                completed += len(done)
+                _report(job, completed=completed, failures=failures)
+    except JobLost as exc:
+        for future in futures:
+            future.cancel()
+        print(f"[Reports] {exc}; stopped rendering it here")
+        return
+    except Exception as exc:
+        for future in futures:
+            future.cancel()
+        owned.update(status='failed', error=str(exc), failures=failures, finished_at=timezone.now())
+        print(f"[Reports] Job {job.id} failed: {exc}")
+        return
+
+    if device_ids and len(failures) == len(device_ids):
+        owned.update(status='failed', error='No device report could be rendered', finished_at=timezone.now())
+        print(f"[Reports] Job {job.id} failed: every device failed")
+        return
+    owned.update(status='done', file_path=str(zip_path), finished_at=timezone.now())
+    print(f"[Reports] Job {job.id} finished: {len(device_ids)} devices, {len(failures)} failed")
+
+
+def expire_reports():
+    """Delete the files of jobs finished more than REPORT_RETENTION_HOURS ago. Returns how many expired."""
+    from django.db.models.functions import Now
+    from devices.models import ReportJob
+
+    finished = ('done', 'failed')
+    cutoff = Now() - timedelta(hours=settings.REPORT_RETENTION_HOURS)
+    expired = 0
+    for job_id in ReportJob.objects.filter(status__in=finished, finished_at__lt=cutoff).values_list('id', flat=True):
+        # Whichever process flips the status removes the files
+        if ReportJob.objects.filter(id=job_id, status__in=finished).update(status='expired', file_path=''):
+            shutil.rmtree(Path(settings.REPORTS_DIR) / str(job_id), ignore_errors=True)
+            expired += 1
+    return expired
+
+
+def _dispatch_forever():
+    expired_at = None
+    while True:
+        _wakeup.wait(timeout=JOB_POLL_SECONDS)
+        _wakeup.clear()
+        try:
+            if expired_at is None or time.monotonic() - expired_at >= EXPIRY_CHECK_SECONDS:
+                expired_at = time.monotonic()
+                expire_reports()
+            while (job := _claim_next_job()) is not None:
+                run_job(job)
+        except Exception as exc:
+            print(f"[Reports] Dispatcher error: {exc}")
+        finally:
+            close_old_connections()
+
+
+def ensure_dispatcher():
+    global _dispatcher
+    with _lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = threading.Thread(target=_dispatch_forever, name='report-jobs', daemon=True)
+            _dispatcher.start()
+
+
+def submit(job):
+    """Hand a freshly saved queued job to this process's dispatcher."""
+    ensure_dispatcher()
+    _wakeup.set()
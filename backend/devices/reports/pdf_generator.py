@@ -1 +1,351 @@
- 
\ No newline at end of file
+import os
+from io import BytesIO
+from itertools import islice
+from django.conf import settings
+from django.utils import timezone
+from reportlab.graphics import renderPDF
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from devices.models import Alarm
+from devices.reports import charts, series
+
+# Bump whenever the report layout or content changes so cached PDFs are not served for the old one
+# 2: the alarm list holds the alarms inside the report range instead of the last five
+REPORT_TEMPLATE_VERSION = 2
+
+# Readings table layout, computed once
+TABLE_HEADERS = ("Timestamp", "Temperature", "Humidity")
+TABLE_COLUMN_WIDTHS = (166, 164, 164)
+TABLE_COLUMN_EDGES = tuple(50 + sum(TABLE_COLUMN_WIDTHS[:i]) for i in range(len(TABLE_COLUMN_WIDTHS) + 1))
+TABLE_TEXT_X = tuple(x + 5 for x in TABLE_COLUMN_EDGES[:-1])
+TABLE_ROW_HEIGHT = 20
+TABLE_ROWS_PER_PAGE = 36
+TABLE_FETCH_SIZE = 2000
+TABLE_PAGE_FORM = 'readings_table_page'
+
+
+def iter_reading_rows(device, start=None, end=None):
+    """(local timestamp, temperature, humidity) tuples streamed from the database."""
+    for chunk in series.iter_series_chunks(device, start, end, chunk_size=TABLE_FETCH_SIZE):
+        yield from series.local_rows(chunk)
+
+
+def format_duration(seconds):
+    """'3h 05m' for a number of seconds; '-' when there is no threshold to measure against."""
+    if seconds is None:
+        return "-"
+    minutes = int(round(seconds / 60))
+    return f"{minutes // 60}h {minutes % 60:02d}m"
+
+
+def _draw_table_grid(c, top, row_count):
+    """Cell borders and header for `row_count` rows below `top`, as one path and one text object."""
+    bottom = top - TABLE_ROW_HEIGHT * (row_count + 1)
+    grid = c.beginPath()
+    for x in TABLE_COLUMN_EDGES:
+        grid.moveTo(x, top)
+        grid.lineTo(x, bottom)
+    for i in range(row_count + 2):
+        y = top - i * TABLE_ROW_HEIGHT
+        grid.moveTo(TABLE_COLUMN_EDGES[0], y)
+        grid.lineTo(TABLE_COLUMN_EDGES[-1], y)
+    c.drawPath(grid, stroke=1, fill=0)
+
+    header = c.beginText()
+    header.setFont("Helvetica-Bold", 10)
+    for x, title in zip(TABLE_TEXT_X, TABLE_HEADERS):
+        header.setTextOrigin(x, top - TABLE_ROW_HEIGHT + 5)
+        header.textOut(title)
+    c.drawText(header)
+    return bottom
+
+
+def _draw_table_text(c, rows, top):
+    """Cell text for `rows`, one text object per column."""
+    columns = (
+        [timestamp.strftime("%I:%M %p %d-%m-%Y") for timestamp, _, _ in rows],
+        [f"{temperature:.1f}°C" for _, temperature, _ in rows],
+        [f"{humidity:.1f}%" for _, _, humidity in rows],
+    )
+    for x, lines in zip(TABLE_TEXT_X, columns):
+        text = c.beginText(x, top - 2 * TABLE_ROW_HEIGHT + 5)
+        text.setFont("Helvetica", 9, leading=TABLE_ROW_HEIGHT)
+        text.textLines(lines, trim=0)
+        c.drawText(text)
+
+
+def draw_readings_table(c, rows, y_pos):
+    """Draw the readings table, pulling one page of `rows` at a time from the iterable.
+
+    Full continuation pages share a single grid, stored once in the PDF as a form.
+    """
+    width, height = A4
+    c.setFont("Helvetica-Bold", 12)
+    c.setFillColorRGB(0, 0.75, 0.85)
+    c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
+    c.setFillColor(colors.black)
+    c.drawString(55, y_pos - 15, "Readings Data")
+
+    if y_pos - 250 < 50:
+        c.showPage()
+        y_pos = height - 50
+
+    rows = iter(rows)
+    top = y_pos - 45
+    page = list(islice(rows, TABLE_ROWS_PER_PAGE))
+    full_page_form = None
+    while True:
+        if top == height - 50 and len(page) == TABLE_ROWS_PER_PAGE:
+            if full_page_form is None:
+                full_page_form = TABLE_PAGE_FORM
+                c.beginForm(full_page_form)
+                _draw_table_grid(c, top, TABLE_ROWS_PER_PAGE)
+                c.endForm()
+            c.doForm(full_page_form)
+            current_y = top - TABLE_ROW_HEIGHT * (TABLE_ROWS_PER_PAGE + 1)
+        else:
+            current_y = _draw_table_grid(c, top, len(page))
+        _draw_table_text(c, page, top)
+
+        page = list(islice(rows, TABLE_ROWS_PER_PAGE))
+        if not page:
+            return current_y - 20
+        c.showPage()
+        top = height - 50
+
+
+def generate_pdf_device_report(device, readings, output=None, table_rows=None, context=None, start=None, end=None):
+    """Render the device report from `readings`, a non-empty `series.ReportSeries`.
+
+    The PDF goes to `output` (a file path or writable file object such as an
+    HttpResponse) when given, otherwise to a new BytesIO; either is returned.
+    `table_rows` feeds the readings table, e.g. from `iter_reading_rows`, and
+    defaults to `readings`. `context` is a `prefetch.ReportContext` whose
+    alarms and aggregates replace the per-device queries. The alarms listed
+    are the newest ones within [start, end].
+    """
+    buffer = output if output is not None else BytesIO()
+
+    temp_stats, hum_stats, temp_mkt = series.summarize(device, readings, context.aggregates if context else None)
+
+    # Generate graphs
+    epoch_times = series.epoch_seconds(readings.timestamps)
+    temp_chart_args = (epoch_times, readings.temperatures,
+                       f'Device {device.number} {device.code} - Temperature Over Time', 'Temperature (°C)', 'red')
+    hum_chart_args = (epoch_times, readings.humidities, f'{device.code} - Humidity Over Time', 'Humidity (%)', 'blue')
+    vector_charts = settings.REPORT_CHART_FORMAT == 'vector'
+    if not vector_charts:
+        temp_graph_buf = charts.render_line_chart_png(*temp_chart_args)
+        hum_graph_buf = charts.render_line_chart_png(*hum_chart_args)
+
+    # Start PDF
+    c = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+
+    def draw_header():
+        c.setFont("Helvetica-Bold", 28)
+        c.drawCentredString(width / 2, height - 50, "Data Report")
+
+        c.setFont("Helvetica-Bold", 20)
+        c.setFillColorRGB(0, 0.7, 1)
+        c.drawCentredString(width / 2, height - 80, device.code)
+
+        logo_path = "./assets/goveeIcon.png"
+        if os.path.exists(logo_path):
+            c.drawImage(logo_path, 30, height - 60, width=40,
+                        preserveAspectRatio=True, mask='auto')
+
+        c.setFont("Helvetica-Bold", 12)
+        c.setFillColor(colors.black)
+        c.drawString(50, height - 100, "Location: ")
+        c.setFillColorRGB(0, 0.6, 1)
+        c.drawString(110, height - 100, device.location)
+
+    def draw_device_info(y_pos):
+        c.setFont("Helvetica-Bold", 12)
+        c.setFillColorRGB(0, 0.75, 0.85)
+        c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
+        c.setFillColor(colors.black)
+        c.drawString(55, y_pos - 15, "Device Information")
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(60, y_pos - 35, "Device Model:")
+        c.setFont("Helvetica", 10)
+        c.drawString(140, y_pos - 35, device.code)
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(250, y_pos - 35, "Probe Type:")
+        c.setFont("Helvetica", 10)
+        c.drawString(370, y_pos - 35, "Temperature & Humidity")
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(60, y_pos - 50, "Serial Number:")
+        c.setFont("Helvetica", 10)
+        c.drawString(140, y_pos - 50,
+                    getattr(device, 'serial_number', None) or 'N/A')
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(250, y_pos - 50, "Firmware Version:")
+        c.setFont("Helvetica", 10)
+        c.drawString(370, y_pos - 50, "V5.10")
+
+        return y_pos - 70
+
+    def draw_device_settings(y_pos):
+        c.setFont("Helvetica-Bold", 12)
+        c.setFillColorRGB(0, 0.75, 0.85)
+        c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
+        c.setFillColor(colors.black)
+        c.drawString(55, y_pos - 15, "Device Settings")
+
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(60, y_pos - 35, "Button stop: ")
+        c.drawString(60, y_pos - 50, "Mute Button:")
+        c.drawString(60, y_pos - 65, "Alarm Tone: ")
+        c.drawString(250, y_pos - 35, "Logging Interval: ")
+        c.drawString(250, y_pos - 50, "Alarm Logging Interval: ")
+        c.drawString(250, y_pos - 65, "Storage Mode: ")
+        button_stop="Enable" if device.button_stop_enabled else"Disable"
+        mute_stop="Enable" if device.mute_button_enabled else"Disable"
+        alarm_tone="Enable" if device.alarm_tone_enabled else"Disable"
+        c.setFont("Helvetica", 10)
+        c.drawString(140, y_pos - 35, button_stop)
+        c.drawString(140, y_pos - 50, mute_stop)
+        c.drawString(140, y_pos - 65, alarm_tone)
+        c.drawString(370, y_pos - 35, "15m")
+        c.drawString(370, y_pos - 50, "15m")
+        c.drawString(370, y_pos - 65, "Loop")
+
+        return y_pos - 85
+
+    def draw_alarms(y_pos):
+        c.setFont("Helvetica-Bold", 12)
+        c.setFillColorRGB(0, 0.75, 0.85)
+        c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
+        c.setFillColor(colors.black)
+        c.drawString(55, y_pos - 15, "Alarm Status")
+
+        if context is not None:
+            alarms = context.alarms
+        else:
+            alarms = Alarm.objects.filter(device=device)
+            if start:
+                alarms = alarms.filter(timestamp__gte=start)
+            if end:
+                alarms = alarms.filter(timestamp__lte=end)
+            alarms = list(alarms.order_by('-timestamp')[:5])
+        y = y_pos - 35
+        if alarms:
+            for alarm in alarms:
+                message = f"[{timezone.localtime(alarm.timestamp).strftime('%Y-%m-%d %H:%M')}] {alarm.alarm_type.upper()} - {alarm.user_message()}"
+                c.drawString(60, y, message[:100])
+                y -= 15
+                if y < 100:
+                    c.showPage()
+                    y = height - 50
+        else:
+            c.setFillColorRGB(0.2, 0.2, 0.8)
+            c.drawString(60, y, "There are no available alarms.")
+            y -= 15
+
+        c.setFillColor(colors.black)
+        return y
+
+    def draw_summary(y_pos):
+        c.setFont("Helvetica-Bold", 12)
+        c.setFillColorRGB(0, 0.75, 0.85)
+        c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
+        c.setFillColor(colors.black)
+        c.drawString(55, y_pos - 15, "Summary")
+
+        c.setFillColorRGB(0.2, 0.4, 1)
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(110, y_pos - 40, "Temperature")
+
+        y = y_pos - 60
+        c.setFillColor(colors.black)
+
+        temp_labels = ["Maximum:", "Minimum:", "Average:", "Median:", "95th pct:", "MKT:", "Above max:", "Below min:"]
+        temp_values = [f"{temp_stats.maximum:.1f}", f"{temp_stats.minimum:.1f}", f"{temp_stats.mean:.2f}",
+                       f"{temp_stats.median:.1f}", f"{temp_stats.p95:.1f}", f"{temp_mkt:.2f}",
+                       format_duration(temp_stats.seconds_above), format_duration(temp_stats.seconds_below)]
+
+        for label, value in zip(temp_labels, temp_values):
+            c.setFont("Helvetica-Bold", 10)
+            c.drawString(90, y, label)
+            c.setFont("Helvetica", 10)
+            c.drawString(160, y, value)
+            y -= 15
+
+        c.setFillColorRGB(0.2, 0.4, 1)
+        c.setFont("Helvetica-Bold", 11)
+        c.drawString(400, y_pos - 40, "Humidity")
+
+        y = y_pos - 60
+        c.setFillColor(colors.black)
+
+        hum_labels = ["Maximum:", "Minimum:", "Average:", "Median:", "95th pct:", "Above max:", "Below min:"]
+        hum_values = [f"{hum_stats.maximum:.1f}", f"{hum_stats.minimum:.1f}", f"{hum_stats.mean:.2f}",
+                      f"{hum_stats.median:.1f}", f"{hum_stats.p95:.1f}",
+                      format_duration(hum_stats.seconds_above), format_duration(hum_stats.seconds_below)]
+
+        for label, value in zip(hum_labels, hum_values):
+            c.setFont("Helvetica-Bold", 10)
+            c.drawString(380, y, label)
+            c.setFont("Helvetica", 10)
+            c.drawString(450, y, value)
+            y -= 15
+
+        return y_pos - 60 - 15 * len(temp_labels) - 10
+
+    def draw_graphs(y_pos):
+        # Temperature Graph
+        if y_pos - 180 < 50:
+            c.showPage()
+            y_pos = height - 50
+        if vector_charts:
+            renderPDF.draw(charts.render_line_chart_drawing(*temp_chart_args), c, 70, y_pos - 150)
+        else:
+            temp_img = ImageReader(temp_graph_buf)
+            c.drawImage(temp_img, 70, y_pos - 150, width=450, height=150)
+        y_pos -= 180
+
+        # Humidity Graph
+        if y_pos - 180 < 50:
+            c.showPage()
+            y_pos = height - 50
+        if vector_charts:
+            renderPDF.draw(charts.render_line_chart_drawing(*hum_chart_args), c, 70, y_pos - 150)
+        else:
+            hum_img = ImageReader(hum_graph_buf)
+            c.drawImage(hum_img, 70, y_pos - 150, width=450, height=150)
+        y_pos -= 180
+
+        return y_pos
+
+    # ==== Main Drawing Sequence ====
+    draw_header()
+    current_y = height - 125
+
+    current_y = draw_device_info(current_y)
+    current_y = draw_device_settings(current_y)
+    current_y = draw_alarms(current_y)
+
+    if current_y < 100:
+        c.showPage()
+        current_y = height - 50
+
+    current_y = draw_summary(current_y)
+    current_y = draw_graphs(current_y)
+
+    c.showPage()
+    if table_rows is None:
+        table_rows = series.local_rows(readings)
+    draw_readings_table(c, table_rows, height - 50)
+
+    c.save()
+    if output is None:
+        buffer.seek(0)
+    return buffer
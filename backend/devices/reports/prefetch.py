@@ -0,0 +1,68 @@
+"""Batch loading for multi-device reports.
+
+Everything a set of reports needs besides the raw readings (the devices,
+each device's latest alarms in range and its reading aggregates) is loaded in a
+fixed number of queries, however many devices are involved.
+"""
+from collections import defaultdict, namedtuple
+from django.db.models import Avg, Count, F, Max, Min, Window
+from django.db.models.functions import RowNumber
+from devices.models import Alarm, Reading
+
+RECENT_ALARMS = 5
+
+ReportContext = namedtuple('ReportContext', ['device', 'alarms', 'aggregates'])
+
+
+def reading_aggregates(device_ids=None, start=None, end=None):
+    """device id -> count and min/max/avg of each column, from one GROUP BY query.
+
+    `device_ids=None` covers every device. Devices without readings in range are absent.
+    """
+    readings = Reading.objects.all()
+    if device_ids is not None:
+        readings = readings.filter(device_id__in=device_ids)
+    if start:
+        readings = readings.filter(timestamp__gte=start)
+    if end:
+        readings = readings.filter(timestamp__lte=end)
+    rows = readings.values('device_id').annotate(
+        count=Count('id'),
+        temperature_min=Min('temperature'),
+        temperature_max=Max('temperature'),
+        temperature_avg=Avg('temperature'),
+        humidity_min=Min('humidity'),
+        humidity_max=Max('humidity'),
+        humidity_avg=Avg('humidity'),
+    ).order_by()
+    return {row.pop('device_id'): row for row in rows}
+
+
+def recent_alarms(device_ids, start=None, end=None, limit=RECENT_ALARMS):
+    """device id -> its `limit` newest alarms in [start, end], newest first, from one windowed query."""
+    alarms = Alarm.objects.filter(device_id__in=device_ids)
+    if start:
+        alarms = alarms.filter(timestamp__gte=start)
+    if end:
+        alarms = alarms.filter(timestamp__lte=end)
+    alarms = alarms.annotate(
+        rank=Window(RowNumber(), partition_by=F('device_id'), order_by=F('timestamp').desc()),
+    ).filter(rank__lte=limit).order_by('device_id', '-timestamp')
+    by_device = defaultdict(list)
+    for alarm in alarms:
+        by_device[alarm.device_id].append(alarm)
+    return by_device
+
+
+def prefetch_reports(devices, start=None, end=None):
+    """ReportContext for each device in the queryset that has readings in [start, end].
+
+    Three queries in total: devices, aggregates and alarms.
+    """
+    devices = list(devices.order_by('id'))
+    aggregates = reading_aggregates([device.id for device in devices], start, end)
+    alarms = recent_alarms(list(aggregates), start, end)
+    return [
+        ReportContext(device, alarms.get(device.id, []), aggregates[device.id])
+        for device in devices if device.id in aggregates
+    ]
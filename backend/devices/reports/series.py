@@ -0,0 +1,127 @@
+"""Columnar reading data and summary statistics for device reports.
+
+Readings are fetched with `values_list` into NumPy arrays, one array per
+column, instead of model instances. Timestamps stay in UTC as
+datetime64[us]; `to_local` shifts a whole array into the current timezone
+at once when wall-clock times are needed.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+import numpy as np
+from django.utils import timezone
+
+ReportSeries = namedtuple('ReportSeries', ['timestamps', 'temperatures', 'humidities'])
+
+SeriesStats = namedtuple('SeriesStats', [
+    'minimum', 'maximum', 'mean', 'median', 'p95', 'seconds_above', 'seconds_below',
+])
+
+# Mean kinetic temperature: activation energy over the gas constant, 83.144 kJ/mol / 8.3144 J/(mol*K)
+MKT_ACTIVATION_KELVIN = 10000.0
+KELVIN_OFFSET = 273.15
+
+
+def _readings(device, start=None, end=None):
+    readings = device.readings.order_by('timestamp')
+    if start:
+        readings = readings.filter(timestamp__gte=start)
+    if end:
+        readings = readings.filter(timestamp__lte=end)
+    return readings.values_list('timestamp', 'temperature', 'humidity')
+
+
+def _to_series(rows):
+    count = len(rows)
+    epoch = np.fromiter((row[0].timestamp() for row in rows), dtype=np.float64, count=count)
+    return ReportSeries(
+        timestamps=np.round(epoch * 1e6).astype(np.int64).view('datetime64[us]'),
+        temperatures=np.fromiter((row[1] for row in rows), dtype=np.float64, count=count),
+        humidities=np.fromiter((row[2] for row in rows), dtype=np.float64, count=count),
+    )
+
+
+def fetch_series(device, start=None, end=None):
+    """The device's readings in [start, end] as a ReportSeries, oldest first."""
+    return _to_series(list(_readings(device, start, end)))
+
+
+def iter_series_chunks(device, start=None, end=None, chunk_size=2000):
+    """The same readings as `fetch_series`, streamed as ReportSeries of at most `chunk_size` rows."""
+    rows = _readings(device, start, end).iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        yield _to_series(chunk)
+
+
+def epoch_seconds(timestamps):
+    return timestamps.astype('datetime64[us]').astype(np.int64) / 1e6
+
+
+def to_local(timestamps, tz=None):
+    """Shift UTC datetime64 values to naive wall-clock times in `tz` (default: current timezone).
+
+    The UTC offset is looked up once per distinct hour, not once per value.
+    """
+    tz = tz or timezone.get_current_timezone()
+    timestamps = timestamps.astype('datetime64[us]')
+    if not timestamps.size:
+        return timestamps
+    hours, inverse = np.unique(timestamps.astype('datetime64[h]'), return_inverse=True)
+    offsets = np.array([
+        datetime.fromtimestamp(int(hour.astype(np.int64)) * 3600, tz).utcoffset() // timedelta(microseconds=1)
+        for hour in hours
+    ], dtype=np.int64)
+    return timestamps + offsets[inverse].astype('timedelta64[us]')
+
+
+def sample_durations(timestamps, interval_seconds):
+    """Seconds each reading stands for: up to the next reading, capped at the logging interval."""
+    durations = np.full(timestamps.size, float(interval_seconds))
+    if timestamps.size > 1:
+        np.minimum(np.diff(epoch_seconds(timestamps)), interval_seconds, out=durations[:-1])
+    return durations
+
+
+def series_stats(values, durations, low=None, high=None, known=None):
+    """Stats for one column; `known` (minimum, maximum, mean) skips recomputing what the database returned."""
+    median, p95 = np.percentile(values, [50, 95])
+    minimum, maximum, mean = known or (values.min(), values.max(), values.mean())
+    return SeriesStats(
+        minimum=float(minimum),
+        maximum=float(maximum),
+        mean=float(mean),
+        median=float(median),
+        p95=float(p95),
+        seconds_above=float(durations[values > high].sum()) if high is not None else None,
+        seconds_below=float(durations[values < low].sum()) if low is not None else None,
+    )
+
+
+def mean_kinetic_temperature(temperatures, durations):
+    """Time-weighted mean kinetic temperature in °C."""
+    kelvin = temperatures + KELVIN_OFFSET
+    mean_rate = np.average(np.exp(-MKT_ACTIVATION_KELVIN / kelvin), weights=durations)
+    return float(MKT_ACTIVATION_KELVIN / -np.log(mean_rate) - KELVIN_OFFSET)
+
+
+def summarize(device, series, aggregates=None):
+    """(temperature stats, humidity stats, mean kinetic temperature) for a non-empty series.
+
+    `aggregates` is the device's entry from `prefetch.reading_aggregates`, when already loaded.
+    """
+    durations = sample_durations(series.timestamps, device.logging_interval_minutes * 60)
+    temperature_known = humidity_known = None
+    if aggregates:
+        temperature_known = (aggregates['temperature_min'], aggregates['temperature_max'], aggregates['temperature_avg'])
+        humidity_known = (aggregates['humidity_min'], aggregates['humidity_max'], aggregates['humidity_avg'])
+    temperature = series_stats(series.temperatures, durations, device.alert_temp_min, device.alert_temp_max,
+                               temperature_known)
+    humidity = series_stats(series.humidities, durations, device.alert_humidity_min, device.alert_humidity_max,
+                            humidity_known)
+    return temperature, humidity, mean_kinetic_temperature(series.temperatures, durations)
+
+
+def local_rows(series):
+    """(local datetime, temperature, humidity) tuples for the readings table."""
+    local = to_local(series.timestamps).astype(object)
+    return zip(local, series.temperatures.tolist(), series.humidities.tolist())
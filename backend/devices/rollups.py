@@ -0,0 +1,292 @@
+"""Hourly and daily reading rollups, kept current as readings are written.
+
+New readings are folded into their buckets with an upsert that adds counts
+and sums and widens min/max. Readings that are edited or deleted can't be
+folded out again, so the buckets they touch are recomputed from the raw rows.
+On PostgreSQL both hold per-device advisory locks for their transaction,
+shared while folding and exclusive while recomputing, so a concurrent
+write is neither lost nor counted twice.
+
+Hourly buckets are UTC hours. Daily buckets are calendar days in
+TIME_ZONE (23 or 25 hours long across a DST change), so a '1d' point
+covers the same day the dashboard shows.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from .models import Reading, ReadingRollup
+
+# Resolution -> (NumPy datetime unit, Trunc kind, bucket length)
+RESOLUTIONS = {
+    '1h': ('h', 'hour', timedelta(hours=1)),
+    '1d': ('D', 'day', timedelta(days=1)),
+}
+
+# Advisory lock keys are (namespace, device id); device id 0 stands for the whole fleet
+LOCK_NAMESPACE = 0x726F6C6C  # 'roll'
+FLEET_LOCK = 0
+
+_STAT_COLUMNS = (
+    'count', 'temperature_min', 'temperature_max', 'temperature_sum',
+    'humidity_min', 'humidity_max', 'humidity_sum',
+)
+
+
+def local_day_starts(timestamps):
+    """UTC start of the TIME_ZONE calendar day of each UTC `datetime64` value."""
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    if not timestamps.size:
+        return timestamps
+    zone = timezone.get_default_timezone()
+    # UTC offsets only change on the hour, so one lookup per distinct hour covers every row
+    hours, inverse = np.unique(timestamps.astype('datetime64[h]'), return_inverse=True)
+    offsets = np.array([
+        int(hour.replace(tzinfo=dt_timezone.utc).astimezone(zone).utcoffset().total_seconds())
+        for hour in hours.astype('datetime64[us]').tolist()
+    ], dtype='timedelta64[s]')
+    days, day_inverse = np.unique((timestamps + offsets[inverse.ravel()]).astype('datetime64[D]'), return_inverse=True)
+    starts = np.array([
+        datetime.combine(day, time(), tzinfo=zone).astimezone(dt_timezone.utc).replace(tzinfo=None)
+        for day in days.tolist()
+    ], dtype='datetime64[us]')
+    return starts[day_inverse.ravel()]
+
+
+def aggregate_buckets(device_ids, timestamps, temperatures, humidities, unit):
+    """Group a batch by (device, bucket) and reduce it to rollup statistics with NumPy.
+
+    `unit` is a NumPy datetime unit ('h', '5m', ...); 'D' buckets by TIME_ZONE calendar
+    day. Returns the per-group device ids and bucket starts plus a dict of statistic arrays.
+    """
+    device_ids = np.asarray(device_ids, dtype=np.int64)
+    if unit == 'D':
+        buckets = local_day_starts(timestamps)
+    else:
+        buckets = np.asarray(timestamps, dtype='datetime64[us]').astype(f'datetime64[{unit}]')
+    temperatures = np.asarray(temperatures, dtype=float)
+    humidities = np.asarray(humidities, dtype=float)
+
+    order = np.lexsort((buckets, device_ids))
+    device_ids, buckets = device_ids[order], buckets[order]
+    temperatures, humidities = temperatures[order], humidities[order]
+
+    new_group = np.r_[True, (device_ids[1:] != device_ids[:-1]) | (buckets[1:] != buckets[:-1])]
+    starts = np.flatnonzero(new_group)
+    stats = {
+        'count': np.diff(np.r_[starts, len(order)]),
+        'temperature_min': np.minimum.reduceat(temperatures, starts),
+        'temperature_max': np.maximum.reduceat(temperatures, starts),
+        'temperature_sum': np.add.reduceat(temperatures, starts),
+        'humidity_min': np.minimum.reduceat(humidities, starts),
+        'humidity_max': np.maximum.reduceat(humidities, starts),
+        'humidity_sum': np.add.reduceat(humidities, starts),
+    }
+    return device_ids[starts], buckets[starts], stats
+
+
+def _upsert_sql():
+    quote = connection.ops.quote_name
+    table = quote(ReadingRollup._meta.db_table)
+    least, greatest = ('LEAST', 'GREATEST') if connection.vendor == 'postgresql' else ('MIN', 'MAX')
+    columns = ('device_id', 'resolution', 'bucket') + _STAT_COLUMNS
+    return (
+        f"INSERT INTO {table} ({', '.join(quote(c) for c in columns)}) "
+        f"VALUES ({', '.join(['%s'] * len(columns))}) "
+        f"ON CONFLICT ({quote('device_id')}, {quote('resolution')}, {quote('bucket')}) DO UPDATE SET "
+        f"{quote('count')} = {table}.{quote('count')} + EXCLUDED.{quote('count')}, "
+        + ', '.join(
+            f"{quote(c)} = {least if c.endswith('_min') else greatest}({table}.{quote(c)}, EXCLUDED.{quote(c)})"
+            if not c.endswith('_sum') else f"{quote(c)} = {table}.{quote(c)} + EXCLUDED.{quote(c)}"
+            for c in _STAT_COLUMNS[1:]
+        )
+    )
+
+
+def lock_devices(device_ids, exclusive=False):
+    """Take the rollup locks of `device_ids` (None for every device) until the transaction ends.
+
+    Every holder takes the fleet lock shared first, then its devices in id order, so
+    holders never deadlock; a rebuild of the whole fleet takes the fleet lock exclusively.
+    A no-op off PostgreSQL, where writing transactions are serialized already.
+    """
+    if connection.vendor != 'postgresql':
+        return
+    shared = 'pg_advisory_xact_lock_shared'
+    function = 'pg_advisory_xact_lock' if exclusive else shared
+    with connection.cursor() as cursor:
+        if device_ids is None:
+            cursor.execute(f"SELECT {function}(%s, %s)", [LOCK_NAMESPACE, FLEET_LOCK])
+            return
+        cursor.execute(f"SELECT {shared}(%s, %s)", [LOCK_NAMESPACE, FLEET_LOCK])
+        # unnest keeps the array order, so the locks are taken in id order
+        cursor.execute(
+            f"SELECT {function}(%s, device_id) FROM unnest(%s::int[]) AS device_id",
+            [LOCK_NAMESPACE, sorted(set(int(device_id) for device_id in device_ids))],
+        )
+
+
+def apply_batch(device_ids, timestamps, temperatures, humidities):
+    """Fold newly inserted readings into every rollup resolution. Timestamps are UTC `datetime64`.
+
+    Call it in the transaction that inserts the readings.
+    """
+    if not len(timestamps):
+        return
+    device_ids = np.broadcast_to(np.asarray(device_ids, dtype=np.int64), (len(timestamps),))
+    adapt = connection.ops.adapt_datetimefield_value
+    sql = _upsert_sql()
+    rows = []
+    for resolution, (unit, _, _) in RESOLUTIONS.items():
+        ids, buckets, stats = aggregate_buckets(device_ids, timestamps, temperatures, humidities, unit)
+        bucket_starts = [
+            adapt(b.replace(tzinfo=dt_timezone.utc)) for b in buckets.astype('datetime64[us]').tolist()
+        ]
+        columns = [stats[c].tolist() for c in _STAT_COLUMNS]
+        rows.extend(
+            (device_id, resolution, bucket, *values)
+            for device_id, bucket, *values in zip(ids.tolist(), bucket_starts, *columns)
+        )
+    with transaction.atomic():
+        lock_devices(np.unique(device_ids).tolist())
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, rows)
+
+
+def _bucket_zone(kind):
+    return timezone.get_default_timezone() if kind == 'day' else dt_timezone.utc
+
+
+def _bucket_floor(value, kind):
+    if kind == 'day':
+        local = timezone.localtime(value)
+        # A midnight skipped by DST resolves to the moment the day actually starts
+        return datetime.combine(local.date(), time(), tzinfo=local.tzinfo).astimezone(dt_timezone.utc)
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _next_bucket(bucket, kind, length):
+    # Half a bucket of slack steps over days of 23 or 25 hours
+    return _bucket_floor(bucket + length * 1.5, kind)
+
+
+def rebuild(device_ids=None, start=None, end=None, resolutions=tuple(RESOLUTIONS)):
+    """Recompute every bucket overlapping [start, end] from the raw readings.
+
+    Runs in one transaction holding the devices' rollup locks exclusively, so readings
+    written meanwhile are folded in after it rather than deleted with the old buckets.
+    """
+    with transaction.atomic():
+        lock_devices(device_ids, exclusive=True)
+        for resolution in resolutions:
+            _rebuild_resolution(resolution, device_ids, start, end)
+
+
+def _rebuild_resolution(resolution, device_ids, start, end):
+    _, kind, length = RESOLUTIONS[resolution]
+    readings = Reading.objects.all()
+    rollups = ReadingRollup.objects.filter(resolution=resolution)
+    if device_ids is not None:
+        readings = readings.filter(device_id__in=device_ids)
+        rollups = rollups.filter(device_id__in=device_ids)
+    # Widen the range to whole buckets so partially covered ones are recomputed completely
+    if start is not None:
+        start_bucket = _bucket_floor(start, kind)
+        readings = readings.filter(timestamp__gte=start_bucket)
+        rollups = rollups.filter(bucket__gte=start_bucket)
+    if end is not None:
+        end_bucket = _next_bucket(_bucket_floor(end, kind), kind, length)
+        readings = readings.filter(timestamp__lt=end_bucket)
+        rollups = rollups.filter(bucket__lt=end_bucket)
+
+    rollups.delete()
+    grouped = (
+        readings.annotate(bucket=Trunc('timestamp', kind, tzinfo=_bucket_zone(kind)))
+        .values('device_id', 'bucket')
+        .annotate(
+            count=Count('id'),
+            temperature_min=Min('temperature'), temperature_max=Max('temperature'),
+            temperature_sum=Sum('temperature'),
+            humidity_min=Min('humidity'), humidity_max=Max('humidity'),
+            humidity_sum=Sum('humidity'),
+        )
+        .order_by()
+    )
+    ReadingRollup.objects.bulk_create(
+        (ReadingRollup(resolution=resolution, **row) for row in grouped.iterator(chunk_size=5000)),
+        batch_size=5000,
+    )
+
+
+# Longest span served at each resolution when the client doesn't ask for one
+AUTO_RESOLUTION_SPANS = (
+    (timedelta(days=2), 'raw'),
+    (timedelta(days=14), '5m'),
+    (timedelta(days=120), '1h'),
+)
+
+
+def pick_resolution(start, end):
+    span = end - start
+    for longest, resolution in AUTO_RESOLUTION_SPANS:
+        if span <= longest:
+            return resolution
+    return '1d'
+
+
+def _series_rows(buckets, stats):
+    counts = stats['count']
+    rows = zip(
+        buckets, counts.tolist(),
+        np.round(stats['temperature_sum'] / counts, 2).tolist(),
+        np.round(stats['humidity_sum'] / counts, 2).tolist(),
+        stats['temperature_min'].tolist(), stats['temperature_max'].tolist(),
+        stats['humidity_min'].tolist(), stats['humidity_max'].tolist(),
+    )
+    return [
+        {
+            'timestamp': timestamp, 'count': count,
+            'temperature': temperature, 'humidity': humidity,
+            'temperature_min': temp_min, 'temperature_max': temp_max,
+            'humidity_min': hum_min, 'humidity_max': hum_max,
+        }
+        for timestamp, count, temperature, humidity, temp_min, temp_max, hum_min, hum_max in rows
+    ]
+
+
+def rollup_series(device_id, resolution, start=None, end=None):
+    """Chart points for one device: averages plus min/max/count per bucket, oldest first.
+
+    '1h' and '1d' read the rollup table; '5m' buckets the raw rows in NumPy,
+    which is only picked automatically for short spans.
+    """
+    if resolution == '5m':
+        readings = Reading.objects.filter(device_id=device_id)
+        if start is not None:
+            readings = readings.filter(timestamp__gte=start)
+        if end is not None:
+            readings = readings.filter(timestamp__lte=end)
+        values = list(readings.values_list('timestamp', 'temperature', 'humidity'))
+        if not values:
+            return []
+        timestamps, temperatures, humidities = zip(*values)
+        stamps = np.array([t.astimezone(dt_timezone.utc).replace(tzinfo=None) for t in timestamps],
+                          dtype='datetime64[us]')
+        _, buckets, stats = aggregate_buckets(np.full(len(stamps), device_id), stamps, temperatures, humidities, '5m')
+        bucket_starts = [b.replace(tzinfo=dt_timezone.utc) for b in buckets.astype('datetime64[us]').tolist()]
+        return _series_rows(bucket_starts, stats)
+
+    _, kind, _ = RESOLUTIONS[resolution]
+    rollups = ReadingRollup.objects.filter(device_id=device_id, resolution=resolution)
+    if start is not None:
+        rollups = rollups.filter(bucket__gte=_bucket_floor(start, kind))
+    if end is not None:
+        rollups = rollups.filter(bucket__lte=end)
+    rows = list(rollups.order_by('bucket').values_list('bucket', *_STAT_COLUMNS))
+    if not rows:
+        return []
+    buckets, *columns = zip(*rows)
+    stats = {name: np.array(column) for name, column in zip(_STAT_COLUMNS, columns)}
+    return _series_rows(list(buckets), stats)
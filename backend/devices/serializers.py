@@ -2,7 +2,7 @@
 from datetime import date, datetime
 from django.utils import timezone
 from rest_framework import serializers
-from .models import Alarm, Device,Manufacturer, Reading
+from .models import Alarm, Device,Manufacturer, Reading, ReportJob
 
 class DeviceSerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,6 +14,19 @@ class ReadingSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reading
         fields = '__all__'
+        # A (device, timestamp) slot that is already taken is updated by create() instead of rejected
+        validators = []
+
+    created = True
+
+    def validate(self, attrs):
+        if self.instance is not None:
+            device = attrs.get('device', self.instance.device)
+            timestamp = attrs.get('timestamp', self.instance.timestamp)
+            if Reading.objects.filter(device=device, timestamp=timestamp).exclude(pk=self.instance.pk).exists():
+                raise serializers.ValidationError("This device already has a reading at that timestamp.")
+        return attrs
+
     def create(self, validated_data):
         # Automatically set the timestamp to the current time
         started_date=validated_data.get('started_at')
@@ -22,7 +35,13 @@ class ReadingSerializer(serializers.ModelSerializer):
                 now = timezone.now()
                 started_date = datetime.combine(started_date,now.time())
                 validated_data['started_at'] = timezone.make_aware(started_date, timezone.get_current_timezone())
-        return super().create(validated_data)
+        # Retried posts land on the same slot; the unique constraint keeps update_or_create race-free
+        reading, self.created = Reading.objects.update_or_create(
+            device=validated_data.pop('device'),
+            timestamp=validated_data.pop('timestamp', None) or timezone.now(),
+            defaults=validated_data,
+        )
+        return reading
 
  
 
@@ -42,3 +61,20 @@ class ManufacturerSerializer(serializers.ModelSerializer):
         model = Manufacturer
         fields = '__all__'
 
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ['id', 'status', 'device_ids', 'start', 'end', 'total', 'completed', 'progress',
+                  'error', 'failures', 'created_at', 'finished_at']
+        read_only_fields = ['status', 'total', 'completed', 'error', 'failures', 'created_at', 'finished_at']
+
+    def get_progress(self, obj):
+        return round(obj.completed / obj.total, 3) if obj.total else 0.0
+
+    def validate_device_ids(self, value):
+        if value is not None and (not isinstance(value, list) or not all(isinstance(i, int) for i in value)):
+            raise serializers.ValidationError("device_ids must be a list of integers or null for all devices")
+        return value
@@ -0,0 +1,53 @@
+"""Consistent hashing of devices onto simulator shards.
+
+Every shard owns VIRTUAL_NODES points on a 64-bit ring, and a device
+belongs to the shard of the first point at or after its own hash. When a
+shard joins or leaves, only the devices between its points and their
+predecessors change owner (about 1/K of the fleet); adding or removing a
+device never moves any other device. Hashes are computed with NumPy over
+whole id arrays, so assigning a fleet costs a handful of array operations.
+"""
+import numpy as np
+
+# Points per shard; more points even out the share of devices each shard gets
+VIRTUAL_NODES = 64
+
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(values):
+    """SplitMix64 finalizer over a uint64 array: well-spread, stable across processes and runs."""
+    with np.errstate(over='ignore'):
+        z = np.asarray(values, dtype=np.uint64) + _GOLDEN
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return z ^ (z >> np.uint64(31))
+
+
+class HashRing:
+    def __init__(self, shards, virtual_nodes=VIRTUAL_NODES):
+        self.shards = tuple(sorted(shards))
+        owners = np.repeat(np.array(self.shards, dtype=np.int64), virtual_nodes)
+        replicas = np.tile(np.arange(virtual_nodes, dtype=np.int64), len(self.shards))
+        # Points come from a different input range than device ids so they don't line up with them
+        points = _mix(((owners + 1) << 32 | replicas).astype(np.uint64) ^ np.uint64(0xA5A5A5A5A5A5A5A5))
+        order = np.argsort(points)
+        self._points = points[order]
+        self._owners = owners[order]
+
+    def __eq__(self, other):
+        return isinstance(other, HashRing) and self.shards == other.shards
+
+    def shard_of(self, device_ids):
+        """Shard number per device id."""
+        if not self.shards:
+            raise ValueError("A hash ring needs at least one shard")
+        positions = np.searchsorted(self._points, _mix(device_ids)) % len(self._points)
+        return self._owners[positions]
+
+    def owned(self, devices, shard):
+        """The devices (objects with an `id`) that belong to `shard`."""
+        if not devices:
+            return []
+        mine = self.shard_of([device.id for device in devices]) == shard
+        return [device for device, is_mine in zip(devices, mine.tolist()) if is_mine]
@@ -1,46 +1,54 @@
-from django.db.models.signals import post_save
+import numpy as np
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
 from django.dispatch import receiver
+from . import counters, live, rollups
+from .alarms import alarm_states, evaluate_readings
+from .cache import bump_version, device_configs, last_readings
 from .models import Device, Reading, Alarm
+from .simulation import to_datetime64
 
 # === Reading-triggered alarms ===
 @receiver(post_save, sender=Reading)
-def handle_new_reading(sender, instance, **kwargs):
-    device = instance.device
-
-    # Only generate reading-based alarms when device is ON
-    if device.status == 'on':
-        check_and_create_reading_alarms(
-            device, instance.temperature, instance.humidity, instance.timestamp
+def handle_new_reading(sender, instance, created, **kwargs):
+    last_readings.record(instance.device_id, instance.timestamp)
+    if created:
+        # Edits are re-rolled up by the views that make them (see ReadingViewSet)
+        rollups.apply_batch(
+            instance.device_id, np.array([to_datetime64(instance.timestamp)]),
+            [instance.temperature], [instance.humidity],
         )
+        counters.add({(instance.device_id, counters.READINGS): 1})
+    transaction.on_commit(lambda: live.publish_readings(
+        instance.device_id, [to_datetime64(instance.timestamp)], [instance.temperature], [instance.humidity],
+    ))
+    evaluate_readings(instance.device_id, [instance.timestamp], [instance.temperature], [instance.humidity])
 
 
-def check_and_create_reading_alarms(device, temperature, humidity, reading_timestamp):
-    def create_or_update_alarm(alarm_type, value=None):
-        alarm, created = Alarm.objects.get_or_create(
-            device=device,
-            alarm_type=alarm_type,
-            acknowledged=False,
-            active=True,
-            defaults={
-                "triggered_value": value,
-                "timestamp": reading_timestamp,
-            },
-        )
-        if not created:
-            # Update the alarm if it already exists (e.g. overwritten reading)
-            alarm.triggered_value = value
-            alarm.timestamp = reading_timestamp
-            alarm.save(update_fields=["triggered_value", "timestamp"])
+# === Counters and live feed for alarms created through the ORM ===
+# Reading alarms are upserted in bulk and handled by the alarm engine itself.
+@receiver(post_save, sender=Alarm)
+def handle_new_alarm(sender, instance, created, **kwargs):
+    if created and not instance.acknowledged:
+        counters.add_alarms([(instance.device_id, instance.alarm_type)])
+        transaction.on_commit(lambda: live.publish_alarms([
+            (instance.device_id, instance.alarm_type, 'raised', instance.triggered_value, instance.timestamp),
+        ]))
 
-    if device.alert_temp_max is not None and temperature > device.alert_temp_max:
-        create_or_update_alarm("TEMP_HI", temperature)
-    elif device.alert_temp_min is not None and temperature < device.alert_temp_min:
-        create_or_update_alarm("TEMP_LO", temperature)
 
-    if device.alert_humidity_max is not None and humidity > device.alert_humidity_max:
-        create_or_update_alarm("HUM_HI", humidity)
-    elif device.alert_humidity_min is not None and humidity < device.alert_humidity_min:
-        create_or_update_alarm("HUM_LO", humidity)
+# === Status change time, where the simulator resumes a device switched back on ===
+@receiver(pre_save, sender=Device)
+def track_status_change(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None:
+        return
+    previous = Device.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+    if previous is None or previous == instance.status:
+        return
+    instance.status_changed_at = timezone.now()
+    if update_fields is not None:
+        # A save limited to other fields wouldn't write it
+        Device.objects.filter(pk=instance.pk).update(status_changed_at=instance.status_changed_at)
 
 
 # === Status-triggered alarms ===
@@ -66,3 +74,21 @@ def handle_device_status_change(sender, instance, created, **kwargs):
 
     if not instance.mute_button_enabled:
         create_status_alarm("MD")
+
+
+# === Device configuration cache ===
+@receiver(post_save, sender=Device)
+def handle_device_config_change(sender, instance, **kwargs):
+    version = bump_version()
+    transaction.on_commit(lambda: device_configs.update(instance, version))
+
+
+# === Cache invalidation on device delete ===
+# Deleting a single reading is handled by ReadingViewSet; a post_delete receiver on
+# Reading would force every device delete to load its readings one by one.
+@receiver(post_delete, sender=Device)
+def handle_device_delete(sender, instance, **kwargs):
+    last_readings.invalidate(instance.id)
+    alarm_states.forget(instance.id)
+    version = bump_version()
+    transaction.on_commit(lambda: device_configs.remove(instance.id, version))
@@ -1,87 +1,400 @@
-import random
-from datetime import timedelta
+import io
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, timezone as dt_timezone
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Random, Round
 from django.utils import timezone
+from . import counters, live, rollups
+from .cache import device_configs, last_readings
 from .models import Reading
 
-def generate_random_reading(device_id):
-    from .models import Device  # Local import to avoid circular dependency
-    device = Device.objects.get(id=device_id)
+# Rows per INSERT round trip when bulk loading readings (COPY on PostgreSQL streams everything at once)
+BULK_BATCH_SIZE = 5000
 
-    temp = round(random.uniform(device.temperature_min, device.temperature_max), 2)
-    humidity = round(random.uniform(device.humidity_min, device.humidity_max), 2)
-    # timestamp=timezone.now
-    last_reading = Reading.objects.filter(device=device).order_by('-timestamp').first()
-    
-    interval = timedelta(minutes=device.logging_interval_minutes or 15)
-    
-    timestamp = last_reading.timestamp+interval
-
-    Reading.objects.create(
-        device=device,
-        temperature=temp,
-        humidity=humidity,
-        timestamp=timestamp
+_rng = np.random.default_rng()
+
+TickStats = namedtuple('TickStats', ['devices', 'readings', 'backlog', 'elapsed_ms'])
+
+
+def build_fleet_series(devices, first_timestamps, counts):
+    """Series for several devices in one vectorized pass, ordered by device then time.
+
+    `first_timestamps` are UTC `datetime64` values, one per device.
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    total = int(counts.sum())
+    device_ids = np.repeat(np.array([d.id for d in devices], dtype=np.int64), counts)
+
+    steps = np.array(
+        [(d.logging_interval_minutes or 15) * 60_000_000 for d in devices], dtype=np.int64
+    ).astype('timedelta64[us]')
+    # Position of every row inside its own device's run: 0, 1, 2, 0, 1, ...
+    run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    slots = np.arange(total, dtype=np.int64) - run_starts
+    timestamps = (
+        np.repeat(np.asarray(first_timestamps, dtype='datetime64[us]'), counts)
+        + slots * np.repeat(steps, counts)
+    )
+
+    def uniform(low_field, high_field):
+        low = np.repeat(np.array([getattr(d, low_field) for d in devices], dtype=float), counts)
+        high = np.repeat(np.array([getattr(d, high_field) for d in devices], dtype=float), counts)
+        return np.round(_rng.uniform(low, high), 2)
+
+    temperatures = uniform('temperature_min', 'temperature_max')
+    humidities = uniform('humidity_min', 'humidity_max')
+    return device_ids, timestamps, temperatures, humidities
+
+
+def to_datetime64(value):
+    return np.datetime64(value.astimezone(dt_timezone.utc).replace(tzinfo=None), 'us')
+
+
+def count_due_slots(next_timestamp, now, interval):
+    if next_timestamp > now:
+        return 0
+    return (now - next_timestamp) // interval + 1
+
+
+def _first_per_slot(device_ids, timestamps):
+    """Mask keeping the first row of every (device, timestamp) pair in a batch."""
+    order = np.lexsort((timestamps, device_ids))
+    ids, stamps = device_ids[order], timestamps[order]
+    first = np.r_[True, (ids[1:] != ids[:-1]) | (stamps[1:] != stamps[:-1])]
+    keep = np.zeros(len(order), dtype=bool)
+    keep[order[first]] = True
+    return keep
+
+
+def _insert_new_postgresql(cursor, table, column_list, device_column, timestamp_column, rows):
+    """COPY `rows` into a temporary table, insert them skipping occupied slots and return the positions inserted."""
+    slot_columns = f"{device_column}, {timestamp_column}"
+    cursor.execute(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS reading_load "
+        "(position integer, device_id bigint, temperature double precision, humidity double precision, "
+        "stamp timestamp with time zone) ON COMMIT DELETE ROWS"
     )
+    # Rows are only dropped at commit, and the caller may be inside a larger transaction
+    cursor.execute("TRUNCATE reading_load")
+    cursor.cursor.copy_expert("COPY reading_load FROM STDIN WITH (FORMAT csv)", rows)
+    cursor.execute(
+        f"WITH inserted AS ("
+        f"INSERT INTO {table} ({column_list}) SELECT device_id, temperature, humidity, stamp FROM reading_load "
+        f"ON CONFLICT ({slot_columns}) DO NOTHING RETURNING {slot_columns}) "
+        f"SELECT position FROM reading_load JOIN inserted "
+        f"ON inserted.{device_column} = reading_load.device_id AND inserted.{timestamp_column} = reading_load.stamp"
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _free_slots(device_ids, timestamps):
+    """Mask of the rows whose (device, timestamp) slot holds no reading yet."""
+    occupied = Reading.objects.filter(
+        device_id__in=np.unique(device_ids).tolist(),
+        timestamp__gte=timestamps.min().item().replace(tzinfo=dt_timezone.utc),
+        timestamp__lte=timestamps.max().item().replace(tzinfo=dt_timezone.utc),
+    ).values_list('device_id', 'timestamp')
+    taken = {
+        (device_id, int(to_datetime64(moment).astype(np.int64)))
+        for device_id, moment in occupied.iterator(chunk_size=BULK_BATCH_SIZE)
+    }
+    if not taken:
+        return np.ones(len(timestamps), dtype=bool)
+    slots = zip(device_ids.tolist(), timestamps.astype(np.int64).tolist())
+    return np.array([slot not in taken for slot in slots], dtype=bool)
+
+
+def bulk_load_readings(device_ids, timestamps, temperatures, humidities):
+    """Write parallel reading arrays straight to the readings table, bypassing model instances.
+
+    Timestamps are UTC `datetime64` values. Rows for a (device, timestamp) slot
+    that already has a reading, or that repeat one earlier in the batch, are
+    skipped, so a retried or overlapping write is harmless. PostgreSQL COPYs the
+    batch into a temporary table and inserts from it with ON CONFLICT DO NOTHING;
+    other backends look up the occupied slots first and insert the rest with
+    chunked executemany. Rollups, counters, caches and the live feed only see
+    the rows actually inserted; the last-reading cache records skipped slots
+    too, since they hold a reading. Returns the (device ids, timestamps,
+    temperatures, humidities) arrays of the rows inserted, for the alarm
+    engine to evaluate, so a resent batch raises nothing twice.
+    """
+    count = len(timestamps)
+    if not count:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype='datetime64[us]'), np.empty(0), np.empty(0)
+
+    opts = Reading._meta
+    quote = connection.ops.quote_name
+    columns = [opts.get_field(name).column for name in ('device', 'temperature', 'humidity', 'timestamp')]
+    table = quote(opts.db_table)
+    column_list = ', '.join(quote(column) for column in columns)
+    slot_columns = f"{quote(columns[0])}, {quote(columns[3])}"
+
+    device_ids = np.broadcast_to(np.asarray(device_ids, dtype=np.int64), (count,))
+    timestamps = np.asarray(timestamps, dtype='datetime64[us]')
+    temperatures = np.asarray(temperatures, dtype=float)
+    humidities = np.asarray(humidities, dtype=float)
+    keep = _first_per_slot(device_ids, timestamps)
+    if not keep.all():
+        device_ids, timestamps = device_ids[keep], timestamps[keep]
+        temperatures, humidities = temperatures[keep], humidities[keep]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            stamps = np.datetime_as_string(timestamps, unit='us').tolist()
+            data = io.StringIO(''.join(
+                f"{position},{d},{t!r},{h!r},{ts}+00\n"
+                for position, (d, t, h, ts) in enumerate(zip(device_ids.tolist(), temperatures.tolist(), humidities.tolist(), stamps))
+            ))
+            inserted = np.zeros(len(timestamps), dtype=bool)
+            inserted[_insert_new_postgresql(cursor, table, column_list, quote(columns[0]), quote(columns[3]), data)] = True
+        else:
+            inserted = _free_slots(device_ids, timestamps)
+            if inserted.any():
+                # Same text Django stores (no fraction for whole seconds), so the unique constraint compares like with like
+                stamps = np.char.replace(np.datetime_as_string(timestamps[inserted], unit='us'), 'T', ' ')
+                stamps = np.char.replace(stamps, '.000000', '')
+                sql = f"INSERT INTO {table} ({column_list}) VALUES (%s, %s, %s, %s) ON CONFLICT ({slot_columns}) DO NOTHING"
+                rows = list(zip(
+                    device_ids[inserted].tolist(), temperatures[inserted].tolist(), humidities[inserted].tolist(),
+                    stamps.tolist(),
+                ))
+                for offset in range(0, len(rows), BULK_BATCH_SIZE):
+                    cursor.executemany(sql, rows[offset:offset + BULK_BATCH_SIZE])
 
-    print(f"[Realtime] {device.number}: Temp={temp}, Humidity={humidity}, Time={timestamp}")
+        # Skipped slots are taken all the same; recording them keeps a writer whose cache fell
+        # behind (e.g. after another process wrote its devices) from retrying them every tick
+        occupied_ids, occupied_timestamps = device_ids, timestamps
+        transaction.on_commit(lambda: last_readings.record_batch(occupied_ids, occupied_timestamps))
+        if not inserted.all():
+            device_ids, timestamps = device_ids[inserted], timestamps[inserted]
+            temperatures, humidities = temperatures[inserted], humidities[inserted]
+        if len(timestamps):
+            rollups.apply_batch(device_ids, timestamps, temperatures, humidities)
+            counters.add_readings(device_ids)
+            transaction.on_commit(lambda: live.publish_readings(device_ids, timestamps, temperatures, humidities))
+    return device_ids, timestamps, temperatures, humidities
+
+
+def fill_slots(devices, first_timestamps, counts):
+    """Generate and load `counts` consecutive slots per device in checkpointed rounds.
+
+    A round covers at most SIMULATOR_FILL_CHUNK_SLOTS slots per device and
+    commits on its own, advancing the last-reading cache. An interrupted fill
+    therefore loses at most one round, and the next fill resumes after the
+    last committed slot; anything it writes twice is skipped by the loader.
+    `first_timestamps` are UTC `datetime64` values, one per device.
+    """
+    from .alarms import evaluate_readings
+
+    chunk = settings.SIMULATOR_FILL_CHUNK_SLOTS
+    first_timestamps = np.asarray(first_timestamps, dtype='datetime64[us]')
+    counts = np.asarray(counts, dtype=np.int64)
+    steps = np.array(
+        [(d.logging_interval_minutes or 15) * 60_000_000 for d in devices], dtype=np.int64
+    ).astype('timedelta64[us]')
+
+    created = 0
+    for offset in range(0, int(counts.max(initial=0)), chunk):
+        rows = np.flatnonzero(counts > offset)
+        round_devices = [devices[row] for row in rows]
+        series = build_fleet_series(
+            round_devices, first_timestamps[rows] + offset * steps[rows], np.minimum(counts[rows] - offset, chunk),
+        )
+        inserted = bulk_load_readings(*series)
+        created += len(inserted[1])
+        evaluate_readings(*inserted, devices=round_devices)
+    return created
+
+
+def is_simulated(device):
+    """Whether the simulator generates readings for `device`: it is switched on and has value ranges."""
+    return device.status == 'on' and None not in (
+        device.temperature_min, device.temperature_max, device.humidity_min, device.humidity_max,
+    )
+
+
+def resume_after(device, last_timestamp):
+    """The moment the device's next slot follows: its last reading, but never earlier than
+    when it was last switched on, so time spent off stays empty. A device without readings
+    follows `started_at` whenever it is switched on first, e.g. after being created off.
+    """
+    if last_timestamp is None:
+        return device.started_at
+    if device.status_changed_at is not None and device.status_changed_at > last_timestamp:
+        return device.status_changed_at
+    return last_timestamp
+
+
+def run_simulation_tick(now=None, devices=None):
+    """Generate every reading that has come due since the last tick as one batched write.
+
+    The device set is read from the config cache on every tick, so devices
+    that were created, deleted, retimed or switched on/off (here or in another
+    process) are picked up without any rescheduling; `devices` limits the tick
+    to part of the fleet (a simulator shard). Devices are grouped by logging
+    interval so due slots are computed per group with array arithmetic. At
+    most `SIMULATOR_MAX_SLOTS_PER_TICK` slots are written per device; whatever
+    is left is reported as backlog and picked up by the next tick, which is
+    also how a device that has no readings yet catches up from `started_at`.
+    """
+    from .alarms import evaluate_readings
+
+    started = time.perf_counter()
+    now = now or timezone.now()
+    now64 = to_datetime64(now)
+    max_slots = settings.SIMULATOR_MAX_SLOTS_PER_TICK
+
+    devices = device_configs.all() if devices is None else devices
+    last_seen = last_readings.get_many([device.id for device in devices])
+    groups = defaultdict(list)
+    for device in devices:
+        if is_simulated(device):
+            groups[device.logging_interval_minutes or 15].append(device)
+
+    due_devices, first_timestamps, counts = [], [], []
+    backlog = 0
+    for minutes, group in groups.items():
+        step = np.timedelta64(minutes * 60_000_000, 'us')
+        first = np.array([to_datetime64(resume_after(d, last_seen[d.id])) for d in group]) + step
+        due = np.where(first <= now64, (now64 - first) // step + 1, 0)
+        take = np.minimum(due, max_slots)
+        backlog += int((due - take).sum())
+        for index in np.flatnonzero(take):
+            due_devices.append(group[index])
+            first_timestamps.append(first[index])
+            counts.append(take[index])
+
+    created = 0
+    if due_devices:
+        series = build_fleet_series(due_devices, first_timestamps, counts)
+        inserted = bulk_load_readings(*series)
+        created = len(inserted[1])
+        evaluate_readings(*inserted, devices=due_devices)
+
+    stats = TickStats(len(due_devices), created, backlog, (time.perf_counter() - started) * 1000)
+    print(f"[Tick] {stats.readings} readings for {stats.devices} devices in {stats.elapsed_ms:.1f} ms, backlog={stats.backlog}")
+    return stats
 
 
 def backfill_readings(device):
-    start_date = device.started_at
+    if not is_simulated(device):
+        print(f"[Backfill] {device.number}: skipped, the device is off or has no value ranges")
+        return 0
+    start_date = resume_after(device, None)
     interval = timedelta(minutes=device.logging_interval_minutes or 15)
     next_timestamp = start_date + interval
     now = timezone.now()
 
-    print(f"Backfilling readings for {device.number} from {start_date} to {now}")
-
-    while next_timestamp <= now:
-        temp = round(random.uniform(device.temperature_min, device.temperature_max), 2)
-        humidity = round(random.uniform(device.humidity_min, device.humidity_max), 2)
-
-        Reading.objects.create(
-            device=device,
-            temperature=temp,
-            humidity=humidity,
-            timestamp=next_timestamp
-        )
+    count = count_due_slots(next_timestamp, now, interval)
+    created = fill_slots([device], [to_datetime64(next_timestamp)], [count])
 
-        print(f"[Backfill] {device.number}: Temp={temp}, Humidity={humidity}, Time={next_timestamp}")
-        next_timestamp += interval
+    print(f"[Backfill] {device.number}: {created} readings from {start_date} to {now}")
+    return created
 
 
 def generate_random_gap_reading(device_id):
-    from .models import Device  # Local import to avoid circular dependency
-    device = Device.objects.get(id=device_id)
+    device = device_configs.get(device_id)
     now = timezone.now()
 
-    last_reading = Reading.objects.filter(device=device).order_by('-timestamp').first()
+    last_timestamp = last_readings.get(device.id)
 
-    if not last_reading:
+    if last_timestamp is None:
         print(f"[Gap Fill] No previous readings for {device.number}. Backfilling from start.")
         backfill_readings(device)
         return
 
     interval = timedelta(minutes=device.logging_interval_minutes or 15)
-    next_timestamp = last_reading.timestamp + interval
-    readings_to_create = []
-
-    while next_timestamp <= now:
-        temp = round(random.uniform(device.temperature_min, device.temperature_max), 2)
-        humidity = round(random.uniform(device.humidity_min, device.humidity_max), 2)
-
-        readings_to_create.append(
-            Reading(
-                device=device,
-                temperature=temp,
-                humidity=humidity,
-                timestamp=next_timestamp
-            )
-        )
-
-        next_timestamp += interval
+    next_timestamp = resume_after(device, last_timestamp) + interval
 
-    if readings_to_create:
-        Reading.objects.bulk_create(readings_to_create)
-        print(f"[Gap Fill] Filled {len(readings_to_create)} missing readings for {device.code}")
+    count = count_due_slots(next_timestamp, now, interval) if is_simulated(device) else 0
+    if count:
+        created = fill_slots([device], [to_datetime64(next_timestamp)], [count])
+        print(f"[Gap Fill] Filled {created} missing readings for {device.code}")
     else:
         print(f"[Gap Fill] No gap detected for {device.code}")
+
+
+def _fill_shard(devices, first_timestamps, counts):
+    try:
+        return fill_slots(devices, first_timestamps, counts)
+    finally:
+        # Worker threads get their own connection; don't leave it open in the pool
+        connection.close()
+
+
+def fill_gaps(now=None, workers=None, devices=None):
+    """Fill the downtime gap of every device (or just `devices`) at once.
+
+    The last timestamp of all devices comes from the last-reading cache (one
+    aggregate query when cold); devices with no readings yet are backfilled
+    from `started_at`. Devices that are switched off are skipped, and ones
+    switched back on resume from that moment (see `resume_after`). Missing rows are
+    generated and bulk loaded by a thread pool, one shard of devices per worker
+    (a single worker on SQLite), in checkpointed rounds (see `fill_slots`), so a
+    fill cut short by a restart picks up where it stopped.
+    """
+    started = time.perf_counter()
+    now = now or timezone.now()
+    workers = workers or settings.SIMULATOR_GAP_FILL_WORKERS
+    if connection.vendor == 'sqlite':
+        # SQLite takes one writer at a time; concurrent loads would only fail on its table locks
+        workers = 1
+
+    devices = device_configs.all() if devices is None else devices
+    last_seen = last_readings.get_many([device.id for device in devices])
+    pending = []
+    for device in devices:
+        if not is_simulated(device):
+            continue
+        interval = timedelta(minutes=device.logging_interval_minutes or 15)
+        next_timestamp = resume_after(device, last_seen[device.id]) + interval
+        count = count_due_slots(next_timestamp, now, interval)
+        if count:
+            pending.append((device, to_datetime64(next_timestamp), count))
+
+    # Deal devices round-robin by size so every shard gets a similar number of rows
+    pending.sort(key=lambda item: item[2], reverse=True)
+    shards = [pending[i::workers] for i in range(workers) if pending[i::workers]]
+
+    with ThreadPoolExecutor(max_workers=max(len(shards), 1), thread_name_prefix='gap-fill') as pool:
+        created = sum(pool.map(lambda shard: _fill_shard(*zip(*shard)), shards))
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"[Gap Fill] Filled {created} missing readings for {len(pending)} devices in {elapsed_ms:.1f} ms")
+    return created
+
+
+def inject_random_values(readings, temp_min, temp_max, hum_min, hum_max):
+    """Overwrite temperature and humidity of every reading in `readings` with one UPDATE.
+
+    The database draws the random values itself, so no rows travel to Python.
+    Alarms are then raised from just the out-of-range rows, which the live
+    alarm lifecycle clears again once readings return to normal.
+    Rollups for the range are rebuilt by the caller.
+    Returns the number of readings updated.
+    """
+    from .alarms import raise_from_history
+
+    with transaction.atomic():
+        updated = readings.update(
+            temperature=Round(Random() * (temp_max - temp_min) + temp_min, 2),
+            humidity=Round(Random() * (hum_max - hum_min) + hum_min, 2),
+        )
+        # Comparisons against a NULL threshold are never true, so unset limits drop out
+        out_of_range = list(
+            readings.filter(device__status='on')
+            .filter(
+                Q(temperature__gt=F('device__alert_temp_max')) | Q(temperature__lt=F('device__alert_temp_min'))
+                | Q(humidity__gt=F('device__alert_humidity_max')) | Q(humidity__lt=F('device__alert_humidity_min'))
+            )
+            .order_by('device_id', 'timestamp')
+            .values_list('device_id', 'timestamp', 'temperature', 'humidity')
+        )
+        if out_of_range:
+            raise_from_history(*zip(*out_of_range))
+    return updated
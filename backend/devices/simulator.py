@@ -1,22 +1,249 @@
+"""Runs the simulation jobs in exactly one process per shard of the fleet.
+
+Every server process (runserver, gunicorn/uvicorn/... workers) and the
+`run_simulator` command is a candidate: its scheduler runs an election
+round every SIMULATOR_LEASE_RENEW_SECONDS (see leader.py). With
+SIMULATOR_SHARDS = 1 the process holding the 'simulator' lease runs the
+whole fleet. With K shards there are K leases ('simulator:0' ...); each
+process holds at most one, and devices are spread over the shards that are
+currently held by consistent hashing on device id (see sharding.py). Every
+shard fills its own gap and writes its own devices in one batch per tick,
+so the fleet is driven by up to K cores instead of one. When a shard's
+process dies its devices move to the remaining shards, and back once the
+shard is taken over again; new and deleted devices only ever affect the
+shard they hash to.
+
+Processes without a shard only keep trying for one. Other management
+commands, shells and tests never start the simulator at all.
+"""
+import atexit
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
-from .simulation import generate_random_reading, generate_random_gap_reading
-from .models import Device
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections
+from . import counters
+from .alarms import alarm_states
+from .cache import device_configs, last_readings
+from .leader import LeaderLease, held_leases
+from .sharding import HashRing
+from .simulation import run_simulation_tick, fill_gaps
 
-def start():
-    print("Scheduler started...")
-    scheduler = BackgroundScheduler()
-    
-    for device in Device.objects.all():
-        generate_random_gap_reading(device.id)
-        logging_interval_minutes = device.logging_interval_minutes   # Default to 15 minutes if not set
-        
-        print(f"Scheduling readings for {device.code} every {logging_interval_minutes} minutes")
-        scheduler.add_job(
-            generate_random_reading,
+# Processes started through one of these serve requests
+SERVER_PROGRAMS = ('gunicorn', 'uvicorn', 'daphne', 'hypercorn', 'uwsgi', 'waitress')
+MANAGEMENT_PROGRAMS = ('manage.py', 'django-admin', 'django-admin.py', os.path.join('django', '__main__.py'))
+
+GENERATION_JOBS = ('simulation_tick_job', 'reconcile_counters_job')
+
+_lock = threading.Lock()
+_scheduler = None
+_leases = []
+# Shard held by this process (None while standing by) and the ring of every shard currently held
+_shard = None
+_ring = None
+# Set when devices changed hands; the next tick reloads what other shards may have written
+_stale = False
+
+
+def is_server_process(argv=None):
+    """Whether this process serves the app: a WSGI/ASGI server or runserver's serving child."""
+    argv = sys.argv if argv is None else argv
+    if not argv:
+        return False
+    program = argv[0]
+    if program.endswith(MANAGEMENT_PROGRAMS):
+        if argv[1:2] != ['runserver']:
+            return False
+        # With the autoreloader the parent only watches files; the child it (re)starts serves
+        return '--noreload' in argv or os.environ.get('RUN_MAIN') == 'true'
+    # Matches the path too, e.g. .../gunicorn/__main__.py for `python -m gunicorn`
+    return any(name in program.lower() for name in SERVER_PROGRAMS)
+
+
+def lease_names(shards=None):
+    shards = shards or settings.SIMULATOR_SHARDS
+    return ['simulator'] if shards == 1 else [f'simulator:{shard}' for shard in range(shards)]
+
+
+def _holds_shard():
+    return _shard is not None and _leases[_shard].held
+
+
+def _owned_devices():
+    return _ring.owned(device_configs.all(), _shard)
+
+
+def simulation_tick():
+    global _stale
+
+    if not _holds_shard():
+        return  # The lease lapsed since the last election round; whoever holds it now ticks
+    try:
+        if _stale:
+            _stale = False
+            last_readings.clear()
+            alarm_states.clear()
+        run_simulation_tick(devices=_owned_devices())
+    finally:
+        close_old_connections()
+
+
+def reconcile_counters():
+    # Counters cover the whole fleet, so only the lowest live shard recounts them
+    if not _holds_shard() or _shard != _ring.shards[0]:
+        return
+    try:
+        counters.reconcile()
+    finally:
+        close_old_connections()
+
+
+def _schedule_generation():
+    with _lock:
+        if _shard is None:
+            return
+        _scheduler.add_job(
+            simulation_tick,
             'interval',
-            minutes=logging_interval_minutes,
-            args=[device.id],
-            id=f'generate_readings_job_{device.code}'
+            seconds=settings.SIMULATOR_TICK_SECONDS,
+            id='simulation_tick_job',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True,
         )
-         
-    scheduler.start()
+        _scheduler.add_job(
+            reconcile_counters,
+            'interval',
+            seconds=settings.COUNTERS_RECONCILE_SECONDS,
+            id='reconcile_counters_job',
+            max_instances=1,
+            coalesce=True,
+            replace_existing=True,
+        )
+    print(f"Scheduling simulation tick every {settings.SIMULATOR_TICK_SECONDS} seconds")
+
+
+def _fill_gaps_then_schedule():
+    if _shard is not None:
+        try:
+            fill_gaps(devices=_owned_devices())
+        finally:
+            close_old_connections()
+    # Only start ticking once the gap is closed, so both never write the same slots
+    _schedule_generation()
+
+
+def _lead(sync_fill):
+    lease = _leases[_shard]
+    print(f"[Leader] {lease.holder} took the {lease.name} lease ({len(_owned_devices())} devices)")
+    # The previous leader kept writing while this process stood by; reload what it changed
+    last_readings.clear()
+    alarm_states.clear()
+
+    mode = settings.SIMULATOR_GAP_FILL_MODE
+    if mode == 'off':
+        _schedule_generation()
+    elif len(_leases) > 1:
+        # Candidates usually start together; let one more election round see every shard they claimed
+        # before deciding which devices are ours, rather than filling the whole fleet from each of them.
+        # The scheduler waits for it, so not even 'sync' mode holds up startup for the round
+        _scheduler.add_job(
+            _fill_gaps_then_schedule,
+            'date',
+            run_date=datetime.now() + timedelta(seconds=settings.SIMULATOR_LEASE_RENEW_SECONDS * 1.5),
+            id='gap_fill_job',
+            replace_existing=True,
+        )
+    elif mode == 'sync' and sync_fill:
+        _fill_gaps_then_schedule()
+    else:
+        # Let the server accept traffic right away (and keep renewing); the tick starts when the fill is done
+        threading.Thread(target=_fill_gaps_then_schedule, name='gap-fill', daemon=True).start()
+
+
+def _stand_by():
+    with _lock:
+        for job_id in GENERATION_JOBS:
+            if _scheduler.get_job(job_id):
+                _scheduler.remove_job(job_id)
+    print(f"[Leader] Standing by; {len(_ring.shards) if _ring else 0} of {len(_leases)} simulator leases are held")
+
+
+def _rebalance():
+    global _stale
+
+    _stale = True
+    print(f"[Leader] Live shards now {list(_ring.shards)}; shard {_shard} runs {len(_owned_devices())} devices")
+
+
+def _claim_shard():
+    """Renew the shard this process holds, or else take any shard whose lease has lapsed."""
+    if _shard is not None and _leases[_shard].acquire():
+        return _shard
+    for shard, lease in enumerate(_leases):
+        if lease.acquire():
+            return shard
+    return None
+
+
+def _elect(sync_fill=False):
+    """One election round: claim or renew a shard, then start, stop or rebalance generation to match."""
+    global _shard, _ring
+
+    names = [lease.name for lease in _leases]
+    try:
+        shard = _claim_shard()
+        live = {names.index(name) for name in held_leases(names)}
+        ring = HashRing(live | {shard} if shard is not None else live)
+    except DatabaseError as exc:
+        shard = _shard if _holds_shard() else None
+        ring = _ring
+        print(f"[Leader] Could not renew the simulator lease: {exc}")
+    finally:
+        close_old_connections()
+
+    with _lock:
+        previous, _shard = _shard, shard
+        rebalanced = ring != _ring
+        _ring = ring
+    if shard is not None and previous is None:
+        _lead(sync_fill)
+    elif shard is None and (previous is not None or sync_fill):
+        _stand_by()
+    elif shard is not None and (rebalanced or shard != previous):
+        _rebalance()
+
+
+def _shutdown():
+    if _shard is None:
+        return
+    try:
+        # Hand over right away instead of making a standby wait for the lease to lapse
+        _leases[_shard].release()
+    except DatabaseError:
+        pass
+
+
+def start():
+    global _scheduler
+
+    if _scheduler is not None:
+        return
+    _leases[:] = [LeaderLease(name) for name in lease_names()]
+    _scheduler = BackgroundScheduler()
+    _scheduler.add_job(
+        _elect,
+        'interval',
+        seconds=settings.SIMULATOR_LEASE_RENEW_SECONDS,
+        id='simulator_election_job',
+        max_instances=1,
+        coalesce=True,
+    )
+    _scheduler.start()
+    atexit.register(_shutdown)
+    print("Scheduler started...")
+    # First round inline so SIMULATOR_GAP_FILL_MODE='sync' still blocks startup until the gap is filled
+    # (with a single shard; see _lead)
+    _elect(sync_fill=True)
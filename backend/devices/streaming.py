@@ -0,0 +1,90 @@
+"""Constant-memory export of raw readings.
+
+Rows are read with `values_list(...).iterator()` (a server-side cursor on
+PostgreSQL) and encoded straight to JSON text, so no model instances or
+serializer output for the whole range are ever held at once.
+"""
+import base64
+from datetime import datetime
+from django.db.models import Q
+from django.utils import timezone
+
+STREAM_CHUNK_SIZE = 2000
+MAX_PAGE_SIZE = 10000
+
+_COLUMNS = ('id', 'device_id', 'temperature', 'humidity', 'timestamp')
+
+
+def _encode_row(row):
+    reading_id, device_id, temperature, humidity, timestamp = row
+    return (
+        f'{{"id":{reading_id},"temperature":{temperature!r},"humidity":{humidity!r},'
+        f'"timestamp":"{timezone.localtime(timestamp).isoformat()}","device":{device_id}}}'
+    )
+
+
+def _rows(readings):
+    return readings.order_by('timestamp', 'id').values_list(*_COLUMNS).iterator(chunk_size=STREAM_CHUNK_SIZE)
+
+
+def ndjson_lines(readings):
+    """One JSON object per line, same keys as ReadingSerializer."""
+    for row in _rows(readings):
+        yield _encode_row(row) + '\n'
+
+
+def json_array_chunks(readings):
+    """A single JSON array, emitted in chunks of STREAM_CHUNK_SIZE rows."""
+    yield '['
+    batch = []
+    separator = ''
+    for row in _rows(readings):
+        batch.append(_encode_row(row))
+        if len(batch) == STREAM_CHUNK_SIZE:
+            yield separator + ','.join(batch)
+            separator, batch = ',', []
+    if batch:
+        yield separator + ','.join(batch)
+    yield ']'
+
+
+def encode_cursor(timestamp, reading_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{reading_id}".encode()).decode()
+
+
+def decode_cursor(token):
+    """(timestamp, id) from a cursor token; raises ValueError when it is malformed."""
+    try:
+        timestamp, reading_id = base64.urlsafe_b64decode(token.encode()).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(reading_id)
+    except (UnicodeError, ValueError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+def after_cursor(readings, token):
+    """Keyset filter: rows strictly after the (timestamp, id) position encoded in `token`."""
+    timestamp, reading_id = decode_cursor(token)
+    return readings.filter(Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=reading_id))
+
+
+def before_cursor(queryset, token):
+    """Keyset filter for newest-first listings: rows strictly before the (timestamp, id) position."""
+    timestamp, row_id = decode_cursor(token)
+    return queryset.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=row_id))
+
+
+def keyset_page(readings, page_size):
+    """One page of rows in (timestamp, id) order plus the cursor for the next page, if any."""
+    rows = list(readings.order_by('timestamp', 'id').values_list(*_COLUMNS)[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1][4], rows[-1][0])
+    results = [
+        {
+            'id': reading_id, 'temperature': temperature, 'humidity': humidity,
+            'timestamp': timezone.localtime(timestamp), 'device': device_id,
+        }
+        for reading_id, device_id, temperature, humidity, timestamp in rows
+    ]
+    return results, next_cursor
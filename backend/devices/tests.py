@@ -1,3 +1,1100 @@
-from django.test import TestCase
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import BytesIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
+import numpy as np
+from apscheduler.schedulers.background import BackgroundScheduler
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+from rest_framework.test import APIClient
+from audit.models import AuditLog
+from . import counters, live, rollups, simulator, streaming
+from .alarms import THRESHOLD_FIELDS, AlarmStateMachine, alarm_states, evaluate_readings
+from .cache import bump_version, device_configs, last_readings
+from .ingest import IngestError, ingest, parse_payload, parse_timestamps
+from .leader import LeaderLease, held_leases
+from .models import Alarm, Device, Lease, Reading, ReadingRollup, ReportJob
+from .partitions import READINGS_TABLE, ensure_partitions, is_partitioned, monthly_partitions, partition_readings_table
+from .reports import jobs as report_jobs, pdf_generator, series as report_series
+from .reports.charts import decimate_minmax
+from .reports.prefetch import prefetch_reports
+from .rollups import aggregate_buckets, local_day_starts
+from .sharding import HashRing
+from .simulation import build_fleet_series, bulk_load_readings, fill_gaps, fill_slots, resume_after, run_simulation_tick, to_datetime64
 
-# Create your tests here.
+CAIRO = ZoneInfo('Africa/Cairo')
+EPOCH = np.datetime64('2026-01-01T00:00:00', 'us')
+
+
+def utc(text):
+    return np.datetime64(text, 'us')
+
+
+@override_settings(ALARM_DEBOUNCE_SECONDS=60, ALARM_HYSTERESIS_TEMPERATURE=0.5)
+class AlarmStateMachineTests(TestCase):
+    def setUp(self):
+        device_configs.clear()
+        alarm_states.clear()
+        self.device = Device.objects.create(number=1, code='ALARM-1', status='on', alert_temp_max=30.0)
+        self.machine = AlarmStateMachine()
+
+    def advance(self, seconds, temperatures):
+        """Run one batch of readings, `seconds` after EPOCH, through the state machine."""
+        count = len(seconds)
+        times = (EPOCH + np.asarray(seconds, dtype='timedelta64[s]')).astype(np.int64)
+        limits = {field: np.full(count, getattr(self.device, field) or np.nan, dtype=float) for field in THRESHOLD_FIELDS}
+        columns = {'temperature': np.asarray(temperatures, dtype=float), 'humidity': np.full(count, 50.0)}
+        return self.machine.advance(np.full(count, self.device.id, dtype=np.int64), times, columns, limits)
+
+    def open_alarms(self):
+        return list(Alarm.objects.filter(device=self.device, active=True).values_list('alarm_type', 'triggered_value'))
+
+    def test_raises_once_the_condition_held_for_the_debounce(self):
+        raised, _ = self.advance([0, 30], [31.0, 31.5])
+        self.assertEqual(raised, [])
+        raised, _ = self.advance([60], [32.0])
+        self.assertEqual([(row[1], row[2]) for row in raised], [('TEMP_HI', 32.0)])
+        self.assertEqual(self.open_alarms(), [('TEMP_HI', 32.0)])
+
+    def test_excursions_shorter_than_the_debounce_never_raise(self):
+        raised, _ = self.advance([0, 30, 60, 90, 120], [31.0, 29.0, 31.0, 29.0, 31.0])
+        self.assertEqual(raised, [])
+        self.assertEqual(self.open_alarms(), [])
+
+    def test_clears_only_below_the_hysteresis_band(self):
+        self.advance([0, 60], [31.0, 31.0])
+        # Back inside the threshold but within the band: the alarm stays open
+        _, cleared = self.advance([120, 180, 240], [29.8, 29.7, 29.6])
+        self.assertEqual(cleared, [])
+        _, cleared = self.advance([300, 330], [29.4, 29.0])
+        self.assertEqual(cleared, [])
+        _, cleared = self.advance([360], [29.0])
+        self.assertEqual([(row[1], row[3]) for row in cleared], [('TEMP_HI', int(EPOCH.astype(np.int64)) + 360_000_000)])
+        self.assertEqual(self.open_alarms(), [])
+
+    def test_raises_again_after_the_open_alarm_was_deleted_elsewhere(self):
+        self.advance([0, 60], [31.0, 31.0])
+        Alarm.objects.filter(device=self.device).delete()
+        raised, _ = self.advance([120, 180], [31.0, 31.0])
+        self.assertEqual(len(raised), 1)
+        self.assertEqual(len(self.open_alarms()), 1)
+
+    def test_an_excursion_inside_one_batch_is_recorded_as_cleared(self):
+        raised, cleared = self.advance(range(0, 600, 30), [20, 31, 31, 31, 20, 20, 20, 20, 32, 32, 32] + [20] * 9)
+        self.assertEqual([(row[1], row[2]) for row in raised], [('TEMP_HI', 31.0), ('TEMP_HI', 32.0)])
+        self.assertEqual(len(cleared), 2)
+        self.assertEqual(
+            list(Alarm.objects.filter(device=self.device).order_by('timestamp').values_list('triggered_value', 'active')),
+            [(31.0, False), (32.0, False)],
+        )
+        self.assertEqual(counters.by_device()[self.device.id]['alarms'], 2)
+
+    def test_an_excursion_left_open_continues_into_the_next_batch(self):
+        self.advance([0, 60, 120, 180, 240], [20, 31, 31, 31, 20])
+        self.assertEqual(self.open_alarms(), [('TEMP_HI', 31.0)])
+        _, cleared = self.advance([300], [20])
+        self.assertEqual(len(cleared), 1)
+        self.assertEqual(self.open_alarms(), [])
+
+    def test_back_dated_readings_replay_their_own_excursions(self):
+        self.advance([6000], [20.0])
+        raised, _ = self.advance([0, 60, 120, 180, 240, 300], [35.0, 35.0, 20.0, 20.0, 36.0, 36.0])
+        self.assertEqual(sorted(row[2] for row in raised), [35.0, 36.0])
+        # The first excursion ended within the late rows; the second was still going at their end
+        self.assertEqual(
+            list(Alarm.objects.filter(device=self.device).order_by('timestamp').values_list('triggered_value', 'active')),
+            [(35.0, False), (36.0, True)],
+        )
+
+    @override_settings(ALARM_DEBOUNCE_SECONDS=0)
+    def test_every_excursion_of_a_batch_is_written(self):
+        start = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+        timestamps = [start + timedelta(minutes=minute) for minute in range(4)]
+        self.assertEqual(evaluate_readings(self.device.id, timestamps, [20, 31, 31, 20], [50] * 4), 2)
+        self.assertEqual(list(Alarm.objects.filter(device=self.device).values_list('alarm_type', 'active')),
+                         [('TEMP_HI', False)])
+
+
+class ParseTimestampsTests(SimpleTestCase):
+    def parse(self, values):
+        return [str(value) for value in parse_timestamps(values, tz=CAIRO)]
+
+    def test_naive_strings_are_local_time(self):
+        self.assertEqual(self.parse(['2026-01-15T12:00:00', '2026-07-15 12:00:00']),
+                         ['2026-01-15T10:00:00.000000', '2026-07-15T09:00:00.000000'])
+
+    def test_strings_with_an_offset_keep_it(self):
+        self.assertEqual(self.parse(['2026-01-15T12:00:00+00:00', '2026-01-15T12:00:00-05:00']),
+                         ['2026-01-15T12:00:00.000000', '2026-01-15T17:00:00.000000'])
+
+    def test_epoch_seconds_as_numbers_or_digit_strings(self):
+        expected = ['2023-11-14T22:13:20.000000', '2023-11-14T22:13:20.500000']
+        self.assertEqual(self.parse([1700000000, 1700000000.5]), expected)
+        self.assertEqual(self.parse(['1700000000', ' 1700000000.5 ']), expected)
+
+    def test_mixed_epoch_and_iso_values(self):
+        self.assertEqual(self.parse(['1700000000', '2026-01-15T12:00:00']),
+                         ['2023-11-14T22:13:20.000000', '2026-01-15T10:00:00.000000'])
+
+    def test_unusable_values_are_nat(self):
+        self.assertEqual(self.parse(['yesterday', '99999999999999', '', None]), ['NaT'] * 4)
+        self.assertEqual(self.parse(['2026-01-15T12:00:00', '99999-01-01']), ['2026-01-15T10:00:00.000000', 'NaT'])
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings):
+            cache.clear()
+        self.device = Device.objects.create(number=1, code='ING-1', status='off')
+
+    def test_parse_payload_maps_export_headers(self):
+        body = (
+            "Timestamp for sample frequency every 1 min,Temperature_Fahrenheit,Relative_Humidity\n"
+            "2026-01-15 12:00:00,212,40\n"
+        ).encode()
+        columns = parse_payload(body, 'text/csv', device='ING-1')
+        self.assertEqual(columns['device'], ['ING-1'])
+        self.assertEqual(columns['timestamp'], ['2026-01-15 12:00:00'])
+        self.assertAlmostEqual(float(columns['temperature'][0]), 100.0)
+        self.assertEqual(columns['humidity'], ['40'])
+
+    def test_parse_payload_rejects_unreadable_bodies(self):
+        with self.assertRaises(IngestError):
+            parse_payload(b'{"not": "a list"}', 'application/json')
+        with self.assertRaises(IngestError):
+            parse_payload(b'timestamp,temperature,humidity\n1,2,3\n', 'text/csv')
+        with self.assertRaises(IngestError):
+            parse_payload(b'<xml/>', 'application/xml')
+
+    def test_ingest_loads_valid_rows_and_reports_the_rest(self):
+        future = (timezone.now() + timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%S')
+        body = (
+            "device,timestamp,temperature,humidity\n"
+            "ING-1,2026-01-15T12:00:00,21.5,40\n"
+            f"{self.device.id},1700000000,22,41\n"
+            "NOPE,2026-01-15T12:01:00,21.5,40\n"
+            "ING-1,2026-01-15T12:02:00,21.5,140\n"
+            f"ING-1,{future},21.5,40\n"
+            "ING-1,not a time,21.5,40\n"
+        ).encode()
+        summary = ingest(parse_payload(body, 'text/csv'))
+        self.assertEqual((summary['created'], summary['duplicates'], summary['rejected']), (2, 0, 4))
+        self.assertEqual(summary['errors'], [
+            {'row': 3, 'error': 'unknown device'},
+            {'row': 4, 'error': 'humidity out of range'},
+            {'row': 5, 'error': 'timestamp is in the future'},
+            {'row': 6, 'error': 'invalid timestamp'},
+        ])
+        self.assertEqual(
+            sorted(Reading.objects.filter(device=self.device).values_list('timestamp', flat=True)),
+            [datetime(2023, 11, 14, 22, 13, 20, tzinfo=dt_timezone.utc), datetime(2026, 1, 15, 10, tzinfo=dt_timezone.utc)],
+        )
+
+        # A resent batch only counts duplicates
+        summary = ingest(parse_payload(body, 'text/csv'))
+        self.assertEqual((summary['created'], summary['duplicates']), (0, 2))
+        self.assertEqual(Reading.objects.filter(device=self.device).count(), 2)
+
+
+@override_settings(TIME_ZONE='Africa/Cairo')
+
+
+@override_settings(TIME_ZONE='Africa/Cairo')
+class AggregateBucketsTests(SimpleTestCase):
+    def test_groups_by_device_and_hour(self):
+        device_ids = [2, 1, 1, 1]
+        timestamps = [utc('2026-01-15T00:20'), utc('2026-01-15T01:05'), utc('2026-01-15T00:50'), utc('2026-01-15T00:10')]
+        ids, buckets, stats = aggregate_buckets(device_ids, timestamps, [5.0, 30.0, 20.0, 10.0], [50.0, 60.0, 40.0, 45.0], 'h')
+        self.assertEqual(ids.tolist(), [1, 1, 2])
+        self.assertEqual([str(bucket) for bucket in buckets], ['2026-01-15T00', '2026-01-15T01', '2026-01-15T00'])
+        self.assertEqual(stats['count'].tolist(), [2, 1, 1])
+        self.assertEqual(stats['temperature_min'].tolist(), [10.0, 30.0, 5.0])
+        self.assertEqual(stats['temperature_max'].tolist(), [20.0, 30.0, 5.0])
+        self.assertEqual(stats['temperature_sum'].tolist(), [30.0, 30.0, 5.0])
+        self.assertEqual(stats['humidity_min'].tolist(), [40.0, 60.0, 50.0])
+        self.assertEqual(stats['humidity_max'].tolist(), [45.0, 60.0, 50.0])
+        self.assertEqual(stats['humidity_sum'].tolist(), [85.0, 60.0, 50.0])
+
+    def test_days_follow_the_local_calendar(self):
+        # 23:30 and 00:30 in Cairo (UTC+2 in winter) fall on different local days
+        ids, buckets, stats = aggregate_buckets(
+            [1, 1], [utc('2026-01-14T21:30'), utc('2026-01-14T22:30')], [1.0, 2.0], [1.0, 2.0], 'D',
+        )
+        self.assertEqual([str(bucket) for bucket in buckets], ['2026-01-13T22:00:00.000000', '2026-01-14T22:00:00.000000'])
+        self.assertEqual(stats['count'].tolist(), [1, 1])
+
+    def test_local_days_across_a_dst_change(self):
+        # Clocks go forward at midnight on 2026-04-24, so that day starts an hour "late" and lasts 23 hours
+        starts = local_day_starts([utc('2026-04-23T21:59'), utc('2026-04-23T22:00'), utc('2026-04-24T20:59'), utc('2026-04-24T21:00')])
+        self.assertEqual([str(start) for start in starts], [
+            '2026-04-22T22:00:00.000000', '2026-04-23T22:00:00.000000',
+            '2026-04-23T22:00:00.000000', '2026-04-24T21:00:00.000000',
+        ])
+
+
+class StreamCursorTests(TestCase):
+    def setUp(self):
+        devices = [Device.objects.create(number=number, code=f'STREAM-{number}') for number in (1, 2)]
+        start = datetime(2026, 1, 15, 10, tzinfo=dt_timezone.utc)
+        # Both devices read at the same moments, so timestamps tie and the id breaks them
+        Reading.objects.bulk_create([
+            Reading(device=device, temperature=20.0, humidity=40.0, timestamp=start + timedelta(minutes=minute))
+            for minute in range(5) for device in devices
+        ])
+
+    def test_cursor_round_trip(self):
+        moment = datetime(2026, 1, 15, 12, 30, 15, 123456, tzinfo=dt_timezone.utc)
+        self.assertEqual(streaming.decode_cursor(streaming.encode_cursor(moment, 42)), (moment, 42))
+
+    def test_malformed_cursors_are_rejected(self):
+        for token in ('not a cursor', streaming.encode_cursor(timezone.now(), 1)[:-4] + 'AAAA', ''):
+            with self.assertRaises(ValueError):
+                streaming.decode_cursor(token)
+
+    def test_keyset_pages_visit_every_row_once_in_order(self):
+        expected = list(Reading.objects.order_by('timestamp', 'id').values_list('id', flat=True))
+        seen, cursor = [], None
+        while True:
+            readings = Reading.objects.all()
+            if cursor:
+                readings = streaming.after_cursor(readings, cursor)
+            page, cursor = streaming.keyset_page(readings, 3)
+            seen += [row['id'] for row in page]
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_before_cursor_continues_a_newest_first_listing(self):
+        newest_first = list(Reading.objects.order_by('-timestamp', '-id'))
+        position = newest_first[3]
+        rest = streaming.before_cursor(Reading.objects.order_by('-timestamp', '-id'),
+                                       streaming.encode_cursor(position.timestamp, position.id))
+        self.assertEqual([reading.id for reading in rest], [reading.id for reading in newest_first[4:]])
+
+
+class DecimateMinMaxTests(SimpleTestCase):
+    def test_short_series_are_returned_as_is(self):
+        times, values = np.arange(10.0), np.arange(10.0) ** 2
+        kept_times, kept_values = decimate_minmax(times, values, 5)
+        np.testing.assert_array_equal(kept_times, times)
+        np.testing.assert_array_equal(kept_values, values)
+
+    def test_keeps_the_extremes_of_every_bucket(self):
+        rng = np.random.default_rng(7)
+        times = np.cumsum(rng.uniform(0.5, 1.5, 10_000))
+        values = np.cumsum(rng.normal(size=times.size))
+        buckets = 100
+        kept_times, kept_values = decimate_minmax(times, values, buckets)
+
+        self.assertLessEqual(kept_times.size, 2 * buckets)
+        self.assertTrue((np.diff(kept_times) > 0).all())
+        self.assertTrue(np.isin(kept_times, times).all())
+        slices = np.minimum(((times - times[0]) / (times[-1] - times[0]) * buckets).astype(int), buckets - 1)
+        kept_slices = slices[np.searchsorted(times, kept_times)]
+        for bucket in range(buckets):
+            self.assertEqual(kept_values[kept_slices == bucket].min(), values[slices == bucket].min())
+            self.assertEqual(kept_values[kept_slices == bucket].max(), values[slices == bucket].max())
+
+
+@override_settings(TIME_ZONE='Africa/Cairo')
+class ReadingsTableTests(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(number=1, code='TABLE-1')
+        self.start = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+        Reading.objects.bulk_create([
+            Reading(device=self.device, temperature=20.0 + slot / 10, humidity=40.0, timestamp=self.start + timedelta(minutes=slot))
+            for slot in range(100)
+        ])
+
+    def test_rows_stream_in_local_time_across_fetches(self):
+        with mock.patch.object(pdf_generator, 'TABLE_FETCH_SIZE', 30):
+            rows = list(pdf_generator.iter_reading_rows(self.device, end=self.start + timedelta(minutes=89)))
+        self.assertEqual(len(rows), 90)
+        self.assertEqual(rows[0], (datetime(2026, 1, 15, 2, 0), 20.0, 40.0))
+        self.assertEqual([row[0].minute for row in rows[29:31]], [29, 30])
+
+    def test_the_table_takes_one_page_per_page_of_rows(self):
+        rows = pdf_generator.iter_reading_rows(self.device)
+        pdf = canvas.Canvas(BytesIO())
+        bottom = pdf_generator.draw_readings_table(pdf, rows, 800)
+        # 100 rows at 36 per page: the last page holds a header and 28 rows below its top margin
+        self.assertEqual(pdf.getPageNumber(), 3)
+        self.assertEqual(bottom, A4[1] - 50 - pdf_generator.TABLE_ROW_HEIGHT * 29 - 20)
+
+
+class SummaryStatisticsTests(SimpleTestCase):
+    def test_durations_are_capped_at_the_logging_interval(self):
+        timestamps = EPOCH + np.array([0, 10, 20, 60, 65], dtype='timedelta64[m]')
+        self.assertEqual(report_series.sample_durations(timestamps, 15 * 60).tolist(), [600, 600, 900, 300, 900])
+
+    def test_one_pass_matches_the_textbook_definitions(self):
+        rng = np.random.default_rng(5)
+        timestamps = EPOCH + np.cumsum(rng.integers(1, 30, 500)).astype('timedelta64[m]')
+        temperatures = rng.uniform(15, 35, 500)
+        device = Device(logging_interval_minutes=15, alert_temp_min=18, alert_temp_max=30)
+        durations = report_series.sample_durations(timestamps, 15 * 60)
+
+        stats = report_series.series_stats(temperatures, durations, device.alert_temp_min, device.alert_temp_max)
+        self.assertAlmostEqual(stats.mean, float(np.mean(temperatures)))
+        self.assertAlmostEqual(stats.median, float(np.median(temperatures)))
+        self.assertEqual((stats.minimum, stats.maximum), (temperatures.min(), temperatures.max()))
+        self.assertEqual(stats.seconds_above, sum(d for t, d in zip(temperatures, durations) if t > 30))
+        self.assertEqual(stats.seconds_below, sum(d for t, d in zip(temperatures, durations) if t < 18))
+        self.assertIsNone(report_series.series_stats(temperatures, durations).seconds_above)
+
+        # Aggregates already loaded from the database are taken as they are
+        known = report_series.series_stats(temperatures, durations, known=(temperatures.min(), temperatures.max(), 25.0))
+        self.assertEqual((known.mean, known.p95), (25.0, stats.p95))
+
+    def test_mean_kinetic_temperature(self):
+        durations = np.ones(4)
+        self.assertAlmostEqual(report_series.mean_kinetic_temperature(np.full(4, 25.0), durations), 25.0)
+        # Warm spells weigh more than the arithmetic mean gives them
+        self.assertGreater(report_series.mean_kinetic_temperature(np.array([20.0, 20.0, 20.0, 40.0]), durations), 25.0)
+
+
+class ReportPrefetchTests(TestCase):
+    def setUp(self):
+        self.devices = [Device.objects.create(number=number, code=f'PRE-{number}') for number in (1, 2, 3)]
+        self.start = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+        rng = np.random.default_rng(11)
+        self.temperatures = rng.uniform(15, 35, 48).round(2)
+        for device in self.devices[:2]:
+            Reading.objects.bulk_create([
+                Reading(device=device, temperature=temperature, humidity=40.0, timestamp=self.start + timedelta(minutes=30 * slot))
+                for slot, temperature in enumerate(self.temperatures)
+            ])
+        Alarm.objects.bulk_create([
+            Alarm(device=self.devices[0], alarm_type='TEMP_HI', timestamp=self.start + timedelta(hours=hour), active=False)
+            for hour in range(8)
+        ])
+
+    def test_every_report_is_loaded_in_three_queries(self):
+        end = self.start + timedelta(hours=6)
+        with self.assertNumQueries(3):
+            contexts = prefetch_reports(Device.objects.all(), self.start, end)
+        # The device without readings in range gets no report
+        self.assertEqual([context.device for context in contexts], self.devices[:2])
+
+        aggregates = contexts[0].aggregates
+        in_range = self.temperatures[:13]
+        self.assertEqual(aggregates['count'], 13)
+        self.assertEqual((aggregates['temperature_min'], aggregates['temperature_max']), (in_range.min(), in_range.max()))
+        self.assertAlmostEqual(aggregates['temperature_avg'], in_range.mean())
+        self.assertEqual([alarm.timestamp.hour for alarm in contexts[0].alarms], [6, 5, 4, 3, 2])
+        self.assertEqual(contexts[1].alarms, [])
+
+    def test_a_report_with_its_context_queries_nothing_else(self):
+        context = prefetch_reports(Device.objects.filter(id=self.devices[0].id), self.start, None)[0]
+        readings = report_series.fetch_series(context.device)
+        with self.assertNumQueries(0):
+            pdf = pdf_generator.generate_pdf_device_report(context.device, readings, context=context, start=self.start)
+        self.assertTrue(pdf.getvalue().startswith(b'%PDF'))
+
+
+class RollupTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.devices = [Device.objects.create(number=number, code=f'ROLL-{number}') for number in (1, 2)]
+
+    def stored(self):
+        rows = ReadingRollup.objects.values_list(
+            'device_id', 'resolution', 'bucket', 'count', 'temperature_min', 'temperature_max', 'humidity_sum',
+        )
+        # Sums differ in the last bits depending on the order they were added in
+        return sorted(row[:-1] + (round(row[-1], 6),) for row in rows)
+
+    def test_folded_batches_match_a_rebuild(self):
+        rng = np.random.default_rng(3)
+        for offset in (0, 500):
+            stamps = EPOCH + (offset + np.arange(500)) * np.timedelta64(7, 'm')
+            for device in self.devices:
+                bulk_load_readings(device.id, stamps, rng.uniform(15, 30, 500).round(2), rng.uniform(30, 60, 500).round(2))
+        folded = self.stored()
+        # 1000 readings 7 minutes apart from 02:00 Cairo time on Jan 1 span five local days
+        self.assertEqual(len([row for row in folded if row[1] == '1d']), 2 * 5)
+        rollups.rebuild()
+        self.assertEqual(folded, self.stored())
+
+    def test_a_range_rebuild_drops_deleted_readings(self):
+        stamps = EPOCH + np.arange(6) * np.timedelta64(30, 'm')
+        device = self.devices[0]
+        bulk_load_readings(device.id, stamps, [20.0, 21.0, 22.0, 23.0, 24.0, 25.0], [40.0] * 6)
+        Reading.objects.filter(device=device, temperature=25.0).delete()
+        rollups.rebuild([device.id], timezone.now() - timedelta(days=3650), timezone.now())
+        hourly = ReadingRollup.objects.filter(device=device, resolution='1h').order_by('bucket')
+        self.assertEqual([(row.count, row.temperature_max) for row in hourly], [(2, 21.0), (2, 23.0), (1, 24.0)])
+
+
+class HashRingTests(SimpleTestCase):
+    device_ids = np.arange(1, 20001)
+
+    def test_assignment_is_stable(self):
+        # Pinned: every process must map a device to the same shard, across releases too
+        self.assertEqual(HashRing(range(4)).shard_of([1, 2, 3, 4, 5, 6, 7, 8, 1000, 123456]).tolist(),
+                         [3, 2, 2, 1, 1, 0, 1, 0, 1, 0])
+        np.testing.assert_array_equal(HashRing([3, 1, 0, 2]).shard_of(self.device_ids),
+                                      HashRing(range(4)).shard_of(self.device_ids))
+
+    def test_devices_are_spread_over_every_shard(self):
+        shares = np.bincount(HashRing(range(4)).shard_of(self.device_ids), minlength=4) / self.device_ids.size
+        self.assertTrue(((shares > 0.15) & (shares < 0.35)).all(), shares)
+
+    def test_a_device_keeps_its_shard_whatever_else_is_assigned(self):
+        ring = HashRing(range(4))
+        self.assertEqual(ring.shard_of([4242])[0], ring.shard_of(self.device_ids)[4241])
+
+    def test_removing_a_shard_only_moves_its_own_devices(self):
+        before = HashRing(range(4)).shard_of(self.device_ids)
+        after = HashRing([0, 1, 3]).shard_of(self.device_ids)
+        moved = before != after
+        self.assertTrue((before[moved] == 2).all())
+        self.assertFalse((after == 2).any())
+
+    def test_adding_a_shard_moves_about_its_share(self):
+        before = HashRing(range(4)).shard_of(self.device_ids)
+        after = HashRing(range(5)).shard_of(self.device_ids)
+        moved = before != after
+        self.assertTrue((after[moved] == 4).all())
+        self.assertTrue(0.1 < moved.mean() < 0.3, moved.mean())
+
+    def test_owned_partitions_the_fleet(self):
+        devices = [Device(id=device_id) for device_id in range(1, 101)]
+        ring = HashRing(range(3))
+        owned = [ring.owned(devices, shard) for shard in range(3)]
+        self.assertEqual(sorted(device.id for share in owned for device in share), list(range(1, 101)))
+
+    def test_an_empty_ring_is_an_error(self):
+        with self.assertRaises(ValueError):
+            HashRing([]).shard_of([1])
+
+
+class LeaderLeaseTests(TransactionTestCase):
+    # Expiry is compared with the database clock, which only moves between transactions on PostgreSQL
+
+    def setUp(self):
+        self.leader = LeaderLease('simulator')
+        self.standby = LeaderLease('simulator')
+        self.standby.holder = 'standby:1:00000000'
+
+    def test_only_one_process_holds_the_lease(self):
+        self.assertTrue(self.leader.acquire())
+        self.assertFalse(self.standby.acquire())
+        self.assertTrue(self.leader.acquire())  # Renewing
+        self.assertTrue(self.leader.held)
+        self.assertFalse(self.standby.held)
+        self.assertEqual(self.standby.current_holder(), self.leader.holder)
+        self.assertEqual(held_leases(['simulator', 'simulator:1']), {'simulator'})
+
+    def test_an_expired_lease_is_taken_over(self):
+        self.leader.acquire()
+        Lease.objects.filter(name='simulator').update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertTrue(self.standby.acquire())
+        self.assertFalse(self.leader.acquire())
+        self.assertFalse(self.leader.held)
+
+    def test_a_released_lease_is_free_at_once(self):
+        self.leader.acquire()
+        self.leader.release()
+        self.assertFalse(self.leader.held)
+        self.assertTrue(self.standby.acquire())
+
+    @override_settings(SIMULATOR_LEASE_SECONDS=0)
+    def test_a_leader_steps_down_when_its_lease_runs_out_unrenewed(self):
+        self.assertTrue(self.leader.acquire())
+        self.assertFalse(self.leader.held)
+
+
+class SimulatorShardTests(TestCase):
+    def setUp(self):
+        device_configs.clear()
+        scheduler = BackgroundScheduler()
+        for name, value in (
+            ('_scheduler', scheduler), ('_leases', [LeaderLease('simulator:0'), LeaderLease('simulator:1')]),
+            ('_shard', 0), ('_ring', HashRing([0])),
+        ):
+            self.enterContext(mock.patch.object(simulator, name, value))
+        self.scheduler = scheduler
+
+    @override_settings(SIMULATOR_GAP_FILL_MODE='sync')
+    def test_a_sharded_fill_never_blocks_startup(self):
+        with mock.patch.object(simulator, 'fill_gaps') as fill_gaps:
+            simulator._lead(sync_fill=True)
+        # Deferred until another election round has seen every shard, even in 'sync' mode
+        fill_gaps.assert_not_called()
+        job = self.scheduler.get_job('gap_fill_job')
+        self.assertIs(job.func, simulator._fill_gaps_then_schedule)
+
+
+class IdempotentWriteTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.device = Device.objects.create(number=1, code='SLOT-1', status='on', alert_temp_max=29.0)
+
+    def test_occupied_slots_are_skipped(self):
+        stamps = EPOCH + np.array([0, 60, 60, 120], dtype='timedelta64[s]')
+        inserted = bulk_load_readings(self.device.id, stamps, [20.0, 21.0, 22.0, 23.0], [50.0] * 4)
+        self.assertEqual(inserted[1].tolist(), stamps[[0, 1, 3]].tolist())
+        self.assertEqual(inserted[2].tolist(), [20.0, 21.0, 23.0])
+
+        inserted = bulk_load_readings(self.device.id, stamps[2:], [30.0, 30.0], [50.0] * 2)
+        self.assertEqual(len(inserted[1]), 0)
+        self.assertEqual(Reading.objects.filter(device=self.device).count(), 3)
+        self.assertEqual(counters.by_device()[self.device.id]['readings'], 3)
+
+    @override_settings(ALARM_DEBOUNCE_SECONDS=0)
+    def test_a_resent_batch_raises_nothing_again(self):
+        body = (
+            "device,timestamp,temperature,humidity\n"
+            "SLOT-1,2026-01-15T12:00:00,20,50\n"
+            "SLOT-1,2026-01-15T12:01:00,31,50\n"
+            "SLOT-1,2026-01-15T12:02:00,20,50\n"
+        ).encode()
+        self.assertEqual(ingest(parse_payload(body, 'text/csv'))['created'], 3)
+        alarm_states.clear()  # As after a restart, or in another process
+
+        summary = ingest(parse_payload(body, 'text/csv'))
+        self.assertEqual((summary['created'], summary['duplicates']), (0, 3))
+        self.assertEqual(list(Alarm.objects.filter(device=self.device).values_list('alarm_type', 'active')),
+                         [('TEMP_HI', False)])
+        self.assertEqual(counters.by_device()[self.device.id]['alarms'], 1)
+
+
+class BulkBackfillTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.start = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+
+    def test_fleet_series_runs_every_device_on_its_own_interval(self):
+        devices = [
+            Device(id=1, logging_interval_minutes=15, temperature_min=20, temperature_max=25, humidity_min=40, humidity_max=50),
+            Device(id=2, logging_interval_minutes=5, temperature_min=-5, temperature_max=0, humidity_min=80, humidity_max=90),
+        ]
+        device_ids, timestamps, temperatures, humidities = build_fleet_series(devices, [EPOCH, EPOCH + np.timedelta64(1, 'm')], [3, 2])
+        self.assertEqual(device_ids.tolist(), [1, 1, 1, 2, 2])
+        self.assertEqual((timestamps - EPOCH).astype('timedelta64[m]').astype(int).tolist(), [0, 15, 30, 1, 6])
+        self.assertTrue(((temperatures[:3] >= 20) & (temperatures[:3] <= 25)).all())
+        self.assertTrue(((humidities[3:] >= 80) & (humidities[3:] <= 90)).all())
+
+    @override_settings(SIMULATOR_FILL_CHUNK_SLOTS=4)
+    def test_fill_slots_loads_in_rounds_and_advances_the_cache(self):
+        devices = [
+            Device.objects.create(number=number, code=f'FILL-{number}', status='on', logging_interval_minutes=10,
+                                  temperature_min=20, temperature_max=25, humidity_min=40, humidity_max=50)
+            for number in (1, 2)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            created = fill_slots(devices, [to_datetime64(self.start)] * 2, [10, 3])
+        self.assertEqual(created, 13)
+        last = Reading.objects.filter(device=devices[0]).order_by('timestamp').last()
+        self.assertEqual(last.timestamp, self.start + timedelta(minutes=90))
+        self.assertEqual(last_readings.get(devices[0].id), last.timestamp)
+        self.assertEqual(last_readings.get(devices[1].id), self.start + timedelta(minutes=20))
+
+        # Resuming over slots that are already there adds nothing
+        self.assertEqual(fill_slots(devices[:1], [to_datetime64(self.start)], [10]), 0)
+
+
+class SimulationTickTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.now = datetime(2026, 1, 15, 12, tzinfo=dt_timezone.utc)
+
+    def device(self, number, status='on', minutes=15):
+        return Device.objects.create(
+            number=number, code=f'TICK-{number}', status=status, logging_interval_minutes=minutes,
+            started_at=self.now - timedelta(hours=1), temperature_min=20, temperature_max=25, humidity_min=40, humidity_max=50,
+        )
+
+    @override_settings(SIMULATOR_MAX_SLOTS_PER_TICK=3)
+    def test_one_tick_writes_every_due_slot_and_carries_the_rest_over(self):
+        quarter, five, off = self.device(1), self.device(2, minutes=5), self.device(3, status='off')
+        devices = [quarter, five, off]
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = run_simulation_tick(now=self.now, devices=devices)
+        # 4 quarter-hour and 12 five-minute slots are due; each device writes at most 3
+        self.assertEqual((stats.devices, stats.readings, stats.backlog), (2, 6, 10))
+        self.assertFalse(Reading.objects.filter(device=off).exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = run_simulation_tick(now=self.now, devices=devices)
+        self.assertEqual((stats.readings, stats.backlog), (4, 6))
+        self.assertEqual(Reading.objects.filter(device=quarter).latest('timestamp').timestamp, self.now)
+
+    def test_a_tick_with_nothing_due_writes_nothing(self):
+        device = self.device(1)
+        last_readings.get(device.id)
+        # Once the last-reading cache knows the device, a tick doesn't touch the database
+        with self.assertNumQueries(0):
+            stats = run_simulation_tick(now=self.now - timedelta(minutes=50), devices=[device])
+        self.assertEqual((stats.devices, stats.readings, stats.backlog), (0, 0, 0))
+
+
+class FillGapsTests(TransactionTestCase):
+    # The fill runs on worker threads with connections of their own, so the devices have to be committed
+
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.now = datetime(2026, 1, 15, 12, tzinfo=dt_timezone.utc)
+
+    def test_every_device_is_filled_up_to_now(self):
+        devices = [
+            Device.objects.create(
+                number=number, code=f'GAP-{number}', status=status, logging_interval_minutes=30,
+                started_at=self.now - timedelta(hours=hours), temperature_min=20, temperature_max=25,
+                humidity_min=40, humidity_max=50,
+            )
+            for number, status, hours in ((1, 'on', 10), (2, 'on', 3), (3, 'on', 1), (4, 'off', 10))
+        ]
+        # The second device was written up to an hour ago; it resumes from there
+        bulk_load_readings(devices[1].id, [to_datetime64(self.now - timedelta(hours=1))], [21.0], [45.0])
+
+        self.assertEqual(fill_gaps(now=self.now, workers=2, devices=devices), 20 + 2 + 2)
+        for device, count in zip(devices, (20, 3, 2, 0)):
+            readings = Reading.objects.filter(device=device)
+            self.assertEqual(readings.count(), count)
+            if count:
+                self.assertEqual(readings.latest('timestamp').timestamp, self.now)
+        self.assertEqual(fill_gaps(now=self.now, workers=2, devices=devices), 0)
+
+
+class LastReadingCacheTests(TestCase):
+    def setUp(self):
+        last_readings.clear()
+        self.devices = [Device.objects.create(number=number, code=f'LAST-{number}') for number in (1, 2, 3)]
+        self.start = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+        Reading.objects.bulk_create([
+            Reading(device=device, temperature=20.0, humidity=40.0, timestamp=self.start + timedelta(minutes=minute))
+            for device in self.devices[:2] for minute in (0, 15, 30)
+        ])
+
+    def test_one_query_warms_every_device(self):
+        ids = [device.id for device in self.devices]
+        with self.assertNumQueries(2):
+            # The warm-up, then one lookup for the device it found no readings for
+            last = last_readings.get_many(ids)
+        newest = self.start + timedelta(minutes=30)
+        self.assertEqual(last, {ids[0]: newest, ids[1]: newest, ids[2]: None})
+        with self.assertNumQueries(0):
+            last_readings.get_many(ids)
+
+    def test_writes_only_ever_move_it_forward(self):
+        device_id = self.devices[0].id
+        last_readings.get(device_id)
+        stamps = [self.start + timedelta(hours=2), self.start + timedelta(hours=1), self.start]
+        last_readings.record_batch([device_id, device_id, self.devices[2].id], [to_datetime64(stamp) for stamp in stamps])
+        last_readings.record(device_id, self.start)
+        self.assertEqual(last_readings.get(device_id), self.start + timedelta(hours=2))
+        self.assertEqual(last_readings.get(self.devices[2].id), self.start)
+
+        last_readings.invalidate(device_id)
+        self.assertEqual(last_readings.get(device_id), self.start + timedelta(minutes=30))
+
+
+class InjectReadingsTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='operator', password='secret'))
+        self.devices = [
+            Device.objects.create(number=number, code=f'INJ-{number}', status='on', alert_temp_max=30.0)
+            for number in (1, 2)
+        ]
+        self.start = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+        for device in self.devices:
+            bulk_load_readings(device.id, [to_datetime64(self.start + timedelta(minutes=15 * slot)) for slot in range(8)],
+                               [20.0] * 8, [40.0] * 8)
+
+    def test_one_update_rewrites_the_range_and_raises_alarms(self):
+        response = self.client.post('/api/readings/inject/', {
+            'device_mode': 'single', 'device_ids': [self.devices[0].id],
+            'start_time': (self.start + timedelta(minutes=30)).isoformat(),
+            'end_time': (self.start + timedelta(minutes=75)).isoformat(),
+            'temp_min': 35, 'temp_max': 40, 'hum_min': 60, 'hum_max': 70,
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], 4)
+
+        injected = Reading.objects.filter(device=self.devices[0], temperature__gt=30)
+        self.assertEqual(injected.count(), 4)
+        self.assertTrue(all(35 <= reading.temperature <= 40 and 60 <= reading.humidity <= 70 for reading in injected))
+        self.assertFalse(Reading.objects.filter(device=self.devices[1], temperature__gt=30).exists())
+
+        alarm = Alarm.objects.get(device=self.devices[0], alarm_type='TEMP_HI')
+        self.assertEqual(alarm.timestamp, self.start + timedelta(minutes=75))
+        hourly = ReadingRollup.objects.get(device=self.devices[0], resolution='1h', bucket=self.start)
+        first_hour = injected.filter(timestamp__lt=self.start + timedelta(hours=1))
+        self.assertEqual(hourly.temperature_max, max(reading.temperature for reading in first_hour))
+
+    def test_an_unknown_mode_is_rejected(self):
+        response = self.client.post('/api/readings/inject/', {
+            'device_mode': 'some', 'start_time': self.start.isoformat(), 'end_time': self.start.isoformat(),
+            'temp_min': 0, 'temp_max': 1, 'hum_min': 0, 'hum_max': 1,
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class DeviceConfigCacheTests(TestCase):
+    def setUp(self):
+        device_configs.clear()
+        self.device = Device.objects.create(number=1, code='CFG-1', alert_temp_max=30.0)
+        device_configs.all()
+
+    @override_settings(DEVICE_CONFIG_CHECK_SECONDS=3600)
+    def test_changes_made_here_apply_without_a_reload(self):
+        self.device.alert_temp_max = 25.0
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(device_configs.get(self.device.id).alert_temp_max, 25.0)
+            self.assertEqual(device_configs.ids_by_code(['CFG-1', 'NOPE']), {'CFG-1': self.device.id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.device.delete()
+        self.assertIsNone(device_configs.get(self.device.id))
+
+    def test_changes_made_elsewhere_show_up_once_the_version_moves(self):
+        # As another process would: a bare UPDATE, then the version bump
+        Device.objects.filter(id=self.device.id).update(alert_temp_max=25.0)
+        with override_settings(DEVICE_CONFIG_CHECK_SECONDS=3600), self.assertNumQueries(0):
+            self.assertEqual(device_configs.get(self.device.id).alert_temp_max, 30.0)
+        with override_settings(DEVICE_CONFIG_CHECK_SECONDS=0):
+            with self.assertNumQueries(1):
+                # The version hasn't moved: only the version is read
+                self.assertEqual(device_configs.get(self.device.id).alert_temp_max, 30.0)
+            bump_version()
+            with self.assertNumQueries(2):
+                self.assertEqual(device_configs.get(self.device.id).alert_temp_max, 25.0)
+
+
+class AlarmListTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='operator', password='secret'))
+        self.devices = [Device.objects.create(number=number, code=f'ACK-{number}') for number in (1, 2)]
+        self.start = datetime(2026, 1, 15, tzinfo=dt_timezone.utc)
+        for hour in range(6):
+            for device in self.devices:
+                Alarm.objects.create(device=device, alarm_type='TEMP_HI' if hour % 2 else 'HUM_LO',
+                                     timestamp=self.start + timedelta(hours=hour), active=hour == 5)
+
+    def acknowledge(self, **selection):
+        return self.client.post('/api/alarms/acknowledge/', selection, format='json')
+
+    def test_bulk_acknowledge_counts_each_alarm_down_once(self):
+        device = self.devices[0]
+        response = self.acknowledge(device=device.id, alarm_type='TEMP_HI', before=(self.start + timedelta(hours=4)).isoformat())
+        self.assertEqual(response.data, {'acknowledged': 2})
+        self.assertEqual(Alarm.objects.filter(acknowledged=True).count(), 2)
+        self.assertEqual(AuditLog.objects.filter(action='ACK_ALARM').count(), 1)
+        self.assertEqual(counters.by_device()[device.id]['alarms'], 4)
+
+        # Alarms acknowledged already are neither flipped nor counted down again
+        everything = list(Alarm.objects.values_list('id', flat=True))
+        self.assertEqual(self.acknowledge(ids=everything).data, {'acknowledged': 10})
+        self.assertEqual(counters.by_device(), {device.id: {'readings': 0, 'alarms': 0} for device in self.devices})
+        self.assertEqual(self.acknowledge(active=True).data, {'acknowledged': 0})
+
+    def test_bulk_acknowledge_needs_a_valid_selection(self):
+        self.assertEqual(self.acknowledge().status_code, 400)
+        self.assertEqual(self.acknowledge(ids='1,2').status_code, 400)
+        self.assertEqual(self.acknowledge(before='yesterday').status_code, 400)
+        self.assertFalse(Alarm.objects.filter(acknowledged=True).exists())
+
+    def test_keyset_pages_list_every_alarm_newest_first(self):
+        expected = list(Alarm.objects.filter(device=self.devices[1]).order_by('-timestamp', '-id').values_list('id', flat=True))
+        seen, query = [], {'device': self.devices[1].id, 'page_size': 4}
+        while True:
+            page = self.client.get('/api/alarms/', query).data
+            seen += [alarm['id'] for alarm in page['results']]
+            if page['next'] is None:
+                break
+            query['cursor'] = page['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.client.get('/api/alarms/', {'cursor': 'garbage'}).status_code, 400)
+        # Without paging parameters the list stays a plain array
+        self.assertEqual(len(self.client.get('/api/alarms/', {'active': 'true'}).data), 2)
+
+
+class DashboardCounterTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='operator', password='secret'))
+        self.devices = [Device.objects.create(number=number, code=f'DASH-{number}') for number in (1, 2)]
+        for device, count in zip(self.devices, (5, 3)):
+            bulk_load_readings(device.id, EPOCH + np.arange(count) * np.timedelta64(15, 'm'), [20.0] * count, [40.0] * count)
+        Alarm.objects.create(device=self.devices[0], alarm_type='TEMP_HI')
+        Alarm.objects.create(device=self.devices[1], alarm_type='HUM_LO', acknowledged=True)
+
+    def test_the_dashboard_reads_the_counters(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/dashboard/stats/', {'breakdown': 'device,alarm_type'})
+        self.assertEqual(response.data['readings'], 8)
+        self.assertEqual(response.data['alarms'], 1)
+        self.assertEqual(response.data['by_alarm_type'], {'TEMP_HI': 1})
+        self.assertEqual(response.data['by_device'][self.devices[1].id], {'readings': 3, 'alarms': 0})
+
+    def test_reconcile_repairs_drift_and_keeps_the_rest(self):
+        # Rows changed behind the application's back
+        Reading.objects.filter(device=self.devices[0], timestamp__gt=datetime(2026, 1, 1, tzinfo=dt_timezone.utc)).delete()
+        Alarm.objects.filter(device=self.devices[1]).update(acknowledged=False)
+        self.assertEqual(counters.totals()[:2], (8, 1))
+
+        self.assertEqual(counters.reconcile(chunk_size=1), 2)
+        self.assertEqual(counters.totals(), (4, 2, {'TEMP_HI': 1, 'HUM_LO': 1}))
+        counters.reconcile()
+        self.assertEqual(counters.totals()[:2], (4, 2))
+
+
+class ResumeAfterTests(SimpleTestCase):
+    started = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+    def test_a_device_without_readings_starts_from_started_at(self):
+        device = Device(started_at=self.started, status_changed_at=self.started + timedelta(days=20))
+        self.assertEqual(resume_after(device, None), self.started)
+
+    def test_time_spent_off_stays_empty(self):
+        last = self.started + timedelta(days=5)
+        device = Device(started_at=self.started, status_changed_at=last + timedelta(days=3))
+        self.assertEqual(resume_after(device, last), last + timedelta(days=3))
+        device.status_changed_at = last - timedelta(days=1)
+        self.assertEqual(resume_after(device, last), last)
+
+
+class DeviceLifecycleTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='operator', password='secret'))
+
+    def create(self, **fields):
+        started = timezone.now() - timedelta(days=2)
+        payload = {
+            'number': 7, 'code': 'LIFE-7', 'temperature_min': 20, 'temperature_max': 25,
+            'humidity_min': 40, 'humidity_max': 50, 'logging_interval_minutes': 60, 'started_at': started.isoformat(),
+            **fields,
+        }
+        response = self.client.post('/api/devices/', payload, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def test_a_device_created_on_is_backfilled(self):
+        device_id = self.create(status='on')
+        self.assertEqual(Reading.objects.filter(device_id=device_id).count(), 48)
+
+    def test_a_device_created_off_is_backfilled_when_first_switched_on(self):
+        device_id = self.create()
+        self.assertFalse(Reading.objects.filter(device_id=device_id).exists())
+
+        response = self.client.patch(f'/api/devices/{device_id}/', {'status': 'on'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(Reading.objects.filter(device_id=device_id).count(), 48)
+
+        # Switched off and on again, the time it spent off stays empty
+        self.client.patch(f'/api/devices/{device_id}/', {'status': 'off'}, format='json')
+        self.client.patch(f'/api/devices/{device_id}/', {'status': 'on'}, format='json')
+        self.assertEqual(Reading.objects.filter(device_id=device_id).count(), 48)
+
+
+class ReportJobTests(TestCase):
+    def setUp(self):
+        reports_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(reports_dir.cleanup)
+        self.enterContext(override_settings(REPORTS_DIR=reports_dir.name))
+        self.user = get_user_model().objects.create_user(username='analyst', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_the_zip_endpoints_queue_a_job(self):
+        response = self.client.post('/api/devices/report/?start=2026-01-01T00:00:00Z', {'device_ids': ['3', 4]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = ReportJob.objects.get(id=response.data['id'])
+        self.assertEqual((job.status, job.device_ids, job.created_by), ('queued', [3, 4], self.user))
+        self.assertEqual(job.start, datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+        self.assertTrue(response['Location'].endswith(f'/api/report-jobs/{job.id}/'))
+
+        response = self.client.get('/api/devices/report/all/')
+        self.assertEqual(response.status_code, 202)
+        self.assertIsNone(ReportJob.objects.get(id=response.data['id']).device_ids)
+
+    def test_users_only_see_their_own_jobs(self):
+        own = ReportJob.objects.create(created_by=self.user, status='done', file_path=__file__)
+        other = ReportJob.objects.create(created_by=get_user_model().objects.create_user(username='other'), status='done')
+        self.assertEqual([job['id'] for job in self.client.get('/api/report-jobs/').data], [str(own.id)])
+        self.assertEqual(self.client.get(f'/api/report-jobs/{other.id}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/report-jobs/{other.id}/download/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/report-jobs/{own.id}/download/').status_code, 200)
+
+        self.user.is_staff = True
+        self.user.save()
+        self.assertEqual(len(self.client.get('/api/report-jobs/').data), 2)
+
+    def test_a_job_is_claimed_once(self):
+        job = ReportJob.objects.create()
+        claimed = report_jobs._claim_next_job()
+        self.assertEqual((claimed.id, claimed.status), (job.id, 'running'))
+        self.assertIsNone(report_jobs._claim_next_job())
+
+    def test_a_silent_job_is_taken_over(self):
+        job = ReportJob.objects.create()
+        first = report_jobs._claim_next_job()
+        ReportJob.objects.filter(id=job.id).update(
+            claimed_by='gone', heartbeat_at=timezone.now() - timedelta(seconds=settings.REPORT_JOB_STALE_SECONDS * 2),
+        )
+        second = report_jobs._claim_next_job()
+        self.assertEqual(second.id, job.id)
+        # The process that lost it stops at its next progress report
+        first.claimed_by = 'gone'
+        with self.assertRaises(report_jobs.JobLost):
+            report_jobs._report(first, completed=1)
+        report_jobs._report(second, completed=1)
+
+    def test_finished_reports_expire(self):
+        old, recent = ReportJob.objects.create(status='done'), ReportJob.objects.create(status='done')
+        ReportJob.objects.filter(id=old.id).update(finished_at=timezone.now() - timedelta(hours=settings.REPORT_RETENTION_HOURS + 1))
+        ReportJob.objects.filter(id=recent.id).update(finished_at=timezone.now())
+        for job in (old, recent):
+            (Path(settings.REPORTS_DIR) / str(job.id)).mkdir()
+        self.assertEqual(report_jobs.expire_reports(), 1)
+        self.assertEqual(ReportJob.objects.get(id=old.id).status, 'expired')
+        self.assertFalse((Path(settings.REPORTS_DIR) / str(old.id)).exists())
+        self.assertTrue((Path(settings.REPORTS_DIR) / str(recent.id)).exists())
+
+
+class ReportCacheTests(TestCase):
+    def setUp(self):
+        for cache in (device_configs, last_readings, alarm_states):
+            cache.clear()
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.enterContext(override_settings(REPORT_CACHE_DIR=cache_dir.name))
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.create_user(username='reader', password='secret'))
+        self.device = Device.objects.create(number=1, code='REPORT-1', status='on')
+        stamps = np.datetime64('2026-01-15T00:00', 'us') + np.arange(48) * np.timedelta64(30, 'm')
+        bulk_load_readings(self.device.id, stamps, np.linspace(20, 25, 48), np.full(48, 45.0))
+        self.url = f'/api/devices/{self.device.id}/report/?start=2026-01-15T00:00:00Z&end=2026-01-15T23:59:59Z'
+
+    def test_unchanged_reports_are_not_modified(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_writes_in_range_change_the_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        bulk_load_readings(self.device.id, [np.datetime64('2026-01-15T12:10', 'us')], [30.0], [45.0])
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        # Writes outside the range leave it alone
+        etag = response['ETag']
+        bulk_load_readings(self.device.id, [np.datetime64('2026-01-17T12:00', 'us')], [30.0], [45.0])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_a_range_without_readings_is_not_found(self):
+        response = self.client.get(f'/api/devices/{self.device.id}/report/?start=2025-01-01T00:00:00Z&end=2025-01-02T00:00:00Z')
+        self.assertEqual(response.status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Readings are only partitioned on PostgreSQL')
+class PartitionTests(TestCase):
+    def setUp(self):
+        self.device = Device.objects.create(number=1, code='PART-1')
+
+    def query(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall() if cursor.description else None
+
+    def test_a_plain_table_is_partitioned_in_place(self):
+        # Start over from the plain table the model describes; the test transaction undoes it all
+        self.query(f'DROP TABLE {READINGS_TABLE} CASCADE')
+        with connection.schema_editor() as editor:
+            editor.create_model(Reading)
+        self.query(f'CREATE INDEX reading_timestamp_brin ON {READINGS_TABLE} USING brin ("timestamp")')
+        stored = Reading.objects.bulk_create([
+            Reading(device=self.device, temperature=20.0, humidity=40.0, timestamp=moment)
+            for moment in (datetime(2026, 1, 31, 23, tzinfo=dt_timezone.utc), datetime(2026, 2, 1, 1, tzinfo=dt_timezone.utc))
+        ])
+        # As if committed: the deferred foreign key checks mustn't be pending on the old table
+        self.query('SET CONSTRAINTS ALL IMMEDIATE')
+
+        with connection.cursor() as cursor:
+            partition_readings_table(cursor)
+            self.assertTrue(is_partitioned(cursor))
+            months = monthly_partitions(cursor)
+        self.assertIn(datetime(2026, 1, 1, tzinfo=dt_timezone.utc), months)
+        self.assertIn(datetime(2026, 2, 1, tzinfo=dt_timezone.utc), months)
+        self.assertEqual(
+            self.query(f'SELECT id, tableoid::regclass::text FROM {READINGS_TABLE} ORDER BY id'),
+            [(stored[0].id, f'{READINGS_TABLE}_y2026m01'), (stored[1].id, f'{READINGS_TABLE}_y2026m02')],
+        )
+
+        # Ids continue from the identity, and every constraint and index is back under its name
+        self.assertEqual(self.query(
+            "SELECT is_identity FROM information_schema.columns WHERE table_name = %s AND column_name = 'id'",
+            [READINGS_TABLE],
+        ), [('YES',)])
+        created = Reading.objects.create(device=self.device, temperature=21.0, humidity=41.0,
+                                         timestamp=datetime(2026, 2, 2, tzinfo=dt_timezone.utc))
+        self.assertGreater(created.id, stored[1].id)
+        constraints = dict(self.query(
+            "SELECT conname, contype FROM pg_constraint WHERE conrelid = to_regclass(%s)", [READINGS_TABLE],
+        ))
+        self.assertEqual(constraints.pop(f'{READINGS_TABLE}_pkey'), 'p')
+        self.assertEqual(constraints.pop('unique_reading_slot'), 'u')
+        self.assertEqual(list(constraints.values()), ['f'])
+        self.assertIn(('reading_timestamp_brin',), self.query(
+            "SELECT indexname FROM pg_indexes WHERE tablename = %s", [READINGS_TABLE],
+        ))
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Reading.objects.create(device=self.device, temperature=22.0, humidity=42.0, timestamp=created.timestamp)
+
+    def test_new_partitions_take_over_rows_from_the_default_one(self):
+        far = datetime(2031, 5, 10, tzinfo=dt_timezone.utc)
+        Reading.objects.create(device=self.device, temperature=20.0, humidity=40.0, timestamp=far)
+        self.assertEqual(self.query(f'SELECT tableoid::regclass::text FROM {READINGS_TABLE}'), [(f'{READINGS_TABLE}_default',)])
+        with connection.cursor() as cursor:
+            self.assertEqual(ensure_partitions(cursor, far, far), [f'{READINGS_TABLE}_y2031m05'])
+            self.assertEqual(ensure_partitions(cursor, far, far), [])
+        self.assertEqual(self.query(f'SELECT tableoid::regclass::text FROM {READINGS_TABLE}'), [(f'{READINGS_TABLE}_y2031m05',)])
+
+
+class LiveFeedTests(TestCase):
+    def test_relay_is_off_by_default(self):
+        self.assertFalse(settings.LIVE_RELAY)
+        self.assertFalse(live.broker.active)
+        # Nobody is listening: publishing costs nothing, the database included
+        with self.assertNumQueries(0):
+            live.publish_readings(7, [EPOCH], [20.0], [50.0])
+
+    def test_a_slow_client_only_keeps_the_newest_event_per_device(self):
+        subscriber = live.broker.subscribe(device_ids={7})
+        self.addCleanup(live.broker.unsubscribe, subscriber)
+        live.publish_readings([7, 7, 8], [EPOCH, EPOCH + np.timedelta64(60, 's'), EPOCH], [20.0, 21.5, 30.0], [50.0] * 3)
+        live.publish_alarms([(7, 'temperature_high', 'raised', 21.5, timezone.now())])
+
+        frames = subscriber.drain()
+        self.assertEqual(len(frames), 2)
+        self.assertIn('"temperature":21.5', frames[0])
+        self.assertTrue(frames[1].startswith('event: alarm'))
+        self.assertEqual(subscriber.drain(), [])
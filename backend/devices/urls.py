@@ -1,13 +1,15 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import AlarmViewSet, DeviceViewSet, ManufacturerViewSet, ReadingViewSet, dashboard_stats
+from .views import AlarmViewSet, DeviceViewSet, ManufacturerViewSet, ReadingViewSet, ReportJobViewSet, dashboard_stats, live_events
 
 router =DefaultRouter()
 router.register(r'devices', DeviceViewSet, basename='device')
 router.register(r'readings', ReadingViewSet)
 router.register(r'alarms', AlarmViewSet)
 router.register(r'manufacturers', ManufacturerViewSet)
+router.register(r'report-jobs', ReportJobViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('dashboard/stats/', dashboard_stats),
+    path('live/', live_events),
 ]
\ No newline at end of file
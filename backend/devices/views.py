@@ -1,36 +1,39 @@
-import random
+from time import perf_counter
 from django.shortcuts import render
-from rest_framework import viewsets
-from .models import Alarm, Device, Manufacturer
+from rest_framework import mixins, viewsets
+from .models import Alarm, Device, Manufacturer, ReportJob
 from .serializers import AlarmSerializer, DeviceSerializer
-from .serializers import ReadingSerializer
+from .serializers import ReadingSerializer, ReportJobSerializer
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
-from django.http import HttpResponse
-from reportlab.pdfgen import canvas
-from io import BytesIO
-import os
-import zipfile 
+from django.conf import settings
+from django.db import connection, transaction
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import require_GET
 from datetime import datetime,time, timedelta
 from django.utils import timezone
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.utils import ImageReader
-import matplotlib.pyplot as plt
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.dateparse import parse_datetime
-import matplotlib
-import matplotlib.dates as mdates
-from reportlab.lib import colors
 from rest_framework.parsers import JSONParser
-from .simulation import backfill_readings
+from .simulation import backfill_readings, inject_random_values, is_simulated
+from . import counters, live, rollups, streaming
+from . import ingest as batch_ingest
 from .serializers import ManufacturerSerializer
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
 from audit.models import AuditLog
 
-# from devices.reports.pdf_generator import generate_pdf_device_report
+from devices.reports import cache as report_cache
+from devices.reports import jobs as report_jobs
+from devices.reports.pdf_generator import generate_pdf_device_report, iter_reading_rows
+from devices.reports.series import fetch_series
 
-matplotlib.use('Agg')  # Use non-GUI backend for rendering
 
 class DeviceViewSet(viewsets.ModelViewSet):
     queryset = Device.objects.all()
@@ -38,9 +41,9 @@ class DeviceViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated] 
     def perform_create(self, serializer):
         device = serializer.save()
-        # Backfill readings for the device
-        backfill_readings(device)
-        print(f"Backfilled readings for device: {device.code}")
+        # Backfill readings for the device; one created off is backfilled when first switched on
+        if backfill_readings(device):
+            print(f"Backfilled readings for device: {device.code}")
 
         # ✅ Audit log
         AuditLog.objects.create(
@@ -53,6 +56,10 @@ class DeviceViewSet(viewsets.ModelViewSet):
 
     def perform_update(self, serializer):
         device = serializer.save()
+        if is_simulated(device) and not Reading.objects.filter(device=device).exists():
+            # Switched on for the first time: its history from started_at is still missing
+            if backfill_readings(device):
+                print(f"Backfilled readings for device: {device.code}")
 
         # ✅ Audit log
         print(self.request.user)
@@ -76,320 +83,6 @@ class DeviceViewSet(viewsets.ModelViewSet):
         )
         instance.delete()
         
-    def _get_readings_for_device(self, device, start=None, end=None):
-        readings = device.readings.all().order_by('timestamp')
-        if start:
-            readings = readings.filter(timestamp__gte=start)
-        if end:
-            readings = readings.filter(timestamp__lte=end)
-            # Localize timestamps to the current timezone
-        localized_readings = []
-        for r in readings:
-            r.timestamp = timezone.localtime(r.timestamp)  # convert UTC → local
-            localized_readings.append(r)
-        return localized_readings
-
-    def _generate_pdf_device_report(self, device, readings):
-        buffer = BytesIO()
-
-        # Extract readings
-        temps = [r.temperature for r in readings]
-        hums = [r.humidity for r in readings]
-        times = [r.timestamp for r in readings]
-
-        temp_max, temp_min, temp_avg = max(temps), min(temps), sum(temps) / len(temps)
-        hum_max, hum_min, hum_avg = max(hums), min(hums), sum(hums) / len(hums)
-        tz = timezone.get_current_timezone()
-        # Generate Temperature Graph
-        temp_graph_buf = BytesIO()
-        plt.figure(figsize=(10, 3))
-        plt.plot(times, temps, label='Temperature', color='red')
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter("%I:%M %p %d-%m-%Y",tz=tz),)
-        plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-        plt.xlabel('Timestamp', weight='bold')
-        plt.ylabel('Temperature (°C)', weight='bold')
-        plt.title(f'Device {device.number} {device.code} - Temperature Over Time', weight='bold')
-        plt.grid(True)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig(temp_graph_buf, format='png')
-        plt.close()
-        temp_graph_buf.seek(0)
-
-        # Generate Humidity Graph
-        hum_graph_buf = BytesIO()
-        plt.figure(figsize=(10, 3))
-        plt.plot(times, hums, label='Humidity', color='blue')
-        plt.gca().xaxis.set_major_formatter(mdates.DateFormatter("%I:%M %p %d-%m-%Y",tz=tz))
-        plt.gca().xaxis.set_major_locator(mdates.AutoDateLocator())
-        plt.xlabel('Timestamp', weight='bold')
-        plt.ylabel('Humidity (%)', weight='bold')
-        plt.title(f'{device.code} - Humidity Over Time', weight='bold')
-        plt.grid(True)
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig(hum_graph_buf, format='png')
-        plt.close()
-        hum_graph_buf.seek(0)
-
-        # Start PDF
-        c = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-
-        def draw_header():
-            c.setFont("Helvetica-Bold", 28)
-            c.drawCentredString(width / 2, height - 50, "Data Report")
-
-            c.setFont("Helvetica-Bold", 20)
-            c.setFillColorRGB(0, 0.7, 1)
-            c.drawCentredString(width / 2, height - 80, device.code)
-
-            logo_path = "./assets/goveeIcon.png"
-            if os.path.exists(logo_path):
-                c.drawImage(logo_path, 30, height - 60, width=40,
-                            preserveAspectRatio=True, mask='auto')
-
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColor(colors.black)
-            c.drawString(50, height - 100, "Location: ")
-            c.setFillColorRGB(0, 0.6, 1)
-            c.drawString(110, height - 100, device.location)
-
-        def draw_device_info(y_pos):
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColorRGB(0, 0.75, 0.85)
-            c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
-            c.setFillColor(colors.black)
-            c.drawString(55, y_pos - 15, "Device Information")
-
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(60, y_pos - 35, "Device Model:")
-            c.setFont("Helvetica", 10)
-            c.drawString(140, y_pos - 35, device.code)
-
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(250, y_pos - 35, "Probe Type:")
-            c.setFont("Helvetica", 10)
-            c.drawString(370, y_pos - 35, "Temperature & Humidity")
-
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(60, y_pos - 50, "Serial Number:")
-            c.setFont("Helvetica", 10)
-            c.drawString(140, y_pos - 50,
-                        getattr(device, 'serial_number', None) or 'N/A')
-
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(250, y_pos - 50, "Firmware Version:")
-            c.setFont("Helvetica", 10)
-            c.drawString(370, y_pos - 50, "V5.10")
-
-            return y_pos - 70
-
-        def draw_device_settings(y_pos):
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColorRGB(0, 0.75, 0.85)
-            c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
-            c.setFillColor(colors.black)
-            c.drawString(55, y_pos - 15, "Device Settings")
-
-            c.setFont("Helvetica-Bold", 10)
-            c.drawString(60, y_pos - 35, "Button stop: ")
-            c.drawString(60, y_pos - 50, "Mute Button:")
-            c.drawString(60, y_pos - 65, "Alarm Tone: ")
-            c.drawString(250, y_pos - 35, "Logging Interval: ")
-            c.drawString(250, y_pos - 50, "Alarm Logging Interval: ")
-            c.drawString(250, y_pos - 65, "Storage Mode: ")
-            button_stop="Enable" if device.button_stop_enabled else"Disable"
-            mute_stop="Enable" if device.mute_button_enabled else"Disable"
-            alarm_tone="Enable" if device.alarm_tone_enabled else"Disable"
-            c.setFont("Helvetica", 10)
-            c.drawString(140, y_pos - 35, button_stop)
-            c.drawString(140, y_pos - 50, mute_stop)
-            c.drawString(140, y_pos - 65, alarm_tone)
-            c.drawString(370, y_pos - 35, "15m")
-            c.drawString(370, y_pos - 50, "15m")
-            c.drawString(370, y_pos - 65, "Loop")
-
-            return y_pos - 85
-
-        def draw_alarms(y_pos):
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColorRGB(0, 0.75, 0.85)
-            c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
-            c.setFillColor(colors.black)
-            c.drawString(55, y_pos - 15, "Alarm Status")
-
-            alarms = Alarm.objects.filter(device=device).order_by('-timestamp')[:5]
-            y = y_pos - 35
-            if alarms.exists():
-                for alarm in alarms:
-                    message = f"[{timezone.localtime(alarm.timestamp).strftime('%Y-%m-%d %H:%M')}] {alarm.alarm_type.upper()} - {alarm.user_message()}"
-                    c.drawString(60, y, message[:100])
-                    y -= 15
-                    if y < 100:
-                        c.showPage()
-                        y = height - 50
-            else:
-                c.setFillColorRGB(0.2, 0.2, 0.8)
-                c.drawString(60, y, "There are no available alarms.")
-                y -= 15
-
-            c.setFillColor(colors.black)
-            return y
-
-        def draw_summary(y_pos):
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColorRGB(0, 0.75, 0.85)
-            c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
-            c.setFillColor(colors.black)
-            c.drawString(55, y_pos - 15, "Summary")
-
-            c.setFillColorRGB(0.2, 0.4, 1)
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(110, y_pos - 40, "Temperature")
-
-            y = y_pos - 60
-            c.setFillColor(colors.black)
-
-            temp_labels = ["Maximum:", "Minimum:", "Average:"]
-            temp_values = [f"{temp_max:.1f}", f"{temp_min:.1f}", f"{temp_avg:.2f}"]
-
-            for label, value in zip(temp_labels, temp_values):
-                c.setFont("Helvetica-Bold", 10)
-                c.drawString(90, y, label)
-                c.setFont("Helvetica", 10)
-                c.drawString(160, y, value)
-                y -= 15
-
-            c.setFillColorRGB(0.2, 0.4, 1)
-            c.setFont("Helvetica-Bold", 11)
-            c.drawString(400, y_pos - 40, "Humidity")
-
-            y = y_pos - 60
-            c.setFillColor(colors.black)
-
-            hum_labels = ["Maximum:", "Minimum:", "Average:"]
-            hum_values = [f"{hum_max:.1f}", f"{hum_min:.1f}", f"{hum_avg:.2f}"]
-
-            for label, value in zip(hum_labels, hum_values):
-                c.setFont("Helvetica-Bold", 10)
-                c.drawString(380, y, label)
-                c.setFont("Helvetica", 10)
-                c.drawString(450, y, value)
-                y -= 15
-
-            return y_pos - 100
-
-        def draw_graphs(y_pos):
-            # Temperature Graph
-            if y_pos - 180 < 50:
-                c.showPage()
-                y_pos = height - 50
-            temp_img = ImageReader(temp_graph_buf)
-            c.drawImage(temp_img, 70, y_pos - 150, width=450, height=150)
-            y_pos -= 180
-
-            # Humidity Graph
-            if y_pos - 180 < 50:
-                c.showPage()
-                y_pos = height - 50
-            hum_img = ImageReader(hum_graph_buf)
-            c.drawImage(hum_img, 70, y_pos - 150, width=450, height=150)
-            y_pos -= 180
-
-            return y_pos
-
-        def draw_readings_table(y_pos):
-            table_data = []
-            for r in readings:
-                # reading_time =timezone.localtime(r.timestamp)
-                reading_time=r.timestamp
-                table_data.append({
-                    'timestamp': reading_time.strftime("%I:%M %p %d-%m-%Y"),
-                    'temperature': f"{r.temperature:.1f}°C",
-                    'humidity': f"{r.humidity:.1f}%"
-                })
-
-            c.setFont("Helvetica-Bold", 12)
-            c.setFillColorRGB(0, 0.75, 0.85)
-            c.rect(50, y_pos - 20, width - 100, 20, fill=1, stroke=0)
-            c.setFillColor(colors.black)
-            c.drawString(55, y_pos - 15, "Readings Data")
-
-            if y_pos - 250 < 50:
-                c.showPage()
-                y_pos = height - 50
-
-            col_widths = [166, 164, 164]
-            row_height = 20
-            header_height = y_pos - 45
-            data_start = header_height - row_height
-
-            headers = ["Timestamp", "Temperature", "Humidity"]
-            c.setFont("Helvetica-Bold", 10)
-
-            x = 50
-            for i, header in enumerate(headers):
-                c.rect(x, header_height - row_height, col_widths[i], row_height)
-                c.drawString(x + 5, header_height - row_height + 5, header)
-                x += col_widths[i]
-
-            c.setFont("Helvetica", 9)
-            current_y = data_start
-            rows_per_page = 36
-
-            for i, reading in enumerate(table_data):
-                if i > 0 and i % rows_per_page == 0:
-                    c.showPage()
-                    current_y = height - 50
-                    c.setFont("Helvetica-Bold", 10)
-                    x = 50
-                    for j, header in enumerate(headers):
-                        c.rect(x, current_y - row_height, col_widths[j], row_height)
-                        c.drawString(x + 5, current_y - row_height + 5, header)
-                        x += col_widths[j]
-                    current_y -= row_height
-                    c.setFont("Helvetica", 9)
-
-                x = 50
-                c.rect(x, current_y - row_height, col_widths[0], row_height)
-                c.drawString(x + 5, current_y - row_height + 5, reading['timestamp'])
-                x += col_widths[0]
-
-                c.rect(x, current_y - row_height, col_widths[1], row_height)
-                c.drawString(x + 5, current_y - row_height + 5, reading['temperature'])
-                x += col_widths[1]
-
-                c.rect(x, current_y - row_height, col_widths[2], row_height)
-                c.drawString(x + 5, current_y - row_height + 5, reading['humidity'])
-
-                current_y -= row_height
-
-            return current_y - 20
-
-        # ==== Main Drawing Sequence ====
-        draw_header()
-        current_y = height - 125
-
-        current_y = draw_device_info(current_y)
-        current_y = draw_device_settings(current_y)
-        current_y = draw_alarms(current_y)
-
-        if current_y < 100:
-            c.showPage()
-            current_y = height - 50
-
-        current_y = draw_summary(current_y)
-        current_y = draw_graphs(current_y)
-
-        c.showPage()
-        draw_readings_table(height - 50)
-
-        c.save()
-        buffer.seek(0)
-        return buffer
-
-        
     #report for single device
     @action(detail=True, methods=['get'], url_path='report')   
     def generate_pdf_report(self, request, pk=None):
@@ -400,85 +93,193 @@ class DeviceViewSet(viewsets.ModelViewSet):
             end_param = request.query_params.get('end')
             start = parse_datetime(start_param) if start_param else None
             end = parse_datetime(end_param) if end_param else None
-            readings=self._get_readings_for_device(device,start,end)
-            if not readings:
+            filename = f"device_{device.id}_report.pdf"
+            if report_cache.is_enabled():
+                marker = report_cache.change_marker(device, start, end)
+                if not marker[0]:
+                    return Response({'error': 'No readings in this time range'}, status=404)
+                key = report_cache.report_key(device, start, end, marker)
+                etag = f'"{key}"'
+                not_modified = get_conditional_response(request, etag=etag)
+                if not_modified is not None:
+                    return not_modified
+                path = report_cache.lookup(device.id, start, end, key)
+                if path is None:
+                    readings = fetch_series(device, start, end)
+                    # The marker covers whole hours; the range itself may still hold no reading
+                    if not readings.timestamps.size:
+                        return Response({'error': 'No readings in this time range'}, status=404)
+                    path = report_cache.store(device.id, start, end, key, lambda output: generate_pdf_device_report(
+                        device, readings, output=output, table_rows=iter_reading_rows(device, start, end),
+                        start=start, end=end))
+                response = FileResponse(open(path, 'rb'), content_type='application/pdf',
+                                        as_attachment=True, filename=filename)
+                response['ETag'] = etag
+                patch_cache_control(response, private=True, no_cache=True)
+                return response
+
+            readings=fetch_series(device,start,end)
+            if not readings.timestamps.size:
                 return Response({'error': 'No readings in this time range'}, status=404)
-            buffer= self._generate_pdf_device_report(device, readings)
-            response = HttpResponse(buffer, content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="device_{device.id}_report.pdf"'
+            response = HttpResponse(content_type='application/pdf')
+            generate_pdf_device_report(device, readings, output=response,
+                                       table_rows=iter_reading_rows(device, start, end), start=start, end=end)
+            response['Content-Disposition'] = f'attachment; filename="{filename}"'
             return response
 
         except Device.DoesNotExist:
             print(f"DEBUG: device with id {pk} not found")
             return Response({'error': 'Device not found'}, status=status.HTTP_404_NOT_FOUND)
-    # All Devices' Reports
+    def _queue_report_job(self, request, device_ids):
+        """Queue the ZIP as a ReportJob (see /api/report-jobs/) instead of rendering it in the request."""
+        serializer = ReportJobSerializer(data={
+            'device_ids': device_ids,
+            'start': request.query_params.get('start'),
+            'end': request.query_params.get('end'),
+        })
+        serializer.is_valid(raise_exception=True)
+        job = serializer.save(created_by=request.user)
+        transaction.on_commit(lambda: report_jobs.submit(job))
+        location = request.build_absolute_uri(reverse('reportjob-detail', args=[job.id]))
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED, headers={'Location': location})
+
+    # All Devices' Reports (deprecated: a 202 with the queued job; poll it and fetch its download)
     @action(detail=False, methods=['get'], url_path='report/all')
     def generate_all_devices_reports(self, request):
-        devices = self.get_queryset()
-        start_param = request.query_params.get('start')
-        end_param = request.query_params.get('end')
-        start = parse_datetime(start_param) if start_param else None
-        end = parse_datetime(end_param) if end_param else None
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for device in devices:
-                readings=self._get_readings_for_device(device,start,end)
-                if not readings.exists():
-                    continue
-                pdf_buffer = self._generate_pdf_device_report(device,readings)
-                pdf_filename = f"device_{device.id}_report.pdf"
-                zip_file.writestr(pdf_filename, pdf_buffer.read())
-
-        zip_buffer.seek(0)
-        response = HttpResponse(zip_buffer, content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename="all_devices_reports.zip"'
-        return response
+        return self._queue_report_job(request, None)
+
     @action(detail=False, methods=['post'], url_path='report')
     def generate_multiple_devices_reports(self, request):
         device_ids = request.data.get('device_ids', [])
         if not device_ids:
             return Response({'error': 'No device_ids provided'}, status=400)
-         
-        start = parse_datetime(request.query_params.get('start'))
-        end = parse_datetime(request.query_params.get('end'))
-
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for device in Device.objects.filter(id__in=device_ids):
-                readings = self._get_readings_for_device(device, start, end)
-                if not readings.exists():
-                    continue
-                pdf_buffer = self._generate_pdf_device_report(device, readings)
-                filename = f"device_{device.id}_report.pdf"
-                zip_file.writestr(filename, pdf_buffer.read())
-
-        zip_buffer.seek(0)
-        response = HttpResponse(zip_buffer, content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename="selected_devices_reports.zip"'
-        return response
+        try:
+            device_ids = [int(device_id) for device_id in device_ids]
+        except (TypeError, ValueError):
+            return Response({'error': 'device_ids must be a list of integers'}, status=400)
+        return self._queue_report_job(request, device_ids)
     @action(detail=True, methods=['get'],url_path='readings')
     def readings(self,request, pk=None):
         device= self.get_object()
         start_date = request.query_params.get('start')
         end_date= request.query_params.get('end')
+        resolution = request.query_params.get('resolution', 'auto')
+        start_date_time = end_date_time = None
         readings= device.readings.all().order_by('timestamp')
         if start_date:
-            start_date_time=datetime.combine(datetime.fromisoformat(start_date).date(), time.min    )
+            start_date_time=timezone.make_aware(datetime.combine(datetime.fromisoformat(start_date).date(), time.min    ))
             readings= readings.filter(timestamp__gte=start_date_time)
         if end_date:
-            end_date_time=datetime.combine(datetime.fromisoformat(end_date).date(), time.max    )
+            end_date_time=timezone.make_aware(datetime.combine(datetime.fromisoformat(end_date).date(), time.max    ))
             readings= readings.filter(timestamp__lte=end_date_time)
-        serializer= ReadingSerializer(readings,many=True)
-        return Response(serializer.data)
+
+        stream = request.query_params.get('stream')
+        cursor = request.query_params.get('cursor')
+        page_size = request.query_params.get('page_size')
+        if stream or cursor or page_size:
+            # Streaming and keyset paging always work on raw rows
+            try:
+                if cursor:
+                    readings = streaming.after_cursor(readings, cursor)
+                page_size = min(int(page_size or streaming.MAX_PAGE_SIZE), streaming.MAX_PAGE_SIZE)
+                if page_size < 1:
+                    raise ValueError
+            except ValueError:
+                return Response({'error': 'Invalid cursor or page_size'}, status=400)
+            if not stream:
+                results, next_cursor = streaming.keyset_page(readings, page_size)
+                return Response({'results': results, 'next': next_cursor})
+            if stream == 'ndjson':
+                return StreamingHttpResponse(streaming.ndjson_lines(readings), content_type='application/x-ndjson')
+            if stream == 'json':
+                return StreamingHttpResponse(streaming.json_array_chunks(readings), content_type='application/json')
+            return Response({'error': 'stream must be ndjson or json'}, status=400)
+
+        if resolution == 'auto':
+            resolution = rollups.pick_resolution(start_date_time or device.started_at, end_date_time or timezone.now())
+        if resolution == 'raw':
+            data = ReadingSerializer(readings,many=True).data
+        elif resolution in ('5m', *rollups.RESOLUTIONS):
+            data = rollups.rollup_series(device.id, resolution, start_date_time, end_date_time)
+            for point in data:
+                point['timestamp'] = timezone.localtime(point['timestamp'])
+        else:
+            return Response({'error': 'resolution must be one of raw, 5m, 1h, 1d or auto'}, status=400)
+
+        response = Response(data)
+        response['X-Readings-Resolution'] = resolution
+        return response
 
 #Reading 
 from rest_framework import viewsets
+from .cache import last_readings
 from .models import Reading
 from .serializers import ReadingSerializer
 
 class ReadingViewSet(viewsets.ModelViewSet):
     queryset = Reading.objects.all()
     serializer_class = ReadingSerializer
+
+    # Each write and its rollup and counter changes commit together (see rollups.lock_devices)
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            reading = serializer.save()
+            if not serializer.created:
+                # Posting to an occupied slot overwrote its values; edits are re-rolled up here as in perform_update
+                rollups.rebuild([reading.device_id], reading.timestamp, reading.timestamp)
+        if not serializer.created:
+            report_cache.invalidate([reading.device_id], reading.timestamp, reading.timestamp)
+
+    def perform_update(self, serializer):
+        previous = serializer.instance.timestamp
+        with transaction.atomic():
+            reading = serializer.save()
+            for moment in {previous, reading.timestamp}:
+                rollups.rebuild([reading.device_id], moment, moment)
+        for moment in {previous, reading.timestamp}:
+            report_cache.invalidate([reading.device_id], moment, moment)
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            counters.add({(instance.device_id, counters.READINGS): -1})
+            rollups.rebuild([instance.device_id], instance.timestamp, instance.timestamp)
+        last_readings.invalidate(instance.device_id)
+        report_cache.invalidate([instance.device_id], instance.timestamp, instance.timestamp)
+
+    @action(detail=False, methods=['post'], url_path='ingest')
+    def ingest_readings(self, request):
+        """Load a batch of readings from a JSON array, NDJSON or CSV body, or an uploaded `file`."""
+        started = perf_counter()
+        upload = request.FILES.get('file') if request.content_type.startswith('multipart/') else None
+        if upload is not None:
+            content_type = upload.content_type
+            if upload.name.lower().endswith('.csv'):
+                content_type = 'text/csv'
+            elif upload.name.lower().endswith(('.ndjson', '.jsonl')):
+                content_type = 'application/x-ndjson'
+            if upload.size > settings.INGEST_MAX_BYTES:
+                return Response({'error': 'Payload too large'}, status=413)
+            data = upload.read()
+        else:
+            content_type = request.content_type
+            # Read the stream directly: request.body caps at DATA_UPLOAD_MAX_MEMORY_SIZE
+            data = request.read(settings.INGEST_MAX_BYTES + 1)
+            if len(data) > settings.INGEST_MAX_BYTES:
+                return Response({'error': 'Payload too large'}, status=413)
+
+        try:
+            columns = batch_ingest.parse_payload(data, content_type, device=request.query_params.get('device'))
+        except batch_ingest.IngestError as exc:
+            return Response({'error': str(exc)}, status=400)
+        summary = batch_ingest.ingest(columns)
+        elapsed = perf_counter() - started
+        summary['elapsed_ms'] = round(elapsed * 1000, 1)
+        summary['rows_per_second'] = round(summary['created'] / elapsed) if elapsed else None
+        # A resent batch whose rows were all stored already is a success, not an error
+        status = 201 if summary['created'] else 200 if summary['duplicates'] else 400
+        return Response(summary, status=status)
+
     @action(detail=False, methods=['post'], url_path='inject')
     def inject_readings(self, request):
         mode = request.data.get('device_mode')
@@ -501,20 +302,51 @@ class ReadingViewSet(viewsets.ModelViewSet):
         else:
             return Response({"error": "Invalid mode"}, status=400)
 
-        updated_count = 0
-        for reading in readings:
-            reading.temperature = round(random.uniform(temp_min, temp_max), 2)
-            reading.humidity = round(random.uniform(hum_min, hum_max), 2)
-            reading.save()
-            updated_count += 1
+        started = perf_counter()
+        updated_count = inject_random_values(readings, temp_min, temp_max, hum_min, hum_max)
+        rollups.rebuild(device_ids if mode != 'all' else None, start_time, end_time)
+        report_cache.invalidate(device_ids if mode != 'all' else None, start_time, end_time)
+        elapsed = perf_counter() - started
+
+        return Response({
+            "message": f"{updated_count} readings updated",
+            "updated": updated_count,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "rows_per_second": round(updated_count / elapsed) if elapsed else None,
+        })
 
-        return Response({"message": f"{updated_count} readings updated"})
 
 
+#Report jobs
+class ReportJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin, mixins.ListModelMixin,
+                       viewsets.GenericViewSet):
+    queryset = ReportJob.objects.all().order_by('-created_at')
+    serializer_class = ReportJobSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        jobs = super().get_queryset()
+        # A job's ZIP belongs to whoever queued it; staff can see every job
+        if self.request.user.is_staff:
+            return jobs
+        return jobs.filter(created_by=self.request.user)
+
+    def perform_create(self, serializer):
+        job = serializer.save(created_by=self.request.user)
+        transaction.on_commit(lambda: report_jobs.submit(job))
+
+    @action(detail=True, methods=['get'], url_path='download')
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'done':
+            return Response({'error': f'Report job is {job.status}'}, status=status.HTTP_409_CONFLICT)
+        return FileResponse(open(job.file_path, 'rb'), as_attachment=True, filename=f"reports_{job.id}.zip",
+                            content_type='application/zip')
+
 
 #Alarms
 class AlarmViewSet(viewsets.ModelViewSet):
-    queryset = Alarm.objects.all().order_by('-timestamp')
+    queryset = Alarm.objects.select_related('device').order_by('-timestamp', '-id')
     serializer_class = AlarmSerializer
 
     def get_queryset(self):
@@ -531,6 +363,44 @@ class AlarmViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(active=active.lower() == 'true')
 
         return queryset
+
+    def list(self, request, *args, **kwargs):
+        cursor = request.query_params.get('cursor')
+        page_size = request.query_params.get('page_size')
+        if not (cursor or page_size):
+            # Without paging parameters the list stays a plain array, as the frontend expects
+            return super().list(request, *args, **kwargs)
+        alarms = self.get_queryset()
+        try:
+            if cursor:
+                alarms = streaming.before_cursor(alarms, cursor)
+            page_size = min(int(page_size or streaming.MAX_PAGE_SIZE), streaming.MAX_PAGE_SIZE)
+            if page_size < 1:
+                raise ValueError
+        except ValueError:
+            return Response({'error': 'Invalid cursor or page_size'}, status=400)
+        page = list(alarms[:page_size + 1])
+        next_cursor = None
+        if len(page) > page_size:
+            page = page[:page_size]
+            next_cursor = streaming.encode_cursor(page[-1].timestamp, page[-1].id)
+        return Response({'results': self.get_serializer(page, many=True).data, 'next': next_cursor})
+
+    def perform_update(self, serializer):
+        was_acknowledged = serializer.instance.acknowledged
+        previous = (serializer.instance.device_id, serializer.instance.alarm_type)
+        alarm = serializer.save()
+        if was_acknowledged != alarm.acknowledged or previous != (alarm.device_id, alarm.alarm_type):
+            if not was_acknowledged:
+                counters.add_alarms([previous], sign=-1)
+            if not alarm.acknowledged:
+                counters.add_alarms([(alarm.device_id, alarm.alarm_type)])
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        if not instance.acknowledged:
+            counters.add_alarms([(instance.device_id, instance.alarm_type)], sign=-1)
+
     def _create_disconnection_alarm(self, device):
         Alarm.objects.create(
             device=device,
@@ -553,9 +423,88 @@ class AlarmViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['patch'], url_path='acknowledge')
     def acknowledge(self, request, pk=None):
         alarm = self.get_object()
-        alarm.acknowledged = True
-        alarm.save()
+        with transaction.atomic():
+            if Alarm.objects.filter(pk=alarm.pk, acknowledged=False).update(acknowledged=True):
+                counters.add_alarms([(alarm.device_id, alarm.alarm_type)], sign=-1)
+                transaction.on_commit(lambda: live.publish_alarms([
+                    (alarm.device_id, alarm.alarm_type, 'acknowledged', alarm.triggered_value, alarm.timestamp),
+                ]))
+        AuditLog.objects.create(
+            user=request.user if request.user.is_authenticated else None,
+            action='ACK_ALARM',
+            model_name='Alarm',
+            object_id=str(alarm.id),
+            changes=f"Alarm {alarm.id} ({alarm.alarm_type}) on '{alarm.device.code}' acknowledged"
+        )
         return Response({'status': 'acknowledged'}, status=status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='acknowledge', url_name='bulk-acknowledge')
+    def bulk_acknowledge(self, request):
+        """Acknowledge every open alarm matching `ids`, `device`, `alarm_type`, `active`
+        and/or `before` (ISO timestamp) with one UPDATE and one audit entry.
+        """
+        ids = request.data.get('ids')
+        device_id = request.data.get('device')
+        alarm_type = request.data.get('alarm_type')
+        active = request.data.get('active')
+        before = request.data.get('before')
+        if ids is None and device_id is None and alarm_type is None and active is None and before is None:
+            return Response({'error': 'Give ids, device, alarm_type, active or before'}, status=400)
+
+        alarms = Alarm.objects.filter(acknowledged=False)
+        selection = []
+        if ids is not None:
+            if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+                return Response({'error': 'ids must be a list of integers'}, status=400)
+            alarms = alarms.filter(id__in=ids)
+            selection.append(f"ids={ids[:20]}{'...' if len(ids) > 20 else ''}")
+        if device_id is not None:
+            alarms = alarms.filter(device_id=device_id)
+            selection.append(f"device={device_id}")
+        if alarm_type is not None:
+            alarms = alarms.filter(alarm_type=alarm_type)
+            selection.append(f"alarm_type={alarm_type}")
+        if active is not None:
+            active = active if isinstance(active, bool) else str(active).lower() == 'true'
+            alarms = alarms.filter(active=active)
+            selection.append(f"active={active}")
+        if before is not None:
+            before_time = parse_datetime(str(before))
+            if before_time is None:
+                return Response({'error': 'before must be an ISO timestamp'}, status=400)
+            if timezone.is_naive(before_time):
+                before_time = timezone.make_aware(before_time)
+            alarms = alarms.filter(timestamp__lte=before_time)
+            selection.append(f"before={before_time.isoformat()}")
+
+        quote = connection.ops.quote_name
+        selected, params = alarms.values('id').query.sql_with_params()
+        with transaction.atomic():
+            # The rows this statement flipped are the ones counted down, so an alarm acknowledged
+            # concurrently by someone else is never subtracted twice
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"UPDATE {quote(Alarm._meta.db_table)} SET {quote('acknowledged')} = %s "
+                    f"WHERE {quote('id')} IN ({selected}) AND NOT {quote('acknowledged')} "
+                    f"RETURNING {quote('device_id')}, {quote('alarm_type')}",
+                    [True, *params],
+                )
+                acknowledged = cursor.fetchall()
+            counters.add_alarms(acknowledged, sign=-1)
+            transaction.on_commit(lambda: live.publish_alarms([
+                (device_id, alarm_type, 'acknowledged', None, None) for device_id, alarm_type in sorted(set(acknowledged))
+            ]))
+            updated = len(acknowledged)
+            if updated:
+                AuditLog.objects.create(
+                    user=request.user if request.user.is_authenticated else None,
+                    action='ACK_ALARM',
+                    model_name='Alarm',
+                    changes=f"{updated} alarms acknowledged ({', '.join(selection)})"
+                )
+        return Response({'acknowledged': updated}, status=status.HTTP_200_OK)
+
+
 class ManufacturerViewSet(viewsets.ModelViewSet):
     queryset = Manufacturer.objects.all()
     serializer_class = ManufacturerSerializer
@@ -600,13 +549,66 @@ from devices.models import Device, Reading, Alarm
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_stats(request):
-    device_count = Device.objects.count()
-    alarm_count = Alarm.objects.filter(acknowledged=False).count()
-    reading_count = Reading.objects.count()
+    """Totals from the materialized counters, so the cost doesn't grow with the tables.
 
-    return Response({
+    `?counts=approximate` takes the reading total from PostgreSQL's planner statistics
+    instead; `?breakdown=device,alarm_type` adds per-device and per-alarm-type figures.
+    """
+    device_count = Device.objects.count()
+    reading_count, alarm_count, by_alarm_type = counters.totals()
+    data = {
         'devices': device_count,
         'alarms': alarm_count,
         'readings': reading_count,
-    })
- 
\ No newline at end of file
+    }
+    if request.query_params.get('counts') == 'approximate':
+        estimate = counters.approximate_reading_count()
+        data['approximate'] = estimate is not None
+        if estimate is not None:
+            data['readings'] = estimate
+
+    breakdown = request.query_params.get('breakdown', '').split(',')
+    if 'device' in breakdown:
+        data['by_device'] = counters.by_device()
+    if 'alarm_type' in breakdown:
+        data['by_alarm_type'] = by_alarm_type
+    return Response(data)
+ 
+
+def _live_user(request):
+    # EventSource can't set an Authorization header, so the JWT may come as ?token=
+    token = request.GET.get('token')
+    if token:
+        authentication = JWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(token))
+        except (InvalidToken, AuthenticationFailed):
+            return None
+    return request.user if request.user.is_authenticated else None
+
+
+@require_GET
+def live_events(request):
+    """Server-Sent Events feed of new readings and alarm transitions, served from memory.
+
+    `?devices=1,2` limits it to those devices and `?kinds=readings` or `?kinds=alarms`
+    to one kind of event. Serve it from an ASGI server in production; under WSGI each
+    open stream holds a worker thread.
+    """
+    if _live_user(request) is None:
+        return JsonResponse({'error': 'Authentication required'}, status=401)
+    try:
+        devices = request.GET.get('devices')
+        device_ids = frozenset(int(i) for i in devices.split(',')) if devices else None
+    except ValueError:
+        return JsonResponse({'error': 'devices must be a comma-separated list of ids'}, status=400)
+    kinds = request.GET.get('kinds', ','.join(live.KINDS)).split(',')
+    if not kinds or not set(kinds) <= set(live.KINDS):
+        return JsonResponse({'error': 'kinds must be readings, alarms or both'}, status=400)
+
+    # An ASGI server needs an async iterator, a WSGI one a plain generator
+    events = live.astream if isinstance(request, ASGIRequest) else live.stream
+    response = StreamingHttpResponse(events(device_ids, kinds), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
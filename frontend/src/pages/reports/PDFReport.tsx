@@ -60,25 +60,10 @@ const accessToken = localStorage.getItem('access')
 
     try {
       if (selectionId === "All Devices") {
-        const response = await fetch(`/api/devices/report/all/?start=${start}&end=${end}`,{method:'GET',        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${accessToken}`, 
-        },});
-        if (!response.ok) throw new Error("Failed to generate all devices PDF");
-        const blob = await response.blob();
+        const blob = await runReportJob(null, start, end);
         downloadBlob(blob, "All_Devices_Report.zip");
       } else if (selectionId === "custom") {
-        const response = await fetch(`/api/devices/report/?start=${start}&end=${end}`, {
-          method: "POST",
-          headers: {
-            "Content-Type": "application/json",
-          'Authorization': `Bearer ${accessToken}`, 
-
-          },
-          body: JSON.stringify({ device_ids: selectedDeviceIds }),
-        });
-        if (!response.ok) throw new Error("Failed to generate custom report");
-        const blob = await response.blob();
+        const blob = await runReportJob(selectedDeviceIds.map(Number), start, end);
         downloadBlob(blob, "Custom_Devices_Report.zip");
       } else {
         const response = await fetch(`/api/devices/${selectionId}/report/?start=${start}&end=${end}`,{method:'GET',        headers: {
@@ -95,6 +80,31 @@ const accessToken = localStorage.getItem('access')
     }
   };
 
+  // Multi-device ZIPs are rendered by a background report job: queue it, poll it, then download it
+  const runReportJob = async (deviceIds: number[] | null, start: string, end: string) => {
+    const headers = {
+      'Content-Type': 'application/json',
+      'Authorization': `Bearer ${accessToken}`,
+    };
+    const created = await fetch("/api/report-jobs/", {
+      method: "POST",
+      headers,
+      body: JSON.stringify({ device_ids: deviceIds, start, end }),
+    });
+    if (!created.ok) throw new Error("Failed to queue the report job");
+    let job = await created.json();
+    while (job.status === "queued" || job.status === "running") {
+      await new Promise((resolve) => setTimeout(resolve, 2000));
+      const response = await fetch(`/api/report-jobs/${job.id}/`, { method: 'GET', headers });
+      if (!response.ok) throw new Error("Failed to check the report job");
+      job = await response.json();
+    }
+    if (job.status !== "done") throw new Error(job.error || `Report job ${job.status}`);
+    const response = await fetch(`/api/report-jobs/${job.id}/download/`, { method: 'GET', headers });
+    if (!response.ok) throw new Error("Failed to download the reports");
+    return response.blob();
+  };
+
   const downloadBlob = (blob: Blob, filename: string) => {
     const url = window.URL.createObjectURL(blob);
     const a = document.createElement("a");